@@ -0,0 +1,119 @@
+"""numba版カーネル（cta.kernels から numba バックエンド選択時のみ読み込まれる）。
+
+各関数は strategy / engine の参照実装と同じ演算を同じ順序で行う。
+numba が無ければ import 時に ImportError になり、numpy にフォールバックする。
+"""
+import numba
+import numpy as np
+
+# error_model="numpy": 0除算は例外でなくNaN/infにする（NumPyの参照実装と同じ）
+_jit = numba.njit(cache=True, nogil=True, error_model="numpy")
+
+
+@_jit
+def ewma(panel, a, b, prev, out):
+    """strategy.ewma の本体。panel [T,M]、a=2/(span+1)、b=1-a（列ごと）。
+
+    prev は再帰の初期状態 [M]（NaN=未開始）で、最終バーの状態に更新する。
+    結果は out（NaNで初期化済み、panelと同じdtype）に書き込む。"""
+    T, M = panel.shape
+    for i in range(T):
+        for j in range(M):
+            v = panel[i, j]
+            if not np.isnan(v):
+                if np.isnan(prev[j]):
+                    prev[j] = v
+                else:
+                    prev[j] = a[j] * v + b[j] * prev[j]
+            out[i, j] = prev[j]
+    return out
+
+
+@_jit
+def trailing_vol(panel, center, window, ann, h1, h2, hn, rows0):
+    """strategy.trailing_vol の本体。center は列ごとの中心化定数、ann=sqrt(bpy)。
+
+    h1 / h2 / hn は持ち越した累積和の末尾（P+1 行、最終行がこのチャンクの起点）、
+    rows0 は処理済み本数。累積和を参照実装（np.cumsum）と同じ順に積み、窓の
+    差分から分散を求める。Returns: (out, c1, c2, cn)（累積和は持ち越し込み）"""
+    T, N = panel.shape
+    P = h1.shape[0] - 1
+    out = np.full((T, N), np.nan)
+    c1 = np.zeros((P + T + 1, N))
+    c2 = np.zeros((P + T + 1, N))
+    cn = np.zeros((P + T + 1, N), dtype=np.int64)
+    c1[:P + 1] = h1
+    c2[:P + 1] = h2
+    cn[:P + 1] = hn
+    for i in range(T):
+        for j in range(N):
+            v = panel[i, j]
+            if np.isnan(v):
+                c1[P + i + 1, j] = c1[P + i, j]
+                c2[P + i + 1, j] = c2[P + i, j]
+                cn[P + i + 1, j] = cn[P + i, j]
+            else:
+                z = v - center[j]
+                c1[P + i + 1, j] = c1[P + i, j] + z
+                c2[P + i + 1, j] = c2[P + i, j] + z * z
+                cn[P + i + 1, j] = cn[P + i, j] + 1
+    for i in range(max(window - rows0, 0), T):
+        k = P + i
+        for j in range(N):
+            n = cn[k, j] - cn[k - window, j]
+            if n < window // 2:
+                continue
+            if n == 1:
+                out[i, j] = 0.0
+                continue
+            mean = (c1[k, j] - c1[k - window, j]) / n
+            var = max((c2[k, j] - c2[k - window, j]) / n - mean * mean, 0.0)
+            out[i, j] = np.sqrt(var) * ann
+    return out, c1, c2, cn
+
+
+@_jit
+def mark_bar(qty, cash, funding, px, px_prev, rate, conservative, has_prev,
+             pnl, weight):
+    """エンジンのバーごと会計（funding授受→時価評価→資産別PnL・実現ウェイト）。
+
+    qty / rate / pnl / weight は [S,N]、cash / funding（累計）は [S]。
+    シナリオごとに参照実装と同じ順で加算し、cash・funding・pnl・weight は
+    その場で更新する。Returns: equity [S]"""
+    S, N = qty.shape
+    eq = np.empty(S)
+    for s in range(S):
+        c = cash[s]
+        f = funding[s]
+        for j in range(N):
+            p = px[j]
+            q = qty[s, j]
+            r = rate[s, j]
+            if np.isnan(p) or q == 0.0 or r == 0.0:
+                continue
+            notional = q * p
+            if conservative[j]:
+                cost = abs(notional) * abs(r)
+            else:
+                cost = notional * r
+            c -= cost
+            f += cost
+            pnl[s, j] -= cost
+        cash[s] = c
+        funding[s] = f
+        mtm = 0.0
+        for j in range(N):
+            if not np.isnan(px[j]):
+                mtm += qty[s, j] * px[j]
+        e = c + mtm
+        eq[s] = e
+        for j in range(N):
+            q = qty[s, j]
+            p = px[j]
+            if q == 0.0 or np.isnan(p):
+                continue
+            if has_prev and not np.isnan(px_prev[j]):
+                pnl[s, j] += q * (p - px_prev[j])
+            if e > 0:
+                weight[s, j] = q * p / e
+    return eq
@@ -0,0 +1,212 @@
+"""シグナル・volの前計算キャッシュ。
+
+sig（トレンドシグナル）と vol（trailing vol）は終値パネルと
+ホライズン・vol窓・足種だけで決まり、コスト倍率・期間・target_vol には
+依存しない。検証ゲート（walk-forward 5窓・コストストレス 1x/3x/5x・感応度）は
+同じ配列を何度も作り直していたため、
+  キー = 終値パネルの指紋(sha1) + 銘柄 + パラメータ
+で引けるキャッシュを置く。
+
+  - 既定はプロセス内LRU（合計バイト数で上限、古いものから追い出し）
+  - set_disk_dir() で .npz のディスク層を有効化（out/cache/ 等。合計サイズ上限、
+    最終アクセスの古いファイルから削除）。プロセスをまたいで再利用できる。
+    ディスク層のファイル名にはコードの版（code_version）とカーネルの
+    バックエンドを足すので、strategy.py 等を直すと前の実行の配列は引かない
+    （版が分からない＝git が使えないときはディスク層を使わない）
+
+返す配列は読み取り専用（呼び出し側の書き換えでキャッシュが汚れないように）。
+"""
+import collections
+import functools
+import hashlib
+import json
+import os
+import subprocess
+
+import numpy as np
+
+from . import kernels
+
+DEFAULT_MEMORY_BYTES = 512 * 2**20
+DEFAULT_DISK_BYTES = 2 * 2**30
+# 結果に効くコード（git の pathspec）。レポートの見た目は結果を変えない
+_CODE_PATHS = ("cta", ":(exclude)cta/report.py")
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@functools.lru_cache(maxsize=None)
+def code_version(root=_ROOT):
+    """結果に効くコードの版（取り込んだ時点の値をプロセス内で使い回す）。
+
+    _CODE_PATHS を最後に変えたコミットに、未コミットの差分・未追跡ファイルが
+    あればその指紋を足す。git が使えなければ None。"""
+    def git(*args):
+        return subprocess.check_output(["git", *args, "--", *_CODE_PATHS],
+                                       cwd=root, stderr=subprocess.DEVNULL)
+    try:
+        head = git("log", "-1", "--format=%H").decode().strip()
+        diff = git("diff", "HEAD")
+        untracked = [n for n in git("ls-files", "--others", "--exclude-standard",
+                                    "-z").split(b"\0") if n]
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    if not head:
+        return None
+    if not diff and not untracked:
+        return head[:12]
+    h = hashlib.sha1(diff)
+    for name in untracked:
+        h.update(name)
+        with open(os.path.join(root, name.decode()), "rb") as f:
+            h.update(f.read())
+    return f"{head[:12]}+{h.hexdigest()[:12]}"
+
+
+def fingerprint(arr):
+    """配列の内容指紋（dtype・形状込みのsha1）。"""
+    arr = np.ascontiguousarray(arr)
+    h = hashlib.sha1(f"{arr.dtype.str}{arr.shape}".encode())
+    h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def make_key(kind, **parts):
+    """種別とパラメータからキー文字列を作る（順序非依存・JSONで正規化）。"""
+    body = json.dumps(parts, sort_keys=True, default=str)
+    return f"{kind}-" + hashlib.sha1(body.encode()).hexdigest()[:24]
+
+
+def evict_lru(directory, max_bytes, suffix=".npz"):
+    """directory 内の *suffix ファイルの合計が max_bytes 以下になるまで、
+    最終アクセス（mtime）の古いものから消す。"""
+    files = []
+    for name in os.listdir(directory):
+        if name.endswith(suffix):
+            try:
+                st = os.stat(os.path.join(directory, name))
+            except OSError:        # 他プロセスが先に消した
+                continue
+            files.append((st.st_mtime, st.st_size, name))
+    total = sum(f[1] for f in files)
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
+
+
+class ArrayCache:
+    """合計バイト数で上限を持つ配列LRU（任意で.npzディスク層付き）。"""
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, disk_dir=None,
+                 max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._mem = collections.OrderedDict()
+        self._nbytes = 0
+        self.hits = self.misses = 0
+        self.misses_by_kind = collections.Counter()   # キーの種別（"sig" 等）ごと
+
+    def __len__(self):
+        return len(self._mem)
+
+    def clear(self):
+        self._mem.clear()
+        self._nbytes = 0
+
+    def get(self, key):
+        arr = self._mem.get(key)
+        if arr is not None:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return arr
+        arr = self._disk_get(key)
+        if arr is not None:
+            self.hits += 1
+            self._remember(key, arr)
+            return arr
+        self.misses += 1
+        self.misses_by_kind[key.split("-", 1)[0]] += 1
+        return None
+
+    def put(self, key, arr):
+        arr = np.array(arr)            # キャッシュ専用の複製
+        arr.flags.writeable = False
+        self._remember(key, arr)
+        self._disk_put(key, arr)
+        return arr
+
+    def get_or_compute(self, key, fn):
+        arr = self.get(key)
+        if arr is None:
+            arr = self.put(key, fn())
+        return arr
+
+    # --- メモリ層 -------------------------------------------------------
+    def _remember(self, key, arr):
+        if arr.nbytes > self.max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._nbytes -= old.nbytes
+        self._mem[key] = arr
+        self._nbytes += arr.nbytes
+        while self._nbytes > self.max_bytes:
+            _, ev = self._mem.popitem(last=False)
+            self._nbytes -= ev.nbytes
+
+    # --- ディスク層 -----------------------------------------------------
+    def _path(self, key):
+        """ディスク層のファイル名（コードの版が分からなければ None＝使わない）。"""
+        code = code_version()
+        if not self.disk_dir or code is None:
+            return None
+        tag = hashlib.sha1(f"{code}/{kernels.backend()}".encode()).hexdigest()[:12]
+        return os.path.join(self.disk_dir, f"{key}-{tag}.npz")
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            with np.load(path) as z:
+                arr = z["arr"]
+        except (OSError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(path)             # LRU順はmtimeで管理
+        except OSError:                # 読んだ直後に他プロセスの上限管理が消した
+            pass
+        arr.flags.writeable = False
+        return arr
+
+    def _disk_put(self, key, arr):
+        path = self._path(key)
+        if path is None:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"   # 並列ワーカー同士で衝突しない
+        with open(tmp, "wb") as f:
+            np.savez(f, arr=arr)
+        os.replace(tmp, path)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        evict_lru(self.disk_dir, self.max_disk_bytes)
+
+
+_default = ArrayCache()
+
+
+def default_cache():
+    return _default
+
+
+def set_disk_dir(path, max_disk_bytes=DEFAULT_DISK_BYTES):
+    """既定キャッシュに.npzのディスク層を付ける（Noneで無効化）。"""
+    _default.disk_dir = path
+    _default.max_disk_bytes = max_disk_bytes
@@ -42,6 +42,16 @@ class Config:
     #   必ず別の値を明示すること。共有すると別ユニバースの保有が混ざり、
     #   Portfolio.equity が価格の無い銘柄で落ちる（2026-08-15に実際に発生）。
     state_prefix: str = ""
+    # 計算カーネルのバックエンド（numpy / numba / auto）。空なら環境変数
+    # CTA_KERNEL_BACKEND に従う。numba が無い環境では黙って numpy になる
+    kernel_backend: str = ""
+    # バックテストの [T,N] 系列の保持精度（float64 / float32）。float32 は大きな
+    # ユニバース・1H足向けの省メモリモード（現金・equityはfloat64のまま）
+    storage_dtype: str = "float64"
+    # バックテストのバーループ（bar / event）。event はリバランス・約定・
+    # ブレーカー発動のあるバーだけをPythonで回し、その間の時価評価を
+    # 一括で行う（結果は bar とビット単位で一致。リバランス間隔が長いほど速い）
+    engine_mode: str = "bar"
 
     @property
     def is_etf(self):
@@ -125,4 +135,7 @@ def load_config(path):
         integer_shares=cp.getboolean("strategy", "integer_shares", fallback=False),
         lot_sizes=lot_sizes,
         state_prefix=cp.get("data", "state_prefix", fallback="").strip(),
+        kernel_backend=cp.get("engine", "backend", fallback="").strip(),
+        storage_dtype=cp.get("engine", "dtype", fallback="float64").strip(),
+        engine_mode=cp.get("engine", "mode", fallback="bar").strip(),
     )
@@ -3,6 +3,7 @@
 原則: バックテストは必ずローカルキャッシュ経由（APIレート制限に触れない）。
 追加取得はバックオフ付きでキャッシュへ追記する。
 """
+import hashlib
 import os
 import pickle
 import sqlite3
@@ -12,28 +13,46 @@ import numpy as np
 import pandas as pd
 
 
-def load_ohlcv(db_path, symbol, timeframe_min):
-    """キャッシュからOHLCVを読み、close_time(UTC epoch秒)インデックスのDataFrameで返す。"""
+def load_ohlcv(db_path, symbol, timeframe_min, since_epoch=None):
+    """キャッシュからOHLCVを読み、close_time(UTC epoch秒)インデックスのDataFrameで返す。
+
+    since_epoch を指定すると close_time がそれ以降のバーだけを読む。"""
     con = sqlite3.connect(db_path)
     df = pd.read_sql_query(
         """SELECT close_time, open_price AS open, high_price AS high,
                   low_price AS low, close_price AS close, volume
-           FROM candles WHERE symbol=? AND time_frame=?
+           FROM candles WHERE symbol=? AND time_frame=? AND close_time>=?
            ORDER BY close_time""",
-        con, params=(symbol, timeframe_min))
+        con, params=(symbol, timeframe_min,
+                     -1 if since_epoch is None else int(since_epoch)))
     con.close()
     df = df.drop_duplicates(subset="close_time").set_index("close_time")
     return df
 
 
-def load_universe(db_path, symbols, timeframe_min):
+def history_fingerprint(db_path, symbols, timeframe_min, until_epoch):
+    """close_time が until_epoch 以前のキャッシュ行の指紋（シグナル状態の突合用）。
+
+    銘柄ごとの行数・終値の和・時刻で重み付けした終値の和を SQLite の集計で求める
+    （履歴を DataFrame に読み込まない）。途中の終値の修正・行の追加や削除で変わる。"""
+    con = sqlite3.connect(db_path)
+    rows = [con.execute(
+        """SELECT COUNT(*), TOTAL(close_price), TOTAL(close_price * close_time)
+           FROM candles WHERE symbol=? AND time_frame=? AND close_time<=?""",
+        (s, timeframe_min, int(until_epoch))).fetchone() for s in symbols]
+    con.close()
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+
+def load_universe(db_path, symbols, timeframe_min, since_epoch=None):
     """全銘柄を共通の時間グリッド（union）に整列。上場前はNaN（weight 0扱い）。
 
     intersection でなく union を使うのは、後発上場資産（XAUT等）を含めつつ
-    先発資産の弱気相場履歴（2021-2022）を捨てないため。"""
+    先発資産の弱気相場履歴（2021-2022）を捨てないため。
+    since_epoch を指定するとそれ以降のバーだけを読む（逐次更新用）。"""
     frames = {}
     for s in symbols:
-        df = load_ohlcv(db_path, s, timeframe_min)
+        df = load_ohlcv(db_path, s, timeframe_min, since_epoch)
         if df.empty:
             raise ValueError(f"no cached data for {s}")
         frames[s] = df
@@ -56,6 +75,18 @@ def load_funding(pkl_path, symbols, times, timeframe_min, default_annual):
     T, N = len(times), len(symbols)
     rates = np.zeros((T, N))
     conservative = np.zeros(N, dtype=bool)
+    for j, col, cons in funding_columns(pkl_path, symbols, times, timeframe_min,
+                                        default_annual):
+        rates[:, j] = col
+        conservative[j] = cons
+    return rates, conservative
+
+
+def funding_columns(pkl_path, symbols, times, timeframe_min, default_annual):
+    """load_funding() の銘柄ごと版: (j, レート [T], conservative) を銘柄順に返す。
+
+    [T,N] の行列を作らないので、長い履歴をメモリマップへ書き出すときに使う。"""
+    T = len(times)
     hist = {}
     if pkl_path and os.path.exists(pkl_path):
         with open(pkl_path, "rb") as f:
@@ -64,6 +95,7 @@ def load_funding(pkl_path, symbols, times, timeframe_min, default_annual):
     bars_per_year = 365 * 24 * 60 // timeframe_min
     for j, sym in enumerate(symbols):
         h = hist.get(sym) or []
+        col = np.zeros(T)
         if len(h) > 0:
             ep = np.array([x[0] for x in h])
             rt = np.array([x[1] for x in h])
@@ -71,11 +103,11 @@ def load_funding(pkl_path, symbols, times, timeframe_min, default_annual):
             pos = np.searchsorted(times, ep, side="left")
             for k, p in enumerate(pos):
                 if 0 <= p < T and times[p] - step < ep[k] <= times[p]:
-                    rates[p, j] += rt[k]
+                    col[p] += rt[k]
+            yield j, col, False
         else:
-            rates[:, j] = default_annual.get(sym, 0.05) / bars_per_year
-            conservative[j] = True
-    return rates, conservative
+            col[:] = default_annual.get(sym, 0.05) / bars_per_year
+            yield j, col, True
 
 
 def fetch_and_cache(db_path, symbol, timeframe_min, since_epoch, until_epoch,
@@ -14,49 +14,49 @@ from . import execution as ex
 from . import strategy as st
 
 
-def compute_signals(cfg, closes, t):
-    """時点tのトレンドシグナルと実現volを返す。t以前の確定バーのみ使用。"""
+def compute_signals(cfg, closes, t, signal_state=None):
+    """時点tのトレンドシグナル・実現vol・共分散窓を返す。t以前の確定バーのみ使用。
+
+    signal_state（時点tまで更新済みの IncrementalSignalState）を渡すと、
+    全履歴を計算し直さずにその値を使う（4H cronの判断を即時にするため）。
+    Returns: (sig_t, vol_t, rets_window[W,N])
+    """
+    W = cfg.vol_window_days * cfg.bars_per_day
+    if signal_state is not None:
+        return signal_state.signal(), signal_state.vol(), signal_state.rets_window()
     bpd, bpy = cfg.bars_per_day, cfg.bars_per_year
     logc = np.log(closes)
     rets = np.vstack([np.full((1, closes.shape[1]), np.nan),
                       np.diff(logc, axis=0)])
     horizons = [(f * bpd, s * bpd) for f, s in cfg.horizons_days]
-    sig_t = np.array([st.trend_signal(logc[:t + 1, j], horizons)[-1]
-                      for j in range(closes.shape[1])])
-    vol_t = np.array([st.trailing_vol(rets[:t + 1, j],
-                                      cfg.vol_window_days * bpd, bpy)[-1]
-                      for j in range(closes.shape[1])])
-    return sig_t, vol_t, rets
+    sig_t = st.trend_signal_panel(logc[:t + 1], horizons)[-1]
+    vol_t = st.trailing_vol(rets[:t + 1], W, bpy)[-1]
+    return sig_t, vol_t, rets[t - W:t]
 
 
 def plan_orders(cfg, closes, t, positions, equity, vol_scale, cost_model,
-                prices=None):
+                prices=None, signal_state=None):
     """時点tのリバランス注文を組み立てて返す。
 
     positions: {symbol: qty} 現在の保有（実発注では取引所の実残を渡すこと）
     prices:    発注可否の判定に使う価格。Noneならバー終値を使う。
+    signal_state: compute_signals() 参照。
     Returns: list[ex.Order]
     """
-    bpd, bpy = cfg.bars_per_day, cfg.bars_per_year
-    sig_t, vol_t, rets = compute_signals(cfg, closes, t)
-    w = st.target_weights(sig_t, vol_t,
-                          rets[t - cfg.vol_window_days * bpd:t],
-                          cfg.target_vol * vol_scale, cfg.max_gross, bpy,
-                          long_only=cfg.long_only)
-    orders = []
-    for j, sym in enumerate(cfg.symbols):
-        px = closes[t, j]
-        if np.isnan(px) or px <= 0:
-            continue
-        if prices is not None and sym not in prices:
-            continue
-        od = ex.plan_rebalance(sym, positions.get(sym, 0.0), w[j] * equity,
-                               px, equity, cost_model, cfg.no_trade_band_pct,
-                               integer_shares=cfg.integer_shares,
-                               lot_size=cfg.lot_size(sym))
-        if od is not None:
-            orders.append(od)
-    return orders
+    sig_t, vol_t, rets_window = compute_signals(cfg, closes, t, signal_state)
+    w = st.target_weights(sig_t, vol_t, rets_window,
+                          cfg.target_vol * vol_scale, cfg.max_gross,
+                          cfg.bars_per_year, long_only=cfg.long_only)
+    px = np.asarray(closes[t], dtype=float)
+    if prices is not None:
+        # 発注可否の価格が取れない銘柄は触らない
+        px = np.where([sym in prices for sym in cfg.symbols], px, np.nan)
+    cur = [positions.get(sym, 0.0) for sym in cfg.symbols]
+    delta, mask = ex.plan_rebalance_batch(
+        cur, w * equity, px, equity, cost_model, cfg.no_trade_band_pct,
+        integer_shares=cfg.integer_shares,
+        lot_sizes=[cfg.lot_size(sym) for sym in cfg.symbols])
+    return ex.orders_from_batch(cfg.symbols, delta, mask, px)
 
 
 def plan_flatten_orders(positions, signal_prices, reason="circuit_breaker"):
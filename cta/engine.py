@@ -10,9 +10,13 @@ from dataclasses import dataclass, field
 
 import numpy as np
 
-from . import data as data_mod
+from . import cache as cache_mod
 from . import execution as ex
+from . import kernels
 from . import strategy as st
+from .fill_log import FillLog
+from .market import MarketData
+from .metrics import RunningEquityStats
 
 
 @dataclass
@@ -22,7 +26,7 @@ class BacktestResult:
     weights: np.ndarray        # [T,N] 実現ウェイト（時価/equity）
     pos_qty: np.ndarray        # [T,N]
     asset_pnl: np.ndarray      # [T,N] バーごと資産別PnL（コスト込み）
-    fills: list = field(default_factory=list)
+    fills: FillLog = None      # 約定（列指向。list[Fill] と同様に扱える）
     symbols: list = field(default_factory=list)
     fees_usd: float = 0.0
     funding_usd: float = 0.0
@@ -30,160 +34,705 @@ class BacktestResult:
     turnover_usd: float = 0.0
     halted_at: float = None    # サーキットブレーカー発動epoch（未発動ならNone）
     config_sha1: str = ""
+    snapshots: list = field(default_factory=list)  # snapshot_at で取った EngineSnapshot
+    # 記録レベル（RECORD_LEVELS）。full 以外では記録しなかった系列が None で、
+    # compute_metrics に要る集計は stats に入る
+    record: str = "full"
+    stats: dict = None
+
+    def __post_init__(self):
+        if not isinstance(self.fills, FillLog):
+            self.fills = FillLog.from_fills(self.symbols, self.fills or [])
 
     def slice(self, t0, t1):
-        """[t0, t1) のepoch範囲でビューを返す（メトリクス窓別計算用）。"""
-        m = (self.times >= t0) & (self.times < t1)
-        r = BacktestResult(self.times[m], self.equity[m], self.weights[m],
-                           self.pos_qty[m], self.asset_pnl[m],
-                           [f for f in self.fills if t0 <= f.ts < t1],
-                           self.symbols)
-        return r
+        """[t0, t1) のepoch範囲のビューを返す（メトリクス窓別計算用）。
+
+        times は昇順なので searchsorted で境界を引き、配列・fillsとも
+        元の結果とメモリを共有する（コピーしない）。"""
+        a, b = self._bounds([t0, t1])
+        return self._view(a, b, t0, t1)
+
+    def windows(self, boundaries):
+        """連続する期間 [b0,b1), [b1,b2), ... のビューを順に返す。
+
+        boundaries は昇順のepoch列。境界は1回の searchsorted でまとめて引く。"""
+        idx = self._bounds(boundaries)
+        for i in range(len(idx) - 1):
+            yield self._view(idx[i], idx[i + 1], boundaries[i], boundaries[i + 1])
+
+    def _bounds(self, epochs):
+        if self.record != "full":
+            raise ValueError(f"slice needs record='full' (got {self.record!r})")
+        return np.searchsorted(self.times, epochs).tolist()
+
+    def _view(self, a, b, t0, t1):
+        return BacktestResult(self.times[a:b], self.equity[a:b], self.weights[a:b],
+                              self.pos_qty[a:b], self.asset_pnl[a:b],
+                              self.fills.between(t0, t1), self.symbols)
+
+
+@dataclass
+class EngineSnapshot:
+    """1シナリオ分のバーループの全状態。run_backtest(resume=...) で続きから回せる。
+
+    time までのバーを処理し終えた時点の状態（次に処理するのは time の次のバー）。
+    begin_time はそのシナリオの開始バー（リバランスの位相と前計算の起点）。
+    fees_usd などの累計と n_fills は開始からの通算。"""
+    time: float
+    begin_time: float
+    symbols: list
+    cash_usd: float
+    qty: np.ndarray                # [N]
+    peak: float
+    halted: bool
+    halted_at: float               # 未発動ならNone
+    pend_qty: np.ndarray           # [N] 次バー始値で執行する注文
+    pend_sig: np.ndarray           # [N]
+    pend_mask: np.ndarray          # [N] bool
+    pend_reason: str
+    fees_usd: float = 0.0
+    funding_usd: float = 0.0
+    slippage_usd: float = 0.0
+    turnover_usd: float = 0.0
+    n_fills: int = 0
+    config_sha1: str = ""
+
+    _ARRAYS = ("qty", "pend_qty", "pend_sig", "pend_mask")
+
+    def save(self, path):
+        """.npz に保存する（浮動小数はそのままの精度で残る）。"""
+        d = dict(vars(self))
+        d["symbols"] = np.array(self.symbols, dtype=str)
+        d["halted_at"] = np.nan if self.halted_at is None else self.halted_at
+        np.savez(path, **d)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            d = {k: z[k] for k in z.files}
+        for k, v in d.items():
+            if k not in cls._ARRAYS:
+                d[k] = v.item() if v.ndim == 0 else v
+        d["symbols"] = [str(s) for s in d["symbols"]]
+        d["halted"] = bool(d["halted"])
+        if np.isnan(d["halted_at"]):
+            d["halted_at"] = None
+        return cls(**d)
+
+
+def signal_and_vol(logc, rets, symbols, horizons_bars, vol_window, bpy, cache=None,
+                   logc_fp=None):
+    """対数終値・リターンからトレンドシグナルとtrailing volを作る（キャッシュ経由）。
+
+    どちらも終値・ホライズン・vol窓だけで決まるので、対数終値の指紋と
+    パラメータをキーに cache（既定はプロセス共有のLRU）から引く。
+    logc_fp: 計算済みの指紋（MarketData.fingerprint）があれば渡す。"""
+    if cache is None:
+        cache = cache_mod.default_cache()
+    fp = logc_fp or cache_mod.fingerprint(logc)
+    sig = cache.get_or_compute(
+        cache_mod.make_key("sig", logc=fp, symbols=list(symbols),
+                           horizons_bars=[list(h) for h in horizons_bars]),
+        lambda: st.trend_signal_panel(logc, horizons_bars))
+    vol = cache.get_or_compute(
+        cache_mod.make_key("vol", logc=fp, symbols=list(symbols),
+                           vol_window=vol_window, bpy=bpy),
+        lambda: st.trailing_vol(rets, vol_window, bpy))
+    return sig, vol
+
+
+def unit_weight_path_cached(logc, rets, symbols, horizons_bars, vol_window, bpy, bars,
+                            long_only=False, cache=None, logc_fp=None):
+    """逆vol配分の前計算 (w_unit [T,N], pvol [T]) をキャッシュ経由で得る。
+
+    w_unit は終値・ホライズン・vol窓・long_only だけで決まり、pvol はさらに
+    リバランス対象バー bars（開始バー・終了バー）で決まる。どちらも target_vol・
+    コスト・ブレーカーには依存しないので、感応度分析の target_vol 違いや
+    別バッチのシナリオで共有できる。walk-forward の窓どうしは w_unit を共有し、
+    pvol（共分散の経路）だけを窓ごとに作る。キャッシュに無いときだけ
+    sig/vol（signal_and_vol）と共分散の経路を計算する。"""
+    if cache is None:
+        cache = cache_mod.default_cache()
+    fp = logc_fp or cache_mod.fingerprint(logc)
+    bars = np.asarray(bars, dtype=int)
+    parts = dict(logc=fp, symbols=list(symbols),
+                 horizons_bars=[list(h) for h in horizons_bars],
+                 vol_window=vol_window, bpy=bpy, long_only=long_only)
+    w_key = cache_mod.make_key("unitw", **parts)
+    w_unit = cache.get(w_key)
+    if w_unit is None:
+        sig, vol = signal_and_vol(logc, rets, symbols, horizons_bars, vol_window,
+                                  bpy, cache, fp)
+        w_unit = cache.put(w_key, st.unit_weights(sig, vol, long_only=long_only))
+    p_key = cache_mod.make_key("pvol", bars=cache_mod.fingerprint(bars), **parts)
+    pvol = cache.get(p_key)
+    if pvol is None:
+        _, pvol = st.unit_weight_path(None, None, rets, vol_window, bpy, bars,
+                                      w_unit=w_unit)
+        pvol = cache.put(p_key, pvol)
+    return w_unit, pvol
+
+
+def unit_path_chunk(cfg, closes, g0, state):
+    """チャンク分割・再開用の前計算: 通し番号 g0 行目以降の逆vol配分の経路を、
+    state（それより前の行を処理したシグナル・vol・共分散の状態）の続きから作る。
+
+    closes は lo = max(g0-1, 0) 行目からの終値 [g1-lo, N]（lo < g0 なら先頭行は
+    前バー終値としてだけ使う）。state は dict（{} で始め、全行を順に渡す）。
+    全履歴を回す run_backtest の前計算と丸めまで一致するので、resume= で
+    再開するときに全履歴の sig/vol/共分散を作り直さずに済む。
+    Returns: run_backtest_batch の unit_path（行番号は closes の先頭基準）。
+    g1 が開始バー（warmup）以前なら None（状態だけ進める）。"""
+    with kernels.use_backend(cfg.kernel_backend):
+        return _unit_path_chunk(cfg, closes, g0, state)
+
+
+def _unit_path_chunk(cfg, closes, g0, state):
+    bpd, bpy = cfg.bars_per_day, cfg.bars_per_year
+    horizons_bars = [(f * bpd, s * bpd) for f, s in cfg.horizons_days]
+    vw = cfg.vol_window_days * bpd
+    reb = max(1, cfg.rebalance_days * bpd)
+    tb = max(s for _, s in horizons_bars) + vw + 2    # run_backtest_batch と同じwarmup
+    closes = np.asarray(closes)
+    N = closes.shape[1]
+    lo = max(g0 - 1, 0)
+    g1 = lo + len(closes)
+    logc = np.log(closes)
+    rets = np.diff(logc, axis=0)
+    if lo == g0:
+        rets = np.vstack([np.full((1, N), np.nan, dtype=rets.dtype), rets])
+    sig = st.trend_signal_panel(logc[g0 - lo:], horizons_bars,
+                                state=state.setdefault("sig", {}))
+    vol = st.trailing_vol(rets, vw, bpy, state=state.setdefault("vol", {}))
+    first_due = tb + max(0, -(-(g0 - tb) // reb)) * reb
+    w_unit, pvol = st.unit_weight_path(
+        sig, vol, rets, vw, bpy, np.arange(first_due, g1, reb) - g0,
+        long_only=cfg.long_only, state=state.setdefault("cov", {}))
+    if g1 <= tb:
+        return None
+    if lo < g0:              # 前バー終値の行の分を詰める
+        w_unit = np.vstack([np.zeros((1, N), dtype=w_unit.dtype), w_unit])
+        pvol = np.r_[np.nan, pvol]
+    return tb - lo, w_unit, pvol
+
+
+# イベント駆動モードで1回にまとめて処理する最大バー数（一時配列 [L,S,N] の上限）
+_SPAN_MAX = 2048
+
+# バックテストの記録レベル:
+#   full    全系列（equity / weights / pos_qty / asset_pnl）と全fills
+#   equity  times / equity の系列だけ（[T,N] 系列とfillsは集計値のみ）
+#   summary 系列も持たず、equity の統計（metrics.RunningEquityStats で
+#           バー順に逐次集計。メモリは本数に依らない）と集計値のみ
+RECORD_LEVELS = ("full", "equity", "summary")
+
+# シナリオで変えられるパラメータ（run_backtest_batch の scenarios の各キー）
+SCENARIO_KEYS = ("target_vol", "cost_mult", "horizons_days", "vol_window_days",
+                 "no_trade_band_pct", "dd_soft", "dd_hard")
+
+
+def _mark_bar(qty, cash, funding, px, px_prev, rate, conservative, has_prev,
+              pnl, weight):
+    """バーごと会計: funding授受 → 時価評価 → 資産別PnL・実現ウェイトの記録。
+
+    全シナリオ×全銘柄まとめて配列で計算する参照実装（kernels の mark_bar と
+    同じ入出力）。qty / rate / pnl / weight は [S,N]、cash / funding（累計）は [S]
+    で、いずれもその場で更新する。価格NaN（上場前）の銘柄は評価から外す。
+    Returns: equity [S]"""
+    priced = ~np.isnan(px)
+    held = (qty != 0.0) & priced
+    live = held & (rate != 0.0)
+    if live.any():
+        cost = np.where(live, ex.funding_cost_usd(qty, px, rate, conservative), 0.0)
+        cash[:] = ex.sequential_sum(cash, -cost)
+        funding[:] = ex.sequential_sum(funding, cost)
+        pnl -= cost
+    notional = qty * px
+    eq = cash + ex.sequential_sum(0.0, np.where(priced, notional, 0.0))
+    if has_prev:
+        moved = held & ~np.isnan(px_prev)
+        pnl[moved] += (qty * (px - px_prev))[moved]
+    np.divide(notional, eq[:, None], out=weight, where=held & (eq > 0)[:, None])
+    return eq
+
+
+def _mark_span(qty, cash, funding, px, px_prev, rate, conservative, pnl, weight):
+    """_mark_bar() を L バー分まとめて行う（区間内は保有数量が変わらない前提）。
+
+    qty [S,N]・cash / funding [S] は区間開始時点の値（更新しない）。
+    px / px_prev は [L,N]、rate / pnl / weight は [L,S,N]（pnl・weightは0で渡す）。
+    現金・fundingはバー順×銘柄順に1本の列として逐次加算するので、
+    バーごとに _mark_bar を呼んだ場合と丸めまで一致する。
+    Returns: (equity [L,S], 各バー後の cash [L,S], 各バー後の funding [L,S])"""
+    L, S, N = rate.shape
+    priced = ~np.isnan(px)[:, None, :]
+    held = (qty != 0.0) & priced
+    live = held & (rate != 0.0)
+    cost = np.where(live, ex.funding_cost_usd(qty, px[:, None, :], rate,
+                                              conservative), 0.0)
+    paths = []
+    for start, sign in ((cash, -1.0), (funding, 1.0)):
+        acc = np.empty((S, L * N + 1))
+        acc[:, 0] = start
+        acc[:, 1:] = (sign * cost).transpose(1, 0, 2).reshape(S, L * N)
+        np.add.accumulate(acc, axis=1, out=acc)
+        paths.append(acc[:, N::N].T)
+    cash_path, funding_path = paths
+    notional = qty * px[:, None, :]
+    mtm = np.zeros((L, S, N + 1))
+    mtm[:, :, 1:] = np.where(priced, notional, 0.0)
+    eq = cash_path + np.add.accumulate(mtm, axis=2)[:, :, -1]
+    pnl -= cost
+    moved = held & ~np.isnan(px_prev)[:, None, :]
+    pnl[moved] += (qty * (px - px_prev)[:, None, :])[moved]
+    np.divide(notional, eq[:, :, None], out=weight,
+              where=held & (eq > 0)[:, :, None])
+    return eq, cash_path, funding_path
+
+
+def _resolve_scenario(cfg, scenario):
+    """シナリオ（SCENARIO_KEYS の部分dict）を cfg の既定値で埋める。"""
+    unknown = set(scenario) - set(SCENARIO_KEYS)
+    if unknown:
+        raise ValueError(f"unknown scenario keys {sorted(unknown)} "
+                         f"(choose from {SCENARIO_KEYS})")
+    sc = {k: scenario.get(k) for k in SCENARIO_KEYS}
+    sc["horizons_days"] = [tuple(h) for h in
+                           (sc["horizons_days"] or cfg.horizons_days)]
+    sc["vol_window_days"] = sc["vol_window_days"] or cfg.vol_window_days
+    for k, default in (("target_vol", cfg.target_vol), ("cost_mult", 1.0),
+                       ("no_trade_band_pct", cfg.no_trade_band_pct),
+                       ("dd_soft", cfg.dd_soft), ("dd_hard", cfg.dd_hard)):
+        if sc[k] is None:
+            sc[k] = default
+    return sc
 
 
 def run_backtest(cfg, start_epoch=None, end_epoch=None, cost_mult=1.0,
-                 target_vol=None, horizons_days=None, vol_window_days=None):
+                 target_vol=None, horizons_days=None, vol_window_days=None,
+                 cache=None, market=None, snapshot_at=(), resume=None,
+                 record="full", unit_path=None):
     """設定に基づいてバックテストを実行する。
 
     cost_mult: コストストレステスト用（手数料・slippage・fundingを一律倍率）
     target_vol / horizons_days / vol_window_days: 感応度分析用オーバーライド
+    cache: sig/vol のキャッシュ（cta.cache.ArrayCache。既定はプロセス共有）
+    market: 読み込み済みの MarketData（省略時は cfg に従ってDBから読む）
+    snapshot_at: 状態を保存するepochのリスト。各epoch以降の最初のバーを処理する
+                 直前の状態を EngineSnapshot として result.snapshots に入れる
+    resume: EngineSnapshot。warmupから再生せず、その続きのバーから回す
+            （結果の系列・fillsは再開後の分だけ。コスト等の累計は通算）。
+            シグナル・vol・共分散は因果的な再帰なので、unit_path を渡さなければ
+            market の全履歴から作る。再開点までの状態を持っている呼び出し側
+            （live_backtest）は、market を再開バーの直前から切り出し
+            （MarketData.rows）、unit_path_chunk の unit_path を渡す
+    record: 記録レベル（RECORD_LEVELS）。感応度分析のように指標しか使わない
+            呼び出しは "summary" で [T,N] 系列とfillsを持たずに済む
+            （compute_metrics の値は "full" と一致する。equity の統計は
+            系列を持たずに逐次集計する）
+    unit_path: run_backtest_batch と同じ（前計算済みの逆vol配分の経路）
+    """
+    scenario = {"cost_mult": cost_mult, "target_vol": target_vol,
+                "horizons_days": horizons_days, "vol_window_days": vol_window_days}
+    return run_backtest_batch(cfg, [scenario], start_epoch, end_epoch, cache,
+                              market, snapshot_at, resume, record, unit_path)[0]
+
+
+def run_backtest_batch(cfg, scenarios, start_epoch=None, end_epoch=None,
+                       cache=None, market=None, snapshot_at=(), resume=None,
+                       record="full", unit_path=None, windows=None):
+    """パラメータ違いの S 本のバックテストを1回のデータ読込・1本のバーループで回す。
+
+    scenarios: dict のリスト。キーは SCENARIO_KEYS（省略したキーは cfg の値）。
+    口座・注文・ブレーカーの状態を [S,N] / [S] の配列で持ち、全シナリオを
+    同じバーで一緒に進める。シグナル・vol・逆vol配分は horizons / vol窓が同じ
+    シナリオ間で共有する。各シナリオの結果は run_backtest() を個別に
+    呼んだ場合とビット単位で一致する。
+    market: 読み込み済みの MarketData（省略時は cfg に従ってDBから読む）
+    snapshot_at / resume: run_backtest() と同じ。resume は全シナリオ共通の
+        EngineSnapshot 1つか、シナリオ順のリスト（共通の前半期間から複数の
+        パラメータで分岐させる用途）
+    record: run_backtest() と同じ
+    unit_path: (開始バー, w_unit [T,N], pvol [T]) を外から与える（stream.py が
+        チャンクごとに逐次計算した前計算を渡す。開始バーは market の行番号で、
+        再開時は負にもなる＝リバランスの位相）。全シナリオで共有するので
+        ホライズン・vol窓は揃っていること
+    windows: シナリオごとの期間 (start_epoch, end_epoch) のリスト（None の端は
+        start_epoch / end_epoch）。walk-forward の窓を1本のバーループで回す用途で、
+        各窓は初期資本・新しいブレーカーから始まり、run_backtest(start, end) と
+        ビット単位で一致する。終了バー以降も他の窓と一緒に進むが、集計値は
+        終了バーの直前で凍結し、系列・fillsも終了バーまでに切る
+    Returns: シナリオ順の BacktestResult のリスト
     """
-    horizons_days = horizons_days or cfg.horizons_days
-    vol_window_days = vol_window_days or cfg.vol_window_days
-    target_vol = target_vol if target_vol is not None else cfg.target_vol
+    # config のバックエンド指定はこの実行の間だけ（後の呼び出しに残さない）
+    with kernels.use_backend(cfg.kernel_backend):
+        return _run_batch(cfg, scenarios, start_epoch, end_epoch, cache, market,
+                          snapshot_at, resume, record, unit_path, windows)
+
 
-    if cfg.is_etf:
-        from . import etf_data
-        times, opens_df, closes_df = etf_data.load_universe(cfg.db_path, cfg.symbols)
+def _run_batch(cfg, scenarios, start_epoch, end_epoch, cache, market, snapshot_at,
+               resume, record, unit_path, windows):
+    scs = [_resolve_scenario(cfg, sc) for sc in scenarios]
+    S = len(scs)
+    if S == 0:
+        return []
+    if record not in RECORD_LEVELS:
+        raise ValueError(f"record は {' / '.join(RECORD_LEVELS)}: {record!r}")
+    full, summary = record == "full", record == "summary"
+
+    if market is None:
+        market = MarketData.load(cfg)
     else:
-        times, opens_df, closes_df = data_mod.load_universe(
-            cfg.db_path, cfg.symbols, cfg.timeframe_min)
-    opens = opens_df.to_numpy(float)
-    closes = closes_df.to_numpy(float)
+        market.check(cfg)
+    # 省メモリモード（[engine] dtype=float32）では [T,N] の系列をfloat32で持つ。
+    # 現金・equity・約定計算はfloat64のまま（バー内の値はfloat64に戻して使う）
+    dtype = market.dtype
+    times, opens, closes = market.times, market.opens, market.closes
+    # 時価評価は closes_ff（上場前/欠損バーは直近有効終値で評価）
+    closes_ff, fr, fr_conservative = (market.closes_ff, market.funding,
+                                      market.conservative)
+    # シグナル・vol・リターンは終値のみ使用 → 判定は常にバー確定値
+    logc, rets = market.logc, market.rets
     T, N = closes.shape
     bpd, bpy = cfg.bars_per_day, cfg.bars_per_year
 
-    # 事前計算（シグナル・vol・リターンは終値のみ使用 → 判定は常にバー確定値）
-    logc = np.log(closes)
-    rets = np.vstack([np.full((1, N), np.nan), np.diff(logc, axis=0)])
-    horizons_bars = [(f * bpd, s * bpd) for f, s in horizons_days]
-    sig = np.column_stack([st.trend_signal(logc[:, j], horizons_bars)
-                           for j in range(N)])
-    vol = np.column_stack([st.trailing_vol(rets[:, j], vol_window_days * bpd, bpy)
-                           for j in range(N)])
-    if cfg.is_etf:
-        # ETFにfundingは無い（保有コストは信託報酬として価格に内包済み）
-        fr = np.zeros((T, N))
-        fr_conservative = np.zeros(N, dtype=bool)
+    reb = max(1, cfg.rebalance_days * bpd)
+    t_end = T if end_epoch is None else int(np.searchsorted(times, end_epoch))
+    t_start = 0 if start_epoch is None else int(np.searchsorted(times, start_epoch))
+    if resume is not None:
+        snaps = list(resume) if isinstance(resume, (list, tuple)) else [resume] * S
+        if len(snaps) != S:
+            raise ValueError(f"resume: {len(snaps)} snapshots for {S} scenarios")
+        t_resume = _resume_index(snaps, times, cfg.symbols)
+    if windows is None:
+        t_starts, t_stop = [t_start] * S, np.full(S, t_end)
     else:
-        fr, fr_conservative = data_mod.load_funding(
-            cfg.funding_pkl, cfg.symbols, times, cfg.timeframe_min,
-            cfg.funding_default_annual)
+        if len(windows) != S:
+            raise ValueError(f"windows: {len(windows)} windows for {S} scenarios")
+        if resume is not None or unit_path is not None or len(snapshot_at):
+            raise ValueError("windows cannot be combined with resume / unit_path / "
+                             "snapshot_at")
+        t_starts = [t_start if a is None else int(np.searchsorted(times, a))
+                    for a, _ in windows]
+        t_stop = np.array([t_end if b is None else int(np.searchsorted(times, b))
+                           for _, b in windows], dtype=int)
+        t_end = int(t_stop.max())
 
-    # 時価評価用: 上場前/欠損バーは直近有効終値で評価
-    closes_ff = closes_df.ffill().to_numpy(float)
+    # ホライズン・vol窓ごとの前計算（同じ組のシナリオで共有）。
+    # 逆vol配分とそのポートフォリオvolはtarget_vol・ブレーカーに依存しないので
+    # リバランス対象バーの分を一括で前計算し、バーループではスケールとキャップだけ掛ける
+    groups = {}
+    group_of = np.empty(S, dtype=int)
+    t_begin = np.empty(S, dtype=int)
+    if unit_path is not None and len({(tuple(sc["horizons_days"]),
+                                       sc["vol_window_days"]) for sc in scs}) > 1:
+        raise ValueError("unit_path: scenarios must share horizons and vol window")
+    for k, sc in enumerate(scs):
+        horizons_bars = [(f * bpd, s * bpd) for f, s in sc["horizons_days"]]
+        vw = sc["vol_window_days"] * bpd
+        if unit_path is not None:
+            tb = int(unit_path[0])
+        elif resume is None:
+            warmup = max(s for _, s in horizons_bars) + vw + 2
+            tb = max(warmup, t_starts[k])
+        else:
+            # 再開時は元の開始バーを使う（リバランス位相・共分散の逐次状態を揃える）
+            tb = int(np.searchsorted(times, snaps[k].begin_time))
+        key = (tuple(sc["horizons_days"]), sc["vol_window_days"], tb, int(t_stop[k]))
+        if key not in groups:
+            if unit_path is not None:
+                w_unit, pvol = unit_path[1:]
+            else:
+                w_unit, pvol = unit_weight_path_cached(
+                    logc, rets, cfg.symbols, horizons_bars, vw, bpy,
+                    np.arange(tb, t_stop[k], reb), cfg.long_only, cache,
+                    market.fingerprint)
+            groups[key] = (len(groups), tb, w_unit, pvol)
+        group_of[k], t_begin[k] = groups[key][:2]
+    unit_paths = [(w_unit, pvol) for _, _, w_unit, pvol in groups.values()]
+    # スナップショットに残す開始バーの時刻（再開時は元の値を引き継ぐ）
+    begin_time = ([float(sn.begin_time) for sn in snaps] if resume is not None
+                  else [float(times[min(tb, T - 1)]) for tb in t_begin])
 
-    cost_model = ex.CostModel(fee_rate=cfg.fee_rate * cost_mult,
-                              slip_rate=cfg.slip_rate * cost_mult,
-                              min_notional_usd=cfg.min_notional_usd)
-    breaker = st.CircuitBreaker(cfg.dd_soft, cfg.dd_hard)
-    pf = ex.Portfolio(cash_usd=cfg.init_capital_usd)
+    cost_mult = np.array([sc["cost_mult"] for sc in scs], dtype=float)
+    cost_models = [ex.CostModel(fee_rate=cfg.fee_rate * sc["cost_mult"],
+                                slip_rate=cfg.slip_rate * sc["cost_mult"],
+                                min_notional_usd=cfg.min_notional_usd)
+                   for sc in scs]
+    target_vol = [sc["target_vol"] for sc in scs]
+    band = np.array([sc["no_trade_band_pct"] for sc in scs], dtype=float)
+    dd_soft = np.array([sc["dd_soft"] for sc in scs], dtype=float)
+    dd_hard = np.array([sc["dd_hard"] for sc in scs], dtype=float)
+    peak, halted = np.full(S, -np.inf), np.zeros(S, dtype=bool)
+    book = ex.ArrayPortfolio(cfg.symbols, cfg.init_capital_usd, n_scenarios=S)
 
-    warmup = max(s for _, s in horizons_bars) + vol_window_days * bpd + 2
-    reb = max(1, cfg.rebalance_days * bpd)
-    t_begin = warmup
-    if start_epoch is not None:
-        t_begin = max(t_begin, int(np.searchsorted(times, start_epoch)))
-    t_end = T if end_epoch is None else int(np.searchsorted(times, end_epoch))
+    # 履歴は [T,S,N]（バーtの全シナリオ分 [S,N] が連続するように）。
+    # record が full 以外なら [T,S,N] は持たず、1バー分の作業領域 [1,S,N] で
+    # 会計して、資産別PnLの累計とバーごとのグロスだけ残す。summary は [T,S] も
+    # 持たず、equity とグロスの統計を逐次集計する（開始前・窓の終了後は NaN で渡す）
+    equity_hist = None if summary else np.full((T, S), np.nan)
+    eq_stats = RunningEquityStats(S) if summary else None
+    H = T if full else 1
+    weights_hist = np.zeros((H, S, N), dtype=dtype)
+    qty_hist = np.zeros((T, S, N), dtype=dtype) if full else None
+    asset_pnl = np.zeros((H, S, N), dtype=dtype)
+    asset_tot = None if full else np.zeros((S, N))
+    gross_hist = None if full or summary else np.zeros((T, S))
+    fills = [FillLog(cfg.symbols) for _ in range(S)]
+    # 今回の実行分の約定数・|slippage|・シグナル乖離の合計（fillsの順に加算）
+    n_trades = [0] * S
+    slip_abs, sig_dev = [0.0] * S, [0.0] * S
+    fees, funding_paid = np.zeros(S), np.zeros(S)
+    slip_total, turnover = np.zeros(S), np.zeros(S)
+    halted_at = [None] * S
+    # 次バー始値で執行する注文（シナリオ×銘柄ID。pend_mask=Trueが未執行）
+    pend_qty, pend_sig = np.zeros((S, N)), np.zeros((S, N))
+    pend_mask = np.zeros((S, N), dtype=bool)
+    pend_reason = ["rebalance"] * S
+    n_fills0 = [0] * S    # 再開前の約定数（スナップショットの通算用）
+    t_first = int(t_begin.min())
+    if resume is not None:
+        t_first = t_resume
+        for k, sn in enumerate(snaps):
+            book.cash_usd[k], book.qty[k] = sn.cash_usd, sn.qty
+            peak[k], halted[k], halted_at[k] = sn.peak, sn.halted, sn.halted_at
+            pend_qty[k], pend_sig[k], pend_mask[k] = sn.pend_qty, sn.pend_sig, sn.pend_mask
+            pend_reason[k], n_fills0[k] = sn.pend_reason, sn.n_fills
+            fees[k], funding_paid[k] = sn.fees_usd, sn.funding_usd
+            slip_total[k], turnover[k] = sn.slippage_usd, sn.turnover_usd
+
+    def snapshot(t):
+        """バー t を処理する直前（= t-1 まで処理済み）の状態。"""
+        return [EngineSnapshot(
+            time=float(times[t - 1]),
+            begin_time=begin_time[k],
+            symbols=list(cfg.symbols), cash_usd=float(book.cash_usd[k]),
+            qty=book.qty[k].copy(), peak=float(peak[k]), halted=bool(halted[k]),
+            halted_at=halted_at[k], pend_qty=pend_qty[k].copy(),
+            pend_sig=pend_sig[k].copy(), pend_mask=pend_mask[k].copy(),
+            pend_reason=pend_reason[k], fees_usd=float(fees[k]),
+            funding_usd=float(funding_paid[k]), slippage_usd=float(slip_total[k]),
+            turnover_usd=float(turnover[k]), n_fills=n_fills0[k] + n_trades[k],
+            config_sha1=cfg.config_sha1) for k in range(S)]
 
-    equity_hist = np.full(T, np.nan)
-    weights_hist = np.zeros((T, N))
-    qty_hist = np.zeros((T, N))
-    asset_pnl = np.zeros((T, N))
-    fills = []
-    fees = funding_paid = slip_total = turnover = 0.0
-    halted_at = None
-    pending = []  # (Order) — 次バー始値で執行
-    vol_scale = 1.0
-
-    for t in range(t_begin, t_end):
+    # スナップショットを取るバー（そのバーの処理前）。t_end なら最後に取る
+    snap_idx = sorted({min(max(int(np.searchsorted(times, ts)), t_first), t_end)
+                       for ts in snapshot_at})
+    taken = []
+
+    jit = kernels.jit()
+    mark = jit.mark_bar if jit is not None else _mark_bar
+    lots = [cfg.lot_size(sym) for sym in cfg.symbols]
+    if cfg.engine_mode not in ("bar", "event"):
+        raise ValueError(f"engine_mode は bar か event: {cfg.engine_mode!r}")
+    event_mode = cfg.engine_mode == "event"
+
+    # 全体より手前で終わる窓（windows）は、終了バーの処理前に集計値を凍結する
+    stops = {}
+    for k in np.flatnonzero(t_stop < t_end):
+        stops.setdefault(max(int(t_stop[k]), t_first), []).append(int(k))
+    frozen = {}
+
+    all_active = int(t_begin.max())
+    skip_to = 0   # イベント駆動: ここまでのバーは区間まとめ処理で記録済み
+    for t in range(t_first, t_end):
+        if t < skip_to:
+            continue
+        if snap_idx and snap_idx[0] == t:
+            taken.append(snapshot(snap_idx.pop(0)))
+        for k in stops.pop(t, ()):
+            frozen[k] = (float(fees[k]), float(funding_paid[k]), float(slip_total[k]),
+                         float(turnover[k]), halted_at[k], n_trades[k], slip_abs[k],
+                         sig_dev[k], None if full else asset_tot[k].copy(),
+                         len(fills[k]))
+        if event_mode and t >= all_active and not pend_mask.any():
+            # 次のイベントバー = 停止していないシナリオの次のリバランスバー。
+            # そこまでは約定もリバランスも無く、時価評価とブレーカー監視だけ
+            running = ~halted
+            nxt = t_begin[running] - (t_begin[running] - t) // reb * reb
+            t1 = min(int(nxt.min()) if running.any() else t_end, t_end,
+                     t + _SPAN_MAX, snap_idx[0] if snap_idx else t_end,
+                     min(stops, default=t_end))
+            if t1 > t:
+                px = closes_ff[t:t1].astype(float, copy=False)
+                px_prev = closes_ff[t - 1:t1 - 1].astype(float, copy=False)
+                rate = (fr[t:t1].astype(float, copy=False)[:, None, :]
+                        * cost_mult[:, None])
+                pnl = np.zeros(rate.shape, dtype=dtype)
+                wgt = np.zeros(rate.shape, dtype=dtype)
+                eq, cash_path, fund_path = _mark_span(
+                    book.qty, book.cash_usd, funding_paid, px, px_prev, rate,
+                    fr_conservative, pnl, wgt)
+                # ブレーカー: 区間内で最初に dd_hard に達したバーで止め、
+                # そのバーまでを記録して次バーから通常処理に戻る
+                peak_path, hit = st.breaker_span(peak, halted, eq, dd_hard)
+                rows = np.flatnonzero(hit.any(axis=1))
+                n = int(rows[0]) + 1 if len(rows) else t1 - t
+                skip_to = t + n
+                if full:
+                    equity_hist[t:skip_to] = eq[:n]
+                    weights_hist[t:skip_to] = wgt[:n]
+                    qty_hist[t:skip_to] = book.qty
+                    asset_pnl[t:skip_to] = pnl[:n]
+                else:
+                    for row in pnl[:n]:     # バー順に加算（full の列和と同じ丸め）
+                        asset_tot += row
+                    gross = np.abs(wgt[:n]).sum(axis=2, dtype=float)
+                    if summary:
+                        # 区間は窓の終了バーを跨がないので、終了済みの窓だけ外す
+                        eq_stats.add_block(times[t:skip_to],
+                                           np.where(t < t_stop, eq[:n], np.nan), gross)
+                    else:
+                        equity_hist[t:skip_to] = eq[:n]
+                        gross_hist[t:skip_to] = gross
+                book.cash_usd[:], funding_paid[:] = cash_path[n - 1], fund_path[n - 1]
+                peak = peak_path[n - 1]
+                if len(rows):
+                    h, newly = skip_to - 1, hit[n - 1]
+                    halted = halted | newly
+                    px_h = px[n - 1]
+                    for k in np.flatnonzero(newly):
+                        halted_at[k] = times[h]
+                        pend_qty[k], pend_mask[k] = -book.qty[k], book.qty[k] != 0.0
+                        pend_sig[k] = np.nan_to_num(px_h)
+                        pend_reason[k] = "circuit_breaker"
+                continue
+        active = t >= t_begin
+        r = t if full else 0      # このバーを書く履歴の行
+        if not full:
+            asset_pnl[0] = 0.0
+            weights_hist[0] = 0.0
         # 1) 前バーで決定した注文をこのバーの始値で執行（唯一の約定パス）
-        still_pending = []
-        for od in pending:
-            j = cfg.symbols.index(od.symbol)
-            ref = opens[t, j]
+        for k, j in zip(*np.nonzero(pend_mask)) if pend_mask.any() else ():
+            ref = float(opens[t, j])
             if np.isnan(ref):
-                still_pending.append(od)  # バー欠損 → 次バーへ持ち越し
-                continue
-            fill = ex.execute_order(od, ref, cost_model, ts=times[t])
-            pf.apply_fill(fill)
-            fills.append(fill)
-            fees += fill.fee_usd
-            slip_total += abs(fill.slippage_usd)
-            turnover += abs(fill.qty) * fill.fill_price
-            asset_pnl[t, j] -= fill.fee_usd + fill.slippage_usd
-        pending = still_pending
-
-        # 2) funding授受（バーtの保有に対し、当バー区間のレートで）
-        for j, sym in enumerate(cfg.symbols):
-            px = closes_ff[t, j]
-            if np.isnan(px):
-                continue
-            cost = pf.apply_funding(sym, px, fr[t, j] * cost_mult,
-                                    conservative=bool(fr_conservative[j]))
-            funding_paid += cost
-            asset_pnl[t, j] -= cost
-
-        # 3) 時価評価
-        prices = {sym: closes_ff[t, j] for j, sym in enumerate(cfg.symbols)
-                  if not np.isnan(closes_ff[t, j])}
-        eq = pf.cash_usd + sum(pf.positions.get(s, 0.0) * p
-                               for s, p in prices.items())
-        equity_hist[t] = eq
-        for j, sym in enumerate(cfg.symbols):
-            q = pf.positions.get(sym, 0.0)
-            qty_hist[t, j] = q
-            if q != 0.0 and not np.isnan(closes_ff[t, j]) and t > 0 \
-                    and not np.isnan(closes_ff[t - 1, j]):
-                asset_pnl[t, j] += q * (closes_ff[t, j] - closes_ff[t - 1, j])
-            if q != 0.0 and eq > 0 and not np.isnan(closes_ff[t, j]):
-                weights_hist[t, j] = q * closes_ff[t, j] / eq
-
-        # 4) サーキットブレーカー
-        was_halted = breaker.halted
-        vol_scale = breaker.update(eq)
-        if breaker.halted:
-            if not was_halted:
-                halted_at = times[t]
-                pending = [ex.Order(sym, -pf.positions[sym], prices.get(sym, 0.0),
-                                    reason="circuit_breaker")
-                           for sym in cfg.symbols
-                           if pf.positions.get(sym, 0.0) != 0.0]
-            continue  # 停止中はリバランスしない
-
-        # 5) リバランス判定（終値ベース → 注文は次バー始値で執行される）
-        if (t - t_begin) % reb == 0 and eq > 0:
-            w = st.target_weights(sig[t], vol[t], rets[t - vol_window_days * bpd:t],
-                                  target_vol * vol_scale, cfg.max_gross, bpy,
-                                  long_only=cfg.long_only)
-            pending = []
-            for j, sym in enumerate(cfg.symbols):
-                px = closes[t, j]
-                if np.isnan(px):
-                    continue  # 当バーの確定値が無い銘柄は触らない
-                od = ex.plan_rebalance(sym, pf.positions.get(sym, 0.0),
-                                       w[j] * eq, px, eq, cost_model,
-                                       cfg.no_trade_band_pct,
-                                       integer_shares=cfg.integer_shares,
-                                       lot_size=cfg.lot_size(sym))
-                if od is not None:
-                    pending.append(od)
-
-    m = ~np.isnan(equity_hist)
-    return BacktestResult(times=times[m], equity=equity_hist[m],
-                          weights=weights_hist[m], pos_qty=qty_hist[m],
-                          asset_pnl=asset_pnl[m], fills=fills,
-                          symbols=list(cfg.symbols), fees_usd=fees,
-                          funding_usd=funding_paid, slippage_usd=slip_total,
-                          turnover_usd=turnover, halted_at=halted_at,
-                          config_sha1=cfg.config_sha1)
+                continue  # バー欠損 → 次バーへ持ち越し
+            fill = ex.execute(cfg.symbols[j], float(pend_qty[k, j]),
+                              float(pend_sig[k, j]), ref, cost_models[k],
+                              ts=times[t], reason=pend_reason[k])
+            book.apply_fill_at(j, fill.qty, fill.fill_price, fill.fee_usd, s=k)
+            pend_mask[k, j] = False
+            if full:
+                fills[k].append(fill, sym=j)
+            else:
+                slip_abs[k] += abs(fill.slippage_usd)
+                sig_dev[k] += fill.signal_deviation_usd
+            n_trades[k] += 1
+            fees[k] += fill.fee_usd
+            slip_total[k] += abs(fill.slippage_usd)
+            turnover[k] += abs(fill.qty) * fill.fill_price
+            asset_pnl[r, k, j] -= fill.fee_usd + fill.slippage_usd
+
+        # 2) funding授受（バーtの保有に対し、当バー区間のレートで）と 3) 時価評価
+        px_t = closes_ff[t].astype(float, copy=False)
+        px_prev = closes_ff[t - 1].astype(float, copy=False) if t > 0 else px_t
+        rate_t = fr[t].astype(float, copy=False) * cost_mult[:, None]
+        eq = mark(book.qty, book.cash_usd, funding_paid, px_t, px_prev, rate_t,
+                  fr_conservative, t > 0, asset_pnl[r], weights_hist[r])
+        if summary:
+            eq_stats.add(times[t], np.where(active & (t < t_stop), eq, np.nan),
+                         np.abs(weights_hist[0]).sum(axis=1, dtype=float))
+        elif t >= all_active:
+            equity_hist[t] = eq
+        else:
+            equity_hist[t, active] = eq[active]
+        if full:
+            qty_hist[t] = book.qty
+        else:
+            asset_tot += asset_pnl[0]
+            if not summary:
+                gross_hist[t] = np.abs(weights_hist[0]).sum(axis=1, dtype=float)
+
+        # 4) サーキットブレーカー（開始前のシナリオは触らない）
+        was_halted = halted
+        peak_t, halted_t, vol_scale = st.breaker_step(peak, halted, eq,
+                                                      dd_soft, dd_hard)
+        if t >= all_active:
+            peak, halted = peak_t, halted_t
+        else:
+            peak = np.where(active, peak_t, peak)
+            halted = np.where(active, halted_t, halted)
+        newly = halted & ~was_halted
+        if newly.any():
+            for k in np.flatnonzero(newly):
+                halted_at[k] = times[t]
+                pend_qty[k], pend_mask[k] = -book.qty[k], book.qty[k] != 0.0
+                pend_sig[k], pend_reason[k] = np.nan_to_num(px_t), "circuit_breaker"
+
+        # 5) リバランス判定（終値ベース → 注文は次バー始値で執行される）。
+        # 停止中のシナリオはリバランスしない
+        due = active & (t < t_stop) & ((t - t_begin) % reb == 0)
+        if not due.any():
+            continue
+        due = np.flatnonzero(due & ~halted & (eq > 0))
+        if len(due) == 0:
+            continue
+        w = np.empty((len(due), N))
+        for i, k in enumerate(due):
+            w_unit, pvol = unit_paths[group_of[k]]
+            w[i] = st.scale_weights(w_unit[t], pvol[t], target_vol[k] * vol_scale[k],
+                                    cfg.max_gross)
+        # 当バーの確定値が無い銘柄（NaN）は触らない
+        px_c = closes[t].astype(float, copy=False)
+        pend_qty[due], pend_mask[due] = ex.plan_rebalance_batch(
+            book.qty[due], w * eq[due, None], px_c, eq[due], cost_models[0],
+            band[due], integer_shares=cfg.integer_shares, lot_sizes=lots)
+        pend_sig[due] = px_c
+        for k in due:
+            pend_reason[k] = "rebalance"
+
+    if snap_idx:       # t_end で取る分
+        taken.append(snapshot(t_end))
+    for k, fz in frozen.items():
+        (fees[k], funding_paid[k], slip_total[k], turnover[k], halted_at[k],
+         n_trades[k], slip_abs[k], sig_dev[k], tot, n_fills) = fz
+        if tot is not None:
+            asset_tot[k] = tot
+        fills[k] = fills[k][:n_fills]
+        if not summary:
+            equity_hist[t_stop[k]:, k] = np.nan
+    results = []
+    for k in range(S):
+        m = None if summary else ~np.isnan(equity_hist[:, k])
+        res = BacktestResult(
+            times=None if summary else times[m],
+            equity=None if summary else equity_hist[m, k], weights=None, pos_qty=None,
+            asset_pnl=None, fills=fills[k],
+            symbols=list(cfg.symbols), fees_usd=float(fees[k]),
+            funding_usd=float(funding_paid[k]), slippage_usd=float(slip_total[k]),
+            turnover_usd=float(turnover[k]), halted_at=halted_at[k],
+            config_sha1=cfg.config_sha1, snapshots=[sn[k] for sn in taken],
+            record=record)
+        if full:
+            res.weights, res.pos_qty = weights_hist[m, k], qty_hist[m, k]
+            res.asset_pnl = asset_pnl[m, k]
+        else:
+            if summary:
+                avg_gross, max_gross = eq_stats.gross(k)
+            else:
+                gross = gross_hist[m, k]
+                # バー順に足す（metrics の full / summary の集計と丸めを揃える）
+                avg_gross = (float(ex.sequential_sum(0.0, gross[None])[0] / len(gross))
+                             if len(gross) else 0.0)
+                max_gross = float(gross.max()) if len(gross) else 0.0
+            res.stats = {"n_trades": n_trades[k], "slippage_usd": slip_abs[k],
+                         "signal_deviation_usd": sig_dev[k],
+                         "asset_pnl": asset_tot[k].copy(),
+                         "avg_gross": avg_gross, "max_gross": max_gross}
+        if summary:
+            res.stats["equity"] = eq_stats.result(k)
+        results.append(res)
+    return results
+
+
+def _resume_index(snaps, times, symbols):
+    """再開するバー（スナップショット時刻の次のバー）の添字。データと銘柄を照合する。"""
+    t0 = snaps[0].time
+    if any(sn.time != t0 for sn in snaps):
+        raise ValueError("resume: snapshots are taken at different bars")
+    if any(list(sn.symbols) != list(symbols) for sn in snaps):
+        raise ValueError("resume: snapshot symbols do not match config")
+    t = int(np.searchsorted(times, t0, side="right"))
+    if t == 0 or times[t - 1] != t0:
+        raise ValueError(f"resume: bar {t0} not found in market data")
+    return t
@@ -12,6 +12,7 @@ cta/data.py（暗号資産・4H足・ccxt）と同じインターフェース（
     INSERT...WHERE NOT EXISTS はこの点が弱かった）。
 """
 import datetime as dt
+import hashlib
 import os
 import sqlite3
 import time
@@ -139,18 +140,22 @@ def fetch_and_cache(db_path, symbols, start='2006-01-01', now_utc=None,
     return inserted
 
 
-def load_universe(db_path, symbols):
+def load_universe(db_path, symbols, since_epoch=None):
     """キャッシュから読み出す。cta/data.load_universe と同じ戻り値の形。
 
+    since_epoch を指定するとその日以降のバーだけを読む（逐次更新用）。
+
     Returns: (times[T] epoch秒, opens DataFrame, closes DataFrame)
     """
     con = _connect(db_path)
+    since = ('' if since_epoch is None else
+             dt.datetime.fromtimestamp(since_epoch, dt.timezone.utc).strftime('%Y-%m-%d'))
     frames = {}
     for sym in symbols:
         df = pd.read_sql_query(
             """SELECT bar_date, open_price AS open, close_price AS close
-               FROM etf_bars WHERE symbol=? ORDER BY bar_date""",
-            con, params=(sym,))
+               FROM etf_bars WHERE symbol=? AND bar_date>=? ORDER BY bar_date""",
+            con, params=(sym, since))
         if df.empty:
             continue
         df['bar_date'] = pd.to_datetime(df['bar_date'])
@@ -173,6 +178,21 @@ def load_universe(db_path, symbols):
     return times, opens, closes
 
 
+def history_fingerprint(db_path, symbols, until_epoch):
+    """until_epoch の日までのキャッシュ行の指紋（cta/data.history_fingerprint と同じ用途）。
+
+    INSERT OR REPLACE や jp_repair で過去の終値が直ると変わる。"""
+    con = _connect(db_path)
+    until = dt.datetime.fromtimestamp(until_epoch, dt.timezone.utc).strftime('%Y-%m-%d')
+    rows = [con.execute(
+        """SELECT COUNT(*), TOTAL(close_price),
+                  TOTAL(close_price * julianday(bar_date))
+           FROM etf_bars WHERE symbol=? AND bar_date<=?""",
+        (sym, until)).fetchone() for sym in symbols]
+    con.close()
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+
 def coverage(db_path):
     """キャッシュの状況を返す（運用時の健全性チェック用）。"""
     con = _connect(db_path)
@@ -9,8 +9,10 @@ fill価格・手数料・funding・最小ロットの計算は必ずここを経
 - ライブ:       ref_price = 発注時点の板mid/ticker を渡す
 どちらも fill_price() が slippage を同一式で適用する。
 """
-import math
-from dataclasses import dataclass, field
+import collections.abc
+from dataclasses import dataclass
+
+import numpy as np
 
 
 @dataclass
@@ -71,60 +73,223 @@ def plan_rebalance(symbol, current_qty, target_notional_usd, price, equity_usd,
 
     バックテスト・ペーパー・実発注のすべてがこの同一関数を通るため、
     「バックテストだけ端数で計算していた」という乖離が構造的に起こらない。
+    計算本体は plan_rebalance_batch()（1銘柄分として呼ぶ）。
 
     Returns Order or None."""
-    if price <= 0:
+    delta, mask = plan_rebalance_batch([current_qty], [target_notional_usd],
+                                       [price], equity_usd, cost_model,
+                                       no_trade_band_pct, integer_shares,
+                                       [lot_size or 1])
+    if not mask[0]:
         return None
-    target_qty = target_notional_usd / price
+    return Order(symbol=symbol, qty=float(delta[0]), signal_price=price)
+
+
+def plan_rebalance_batch(current_qty, target_notional_usd, price, equity_usd,
+                         cost_model, no_trade_band_pct, integer_shares=False,
+                         lot_sizes=1):
+    """plan_rebalance() の全銘柄一括版。サイズ計算の式はこれ一つだけ。
+
+    current_qty / target_notional_usd / price / lot_sizes は銘柄順の [N]
+    （lot_sizes はスカラーも可）。current_qty / target_notional_usd に先頭の
+    シナリオ軸を付けた [S,N] も受け付け、そのとき equity_usd・no_trade_band_pct は
+    スカラーか [S]（バッチバックテスト用）。規則は plan_rebalance() と同じ:
+      - 価格が無い(NaN)・0以下の銘柄は発注しない
+      - integer_shares なら目標数量を売買単位の整数倍に0方向へ切り捨て
+      - |Δノーショナル| が max(最小ノーショナル, バンド×equity) 未満はスキップ
+      - 完全クローズ（target=0かつ保有あり）は最小ロット制約の対象外
+
+    Order は作らない（バックテストの内側ループ用）。発注が必要な境界で
+    orders_from_batch() で Order に変換する。
+    Returns: (delta_qty[N], mask[N])  mask=False の銘柄の delta_qty は0。"""
+    cur = np.asarray(current_qty, dtype=float)
+    tgt = np.asarray(target_notional_usd, dtype=float)
+    px = np.asarray(price, dtype=float)
+    priced = np.broadcast_to(px > 0, tgt.shape)   # NaNとの比較はFalse
+    target_qty = np.zeros(tgt.shape)
+    np.divide(tgt, px, out=target_qty, where=priced)
     if integer_shares:
-        lot = max(1, int(lot_size or 1))
+        lot = np.maximum(1, np.asarray(lot_sizes, dtype=np.int64))
         # 0方向へ切り捨て（ロングは切り下げ、ショートは切り上げ）
-        target_qty = float(math.trunc(target_qty / lot) * lot)
-    delta_qty = target_qty - current_qty
-    delta_notional = abs(delta_qty) * price
-    # 完全クローズ（target=0）は最小ロット制約の対象外（残骸ポジションを許さない）
-    closing = target_notional_usd == 0.0 and current_qty != 0.0
-    if not closing:
-        if delta_notional < max(cost_model.min_notional_usd,
-                                no_trade_band_pct * equity_usd):
-            return None
-    elif delta_notional == 0.0:
-        return None
-    return Order(symbol=symbol, qty=delta_qty, signal_price=price)
+        target_qty = np.trunc(target_qty / lot) * lot
+    delta = target_qty - cur
+    delta_notional = np.abs(delta) * np.where(priced, px, 0.0)
+    closing = (tgt == 0.0) & (cur != 0.0)
+    threshold = np.maximum(cost_model.min_notional_usd,
+                           np.asarray(no_trade_band_pct) * np.asarray(equity_usd))
+    if delta.ndim == 2 and threshold.ndim == 1:
+        threshold = threshold[:, None]
+    mask = priced & np.where(closing, delta_notional != 0.0,
+                             delta_notional >= threshold)
+    return np.where(mask, delta, 0.0), mask
+
+
+def orders_from_batch(symbols, delta_qty, mask, signal_prices, reason="rebalance"):
+    """plan_rebalance_batch() の結果を Order のリストにする（発注の境界でのみ使う）。"""
+    return [Order(symbol=symbols[j], qty=float(delta_qty[j]),
+                  signal_price=float(signal_prices[j]), reason=reason)
+            for j in np.flatnonzero(mask)]
 
 
 def execute_order(order, ref_price, cost_model, ts=0.0):
     """注文を約定させFillを返す。手数料は約定ノーショナルに対して課す。"""
-    fp = fill_price(ref_price, order.qty, cost_model.slip_rate)
-    fee = abs(order.qty) * fp * cost_model.fee_rate
-    return Fill(symbol=order.symbol, qty=order.qty, signal_price=order.signal_price,
+    return execute(order.symbol, order.qty, order.signal_price, ref_price,
+                   cost_model, ts=ts, reason=order.reason)
+
+
+def execute(symbol, qty, signal_price, ref_price, cost_model, ts=0.0,
+            reason="rebalance"):
+    """execute_order() の本体（Orderを作らない配列側の呼び出し用）。"""
+    fp = fill_price(ref_price, qty, cost_model.slip_rate)
+    fee = abs(qty) * fp * cost_model.fee_rate
+    return Fill(symbol=symbol, qty=qty, signal_price=signal_price,
                 ref_price=ref_price, fill_price=fp, fee_usd=fee,
-                reason=order.reason, ts=ts)
+                reason=reason, ts=ts)
 
 
 def funding_cost_usd(qty, price, rate, conservative=False):
     """funding授受。rate>0でロングが支払い・ショートが受取り（perp標準）。
 
-    conservative=True は実レート履歴が無い資産用: 符号に関わらずコストとして課す。"""
+    conservative=True は実レート履歴が無い資産用: 符号に関わらずコストとして課す。
+    全銘柄分の配列（conservative も [N]）を渡すと銘柄ごとのコスト [N] を返す。"""
     notional = qty * price
+    if np.ndim(conservative):
+        return np.where(conservative, np.abs(notional) * np.abs(rate),
+                        notional * rate)
     if conservative:
         return abs(notional) * abs(rate)
     return notional * rate  # ロング(+qty)は支払い、ショートは受取り(負のコスト)
 
 
-@dataclass
-class Portfolio:
-    """現金+ポジションの会計。backtest/paperで共有。equityは時価評価。"""
-    cash_usd: float
-    positions: dict = field(default_factory=dict)   # symbol -> qty(符号付き)
+def sequential_sum(start, values):
+    """start + v0 + v1 + ... を先頭から順に足す。
 
-    def apply_fill(self, fill):
-        self.cash_usd -= fill.qty * fill.fill_price
-        self.cash_usd -= fill.fee_usd
-        q = self.positions.get(fill.symbol, 0.0) + fill.qty
+    銘柄ごとに現金へ加減算していた逐次処理と丸めまで一致させるため
+    （np.sum はペアワイズ加算なので結果の最下位ビットが変わりうる）。
+    values が [S,N] なら行ごとに足して [S] を返す（start はスカラーか [S]）。"""
+    values = np.asarray(values)
+    if values.ndim == 2:
+        acc = np.empty((values.shape[0], values.shape[1] + 1))
+        acc[:, 0] = start
+        acc[:, 1:] = values
+        return np.add.accumulate(acc, axis=1)[:, -1]  # accumulate は先頭から逐次
+    total = start
+    for v in values.tolist():
+        total += v
+    return total
+
+
+class ArrayPortfolio:
+    """現金 + 銘柄ID順のポジションベクトル。会計の本体（バックテストのバーループ用）。
+
+    qty[j] は symbols[j] の符号付き数量。バックテストはこの配列を直接使い
+    （funding・時価評価は engine 側で全銘柄まとめて計算）、ペーパー・実発注は
+    Portfolio ビュー経由で使う。未知の銘柄は slot() で末尾に追加するので、
+    ペーパーの state に旧ユニバースの銘柄が残っていても保持できる。
+
+    n_scenarios を与えるとシナリオ軸付き（qty [S,N]・cash_usd [S]）になり、
+    バッチバックテストが S 本の口座をまとめて持つのに使う。"""
+
+    def __init__(self, symbols=(), cash_usd=0.0, qty=None, n_scenarios=None):
+        self.symbols = list(symbols)
+        self.index = {s: j for j, s in enumerate(self.symbols)}
+        if n_scenarios is not None:
+            self.cash_usd = np.full(n_scenarios, cash_usd, dtype=float)
+            self.qty = np.zeros((n_scenarios, len(self.symbols)))
+            return
+        self.cash_usd = cash_usd
+        self.qty = (np.zeros(len(self.symbols)) if qty is None
+                    else np.array(qty, dtype=float).reshape(len(self.symbols)))
+
+    def slot(self, symbol):
+        """銘柄の添字（無ければ数量0で追加する）。"""
+        j = self.index.get(symbol)
+        if j is None:
+            j = self.index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            self.qty = np.append(self.qty, 0.0)
+        return j
+
+    def remove(self, symbol):
+        j = self.index.pop(symbol)
+        del self.symbols[j]
+        self.qty = np.delete(self.qty, j)
+        self.index = {s: k for k, s in enumerate(self.symbols)}
+
+    def apply_fill_at(self, j, qty, fill_price, fee_usd, s=None):
+        """銘柄 j の約定を反映する。s はシナリオ軸付きのときのシナリオ番号。"""
+        if s is None:
+            self.cash_usd -= qty * fill_price
+            self.cash_usd -= fee_usd
+        else:
+            self.cash_usd[s] -= qty * fill_price
+            self.cash_usd[s] -= fee_usd
+            j = (s, j)
+        q = self.qty[j] + qty
         if abs(q) < 1e-12:
             q = 0.0
-        self.positions[fill.symbol] = q
+        self.qty[j] = q
+
+    def apply_fill(self, fill):
+        self.apply_fill_at(self.slot(fill.symbol), fill.qty, fill.fill_price,
+                           fill.fee_usd)
+
+
+class PositionsView(collections.abc.MutableMapping):
+    """ArrayPortfolio のポジションを {symbol: qty} として見せる辞書風ビュー。"""
+
+    def __init__(self, book):
+        self._book = book
+
+    def __getitem__(self, symbol):
+        return float(self._book.qty[self._book.index[symbol]])
+
+    def __setitem__(self, symbol, qty):
+        self._book.qty[self._book.slot(symbol)] = qty
+
+    def __delitem__(self, symbol):
+        self._book.remove(symbol)
+
+    def __iter__(self):
+        return iter(list(self._book.symbols))
+
+    def __len__(self):
+        return len(self._book.symbols)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Portfolio:
+    """現金+ポジションの会計。backtest/paperで共有。equityは時価評価。
+
+    実体は ArrayPortfolio（book）で、positions は銘柄名で引けるビュー。
+    ペーパー・実発注は従来どおり {symbol: qty} として扱える。"""
+
+    def __init__(self, cash_usd, positions=None, book=None):
+        if book is None:
+            positions = dict(positions or {})
+            book = ArrayPortfolio(list(positions), cash_usd,
+                                  list(positions.values()))
+        self.book = book
+
+    @property
+    def cash_usd(self):
+        return self.book.cash_usd
+
+    @cash_usd.setter
+    def cash_usd(self, value):
+        self.book.cash_usd = value
+
+    @property
+    def positions(self):   # symbol -> qty(符号付き)
+        return PositionsView(self.book)
+
+    def __repr__(self):
+        return f"Portfolio(cash_usd={self.cash_usd!r}, positions={self.positions!r})"
+
+    def apply_fill(self, fill):
+        self.book.apply_fill(fill)
 
     def apply_funding(self, symbol, price, rate, conservative=False):
         qty = self.positions.get(symbol, 0.0)
@@ -0,0 +1,183 @@
+"""約定ログの列指向コンテナ（FillLog）。
+
+バックテストは約定ごとに Fill データクラスを list に溜めていたため、
+rebalance_days=1 の高回転設定では数万個のオブジェクトができ、
+compute_metrics の slippage 合計や BacktestResult.slice の期間抽出が
+全約定を Python で舐めていた。FillLog は
+  ts / 銘柄ID / qty / signal・ref・fill価格 / 手数料 / 理由コード
+を numpy 配列で持ち、追記・列ごとの一括集計・searchsorted での期間切り出しを
+配列のまま行う。Fill オブジェクトは要素を取り出すときに初めて作る
+（レポートの約定表など）。
+
+list[Fill] と同じく len / for / [i] / [a:b] / == が使える。
+"""
+import numpy as np
+
+from . import execution as ex
+
+_COLUMNS = ("ts", "sym", "qty", "signal_price", "ref_price", "fill_price",
+            "fee_usd", "reason")
+_DTYPES = {"sym": np.int32, "reason": np.int8}
+
+
+class FillLog:
+    """1本のバックテストの約定列（ts 昇順）。
+
+    symbols は銘柄IDの表、reasons は理由コードの表（追記時に初出の理由を足す）。
+    切り出し（between / [a:b]）は配列を共有するビューを返す。"""
+
+    def __init__(self, symbols, reasons=(), capacity=64, _cols=None, _n=0):
+        self.symbols = list(symbols)
+        self.reasons = list(reasons)
+        if _cols is None:
+            _cols = {c: np.empty(capacity, dtype=_DTYPES.get(c, float))
+                     for c in _COLUMNS}
+        self._cols = _cols
+        self._n = _n
+
+    @classmethod
+    def from_arrays(cls, symbols, reasons, **cols):
+        """列配列（ts / sym / qty / ... / reason）から作る（保存からの復元用）。"""
+        cols = {c: np.asarray(cols[c], dtype=_DTYPES.get(c, float))
+                for c in _COLUMNS}
+        return cls(symbols, reasons, _cols=cols, _n=len(cols["ts"]))
+
+    @classmethod
+    def from_fills(cls, symbols, fills):
+        log = cls(symbols, capacity=max(len(fills), 1))
+        for f in fills:
+            log.append(f)
+        return log
+
+    def __len__(self):
+        return self._n
+
+    def _col(self, name):
+        return self._cols[name][:self._n]
+
+    def __getattr__(self, name):
+        # 列（ts / qty / fill_price ...）は有効部分のビューとして読む
+        if name in _COLUMNS:
+            return self._col(name)
+        raise AttributeError(name)
+
+    def _grow(self, need):
+        cap = len(self._cols["ts"])
+        if need <= cap:
+            return
+        cap = max(need, 2 * cap)
+        for c, arr in self._cols.items():
+            new = np.empty(cap, dtype=arr.dtype)
+            new[:self._n] = arr[:self._n]
+            self._cols[c] = new
+
+    def _reason_code(self, reason):
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+        return self.reasons.index(reason)
+
+    def append(self, fill, sym=None):
+        """Fill を1件追記する。sym は銘柄ID（省略時は fill.symbol から引く）。"""
+        self._grow(self._n + 1)
+        i = self._n
+        c = self._cols
+        c["ts"][i] = fill.ts
+        c["sym"][i] = self.symbols.index(fill.symbol) if sym is None else sym
+        c["qty"][i] = fill.qty
+        c["signal_price"][i] = fill.signal_price
+        c["ref_price"][i] = fill.ref_price
+        c["fill_price"][i] = fill.fill_price
+        c["fee_usd"][i] = fill.fee_usd
+        c["reason"][i] = self._reason_code(fill.reason)
+        self._n += 1
+
+    def _view(self, a, b):
+        cols = {c: arr[a:b] for c, arr in self._cols.items()}
+        return FillLog(self.symbols, self.reasons, _cols=cols, _n=max(b - a, 0))
+
+    def between(self, t0, t1):
+        """[t0, t1) の約定（ビュー）。"""
+        ts = self._col("ts")
+        a, b = np.searchsorted(ts, [t0, t1])
+        return self._view(int(a), int(b))
+
+    def fill(self, i):
+        """i 件目を Fill にして返す。"""
+        c = self._cols
+        return ex.Fill(symbol=self.symbols[c["sym"][i]], qty=float(c["qty"][i]),
+                       signal_price=float(c["signal_price"][i]),
+                       ref_price=float(c["ref_price"][i]),
+                       fill_price=float(c["fill_price"][i]),
+                       fee_usd=float(c["fee_usd"][i]),
+                       reason=self.reasons[c["reason"][i]], ts=float(c["ts"][i]))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            a, b, step = key.indices(self._n)
+            if step != 1:
+                raise ValueError("FillLog slices must be contiguous")
+            return self._view(a, b)
+        i = range(self._n)[key]
+        return self.fill(i)
+
+    def __iter__(self):
+        return (self.fill(i) for i in range(self._n))
+
+    def to_list(self):
+        return list(self)
+
+    def __eq__(self, other):
+        if isinstance(other, FillLog):
+            return (len(self) == len(other)
+                    and [self.symbols[i] for i in self.sym]
+                    == [other.symbols[i] for i in other.sym]
+                    and [self.reasons[i] for i in self.reason]
+                    == [other.reasons[i] for i in other.reason]
+                    and all(np.array_equal(self._col(c), other._col(c))
+                            for c in _COLUMNS if c not in ("sym", "reason")))
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __add__(self, other):
+        """2つのログを連結した新しいログ（other は self より後の約定）。"""
+        reasons = self.reasons + [r for r in other.reasons if r not in self.reasons]
+        remap = {"sym": np.array([self.symbols.index(s) for s in other.symbols],
+                                 dtype=_DTYPES["sym"]),
+                 "reason": np.array([reasons.index(r) for r in other.reasons],
+                                    dtype=_DTYPES["reason"])}
+        cols = {}
+        for c in _COLUMNS:
+            tail = other._col(c)
+            if c in remap and len(tail):
+                tail = remap[c][tail]
+            cols[c] = np.concatenate([self._col(c), tail])
+        return FillLog.from_arrays(self.symbols, reasons, **cols)
+
+    def __repr__(self):
+        return f"FillLog({self._n} fills, symbols={self.symbols})"
+
+    # --- 一括集計（Fill のプロパティと同じ式を配列で） ---
+    def _side(self):
+        return np.where(self.qty > 0, 1, -1)
+
+    @property
+    def slippage_usd(self):
+        """約定ごとの slippage [n]（Fill.slippage_usd と同じ式）。"""
+        return np.abs(self.qty) * (self.fill_price - self.ref_price) * self._side()
+
+    @property
+    def signal_deviation_usd(self):
+        """約定ごとの signal→fill 乖離 [n]（Fill.signal_deviation_usd と同じ式）。"""
+        return np.abs(self.qty) * (self.fill_price - self.signal_price) * self._side()
+
+    @property
+    def notional_usd(self):
+        return np.abs(self.qty) * self.fill_price
+
+    def total(self, values):
+        """約定順に先頭から足した合計（list[Fill] を sum() した場合と丸めまで一致）。"""
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return 0
+        return float(ex.sequential_sum(0.0, values[None, :])[0])
@@ -0,0 +1,82 @@
+"""計算カーネルのバックエンド切り替え（任意のJIT）。
+
+感応度グリッドや研究用スイープでは ewma・trailing_vol・エンジンのバーごとの
+会計がCPUの大半を占める。これらについて numba でJITコンパイルした版を用意し、
+選択されていればそちらを使う（サーキットブレーカーはエンジン側で全シナリオ・
+区間まとめて配列演算するので対象にしない: strategy.breaker_step / breaker_span）。
+
+  - 参照実装は従来どおり strategy / engine 内の NumPy・Python コード。
+    JIT版は同じ演算順で書いてあり、参照実装と一致する（テストで固定）
+  - 選択: 環境変数 CTA_KERNEL_BACKEND（プロセス全体の既定）、または config の
+    [engine] backend（numpy / numba / auto。既定 numpy。auto は numba があれば使う）。
+    config の指定は use_backend() でその実行の間だけ効かせ、抜けると既定に戻す
+  - numba が入っていない環境（素のRPi等）では黙って numpy にフォールバックする
+"""
+import contextlib
+import os
+
+BACKEND_ENV = "CTA_KERNEL_BACKEND"
+BACKENDS = ("numpy", "numba", "auto")
+
+_backend = "numpy"
+_jit = None          # コンパイル済みカーネルの名前空間（numba無しならNone）
+
+
+def _load_numba():
+    global _jit
+    if _jit is None:
+        try:
+            from . import _numba_kernels
+        except ImportError:
+            return None
+        _jit = _numba_kernels
+    return _jit
+
+
+def _effective(name):
+    name = (name or "numpy").strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"unknown kernel backend {name!r} (choose from {BACKENDS})")
+    if name in ("numba", "auto") and _load_numba() is not None:
+        return "numba"
+    return "numpy"
+
+
+def set_backend(name):
+    """バックエンドを選ぶ。実際に有効になった名前（numpy/numba）を返す。"""
+    global _backend
+    _backend = _effective(name)
+    return _backend
+
+
+def backend():
+    return _backend
+
+
+def resolve(name=None):
+    """config の [engine] backend（空なら現在の既定）で実際に使われる
+    バックエンド名（numpy/numba）。切り替えはしない（キャッシュのキー用）。"""
+    return _effective(name) if name else _backend
+
+
+@contextlib.contextmanager
+def use_backend(name=None):
+    """with の間だけバックエンドを name にする（空なら既定のまま）。
+    抜けると元に戻すので、ある config の指定が後の呼び出しに残らない。"""
+    global _backend
+    prev = _backend
+    if name:
+        _backend = _effective(name)
+    try:
+        yield _backend
+    finally:
+        _backend = prev
+
+
+def jit():
+    """JITカーネルの名前空間。numpy バックエンドならNone。"""
+    return _jit if _backend == "numba" else None
+
+
+set_backend(os.environ.get(BACKEND_ENV, "numpy"))
+
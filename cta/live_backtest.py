@@ -0,0 +1,209 @@
+"""追記型のライブバックテスト（成果物 .npz）。
+
+日次運用では新しい4H足が数本増えただけでも全履歴のバックテストを
+回し直していた。ここでは
+  - 最後に処理したバーの直後の EngineSnapshot（エンジン状態）
+  - それまでの結果配列（equity / weights / pos_qty / asset_pnl / fills / 累計コスト）
+  - シグナル・vol・共分散の前計算の逐次状態（engine.unit_path_chunk の state）
+  - 処理済み区間の入力データの指紋と、結果に効く設定の指紋
+を1ファイルに持ち、次回は新しいバーだけの前計算を状態の続きから作り、
+run_backtest(resume=..., unit_path=...) で回して結果を継ぎ足す。結果は全期間を通しで回した run_backtest とビット単位で一致する
+（シグナル・vol・共分散・時価評価がすべて因果的なため）。
+
+処理済み区間のデータ（過去足の修正・funding履歴の差し替え等）や設定が
+変わっていれば指紋が合わないので、全期間を回し直して作り直す
+（前計算の状態を持たない旧形式の成果物も同様）。
+"""
+import dataclasses
+import os
+
+import numpy as np
+
+from . import cache as cache_mod
+from . import kernels
+from . import strategy as st
+from .engine import BacktestResult, EngineSnapshot, run_backtest, unit_path_chunk
+from .fill_log import FillLog
+from .market import MarketData
+
+# 設定の指紋から除く項目: 結果に影響しないもの（ループ方式はビット単位で同じ
+# 結果）と、中身を data_fingerprint で照合する入力の置き場所。カーネルの
+# バックエンドは numba と numpy が丸めまで一致する保証が無いので、実際に
+# 使われる名前（kernels.resolve）で指紋に入れる
+_NEUTRAL_FIELDS = ("config_path", "config_sha1", "kernel_backend", "engine_mode",
+                   "state_prefix", "db_path", "funding_pkl")
+_RESULT_ARRAYS = ("times", "equity", "weights", "pos_qty", "asset_pnl")
+_RESULT_TOTALS = ("fees_usd", "funding_usd", "slippage_usd", "turnover_usd")
+_FILL_COLUMNS = ("ts", "sym", "qty", "signal_price", "ref_price", "fill_price",
+                 "fee_usd", "reason")
+
+
+def _state_arrays(state):
+    """前計算の状態 dict を .npz のキー "pre.<部>.<名前>" の配列にする
+    （タプルは ".<番号>"、RollingCovariance は ".<to_arrays のキー>" で展開。
+    None の項目は書かない＝読み戻すと無いのと同じ）。"""
+    d = {}
+    for part, sub in state.items():
+        for name, v in sub.items():
+            key = f"pre.{part}.{name}"
+            if isinstance(v, st.RollingCovariance):
+                d.update({f"{key}.{k}": a for k, a in v.to_arrays().items()})
+            elif isinstance(v, tuple):
+                d.update({f"{key}.{i}": a for i, a in enumerate(v)})
+            elif v is not None:
+                d[key] = v
+    return d
+
+
+def _state_from_arrays(d):
+    """_state_arrays() の逆。"pre." のキーが無ければ None。"""
+    state, nested = {}, {}
+    for key, v in d.items():
+        if not key.startswith("pre."):
+            continue
+        _, part, name, *rest = key.split(".")
+        sub = state.setdefault(part, {})
+        if rest:
+            nested.setdefault((part, name), {})[rest[0]] = v
+        else:
+            sub[name] = v.item() if v.ndim == 0 else v
+    for (part, name), parts in nested.items():
+        if "row_x" in parts:
+            state[part][name] = st.RollingCovariance.from_arrays(parts)
+        else:
+            state[part][name] = tuple(parts[str(i)] for i in range(len(parts)))
+    return state or None
+
+
+def config_fingerprint(cfg):
+    """バックテスト結果を決める設定値の指紋（ini の書式やパスの違いは無視）。"""
+    parts = {f.name: getattr(cfg, f.name) for f in dataclasses.fields(cfg)
+             if f.name not in _NEUTRAL_FIELDS}
+    parts["kernel_backend"] = kernels.resolve(cfg.kernel_backend)
+    return cache_mod.make_key("live", **parts)
+
+
+def data_fingerprint(market, n_bars):
+    """先頭 n_bars 本の入力（時刻・始値・終値・funding・保守的課金フラグ）の指紋。"""
+    return market.data_fingerprint(n_bars)
+
+
+@dataclasses.dataclass
+class LiveBacktest:
+    """ライブバックテストの成果物。result は先頭からの通しの結果。"""
+    result: BacktestResult
+    snapshot: EngineSnapshot     # n_bars 本目まで処理した直後の状態
+    n_bars: int                  # 処理済みの入力バー数（warmup込み）
+    data_fp: str
+    config_fp: str
+    state: dict = None           # n_bars 本までの前計算の状態（unit_path_chunk）
+
+    def save(self, path):
+        """.npz に保存する（一時ファイルに書いてから置き換える）。"""
+        r = self.result
+        d = {k: getattr(r, k) for k in _RESULT_ARRAYS + _RESULT_TOTALS}
+        d["symbols"] = np.array(r.symbols, dtype=str)
+        d["halted_at"] = np.nan if r.halted_at is None else r.halted_at
+        d["config_sha1"] = r.config_sha1
+        for k in _FILL_COLUMNS:
+            d["fill_" + k] = getattr(r.fills, k)
+        d["fill_reasons"] = np.array(r.fills.reasons, dtype=str)
+        for k, v in vars(self.snapshot).items():
+            d["snap_" + k] = v
+        d["snap_symbols"] = np.array(self.snapshot.symbols, dtype=str)
+        d["snap_halted_at"] = (np.nan if self.snapshot.halted_at is None
+                               else self.snapshot.halted_at)
+        d.update(n_bars=self.n_bars, data_fp=self.data_fp, config_fp=self.config_fp)
+        d.update(_state_arrays(self.state or {}))
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **d)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            d = {k: z[k] for k in z.files}
+        symbols = [str(s) for s in d["symbols"]]
+        fills = FillLog.from_arrays(symbols, [str(r) for r in d["fill_reasons"]],
+                                    **{k: d["fill_" + k] for k in _FILL_COLUMNS})
+        halted_at = float(d["halted_at"])
+        result = BacktestResult(
+            **{k: d[k] for k in _RESULT_ARRAYS},
+            **{k: float(d[k]) for k in _RESULT_TOTALS},
+            fills=fills, symbols=symbols,
+            halted_at=None if np.isnan(halted_at) else halted_at,
+            config_sha1=str(d["config_sha1"]))
+        snap = {k[5:]: v for k, v in d.items() if k.startswith("snap_")}
+        for k, v in snap.items():
+            if k not in EngineSnapshot._ARRAYS:
+                snap[k] = v.item() if v.ndim == 0 else v
+        snap["symbols"] = [str(s) for s in snap["symbols"]]
+        snap["halted"] = bool(snap["halted"])
+        if np.isnan(snap["halted_at"]):
+            snap["halted_at"] = None
+        return cls(result, EngineSnapshot(**snap), int(d["n_bars"]),
+                   str(d["data_fp"]), str(d["config_fp"]), _state_from_arrays(d))
+
+
+def _build(cfg, market):
+    """全期間を回して成果物を作る（最後のバーの直後でスナップショットを取り、
+    前計算も次回の継ぎ足し用に状態を持ち越す形で作る）。"""
+    state = {}
+    up = unit_path_chunk(cfg, market.closes, 0, state)
+    res = run_backtest(cfg, market=market, snapshot_at=[np.inf], unit_path=up)
+    snap = res.snapshots.pop()
+    n = len(market.times)
+    return LiveBacktest(res, snap, n, data_fingerprint(market, n),
+                        config_fingerprint(cfg), state)
+
+
+def _concat(old, new):
+    """old の結果の後ろに、old のスナップショットから再開した new を継ぎ足す。"""
+    arrays = {k: np.concatenate([getattr(old, k), getattr(new, k)])
+              for k in _RESULT_ARRAYS}
+    return dataclasses.replace(new, **arrays, fills=old.fills + new.fills,
+                               snapshots=[])
+
+
+def update(cfg, path, market=None):
+    """path の成果物を market の最新バーまで伸ばす。
+
+    返り値は (BacktestResult, 状態)。状態は
+      "created"   成果物が無かったので全期間を回した
+      "rebuilt"   設定か処理済み区間のデータが変わっていたので回し直した
+      "extended"  新しいバーだけを回して継ぎ足した
+      "unchanged" 新しいバーが無かった
+    成果物は "unchanged" 以外のとき上書き保存する。"""
+    if market is None:
+        market = MarketData.load(cfg)
+    else:
+        market.check(cfg)
+    if not os.path.exists(path):
+        live, status = _build(cfg, market), "created"
+    else:
+        live = LiveBacktest.load(path)
+        n = live.n_bars
+        if (live.config_fp != config_fingerprint(cfg) or n > len(market.times)
+                or live.data_fp != data_fingerprint(market, n)
+                or live.state is None):
+            live, status = _build(cfg, market), "rebuilt"
+        elif n == len(market.times):
+            return live.result, "unchanged"
+        else:
+            # 前計算は新しいバーの分だけ（前バー終値用に処理済みの最終バーから切り出す）
+            state = live.state
+            up = unit_path_chunk(cfg, market.closes[n - 1:], n, state)
+            T = len(market.times)
+            if up is None or up[0] > 0:
+                live = _build(cfg, market)      # 前回はwarmup中（通しで回しても短い）
+            else:
+                new = run_backtest(cfg, market=market.rows(n - 1),
+                                   snapshot_at=[np.inf], resume=live.snapshot,
+                                   unit_path=up)
+                snap = new.snapshots.pop()
+                live = LiveBacktest(_concat(live.result, new), snap, T,
+                                    data_fingerprint(market, T), live.config_fp,
+                                    state)
+            status = "extended"
+    live.save(path)
+    return live.result, status
@@ -25,6 +25,7 @@ import numpy as np
 from . import data as data_mod
 from . import decision
 from . import execution as ex
+from . import signal_state
 from . import strategy as st
 from .live_execution import BitgetLiveExecutor, OrderPlacementError
 from .notify import send_alert
@@ -32,6 +33,7 @@ from .notify import send_alert
 STATE_FILE = "state/live_state.json"
 TRADES_CSV = "state/live_trades.csv"
 EQUITY_CSV = "state/live_equity.csv"
+SIGNAL_STATE_FILE = "state/live_signal_state.json"
 
 
 class LiveGuardError(RuntimeError):
@@ -55,6 +57,7 @@ class LiveTrader:
         self.state_path = os.path.join(base_dir, STATE_FILE)
         self.trades_path = os.path.join(base_dir, TRADES_CSV)
         self.equity_path = os.path.join(base_dir, EQUITY_CSV)
+        self.signal_state_path = os.path.join(base_dir, SIGNAL_STATE_FILE)
         os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
         self.cost_model = ex.CostModel(cfg.fee_rate, cfg.slip_rate,
                                        cfg.min_notional_usd)
@@ -131,11 +134,15 @@ class LiveTrader:
                 data_mod.fetch_and_cache(cfg.db_path, sym, cfg.timeframe_min,
                                          time.time() - 3 * 86400, time.time(),
                                          "bybit")
-        times, _, closes_df = data_mod.load_universe(
-            cfg.db_path, cfg.symbols, cfg.timeframe_min)
-        closes = closes_df.to_numpy(float)
         now = now or time.time()
-        t = int(np.searchsorted(times, now, side="right")) - 1
+        # シグナル状態が有効なら前回バー以降のキャッシュだけを読んで逐次更新する
+        times, _, closes_df, t, sig_state = signal_state.load_market(
+            cfg, self.signal_state_path, now,
+            lambda since: data_mod.load_universe(cfg.db_path, cfg.symbols,
+                                                 cfg.timeframe_min, since),
+            lambda until: data_mod.history_fingerprint(cfg.db_path, cfg.symbols,
+                                                       cfg.timeframe_min, until))
+        closes = closes_df.to_numpy(float)
         if t < 0:
             raise RuntimeError("確定バーがキャッシュにありません")
 
@@ -199,7 +206,8 @@ class LiveTrader:
 
         # --- 通常リバランス ---
         orders = decision.plan_orders(cfg, closes, t, real_pos, equity,
-                                      vol_scale, self.cost_model, prices)
+                                      vol_scale, self.cost_model, prices,
+                                      signal_state=sig_state)
         # ガード③: 新規建てに必要な余力があるか（決済方向は余力を消費しない）
         available = self.executor.fetch_available_usd()
         need = sum(abs(o.qty) * prices[o.symbol] for o in orders
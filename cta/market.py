@@ -0,0 +1,148 @@
+"""バックテスト入力の束（MarketData）。
+
+run_backtest は毎回 SQLite のキャッシュDBと funding の pickle を読み直していたため、
+検証ゲート一式（全期間・walk-forward・コストストレス・感応度）で同じデータを
+40回以上読み込んでいた。MarketData は1回読んだ
+  times / opens / closes / funding / conservative
+を持ち回り、closes_ff・対数終値・リターンなどの派生配列は初回アクセス時に
+作って覚えておく（使わない派生は作らない）。
+
+配列はすべて読み取り専用（複数のバックテストで共有するため）。
+"""
+import functools
+
+import numpy as np
+
+from . import cache as cache_mod
+from . import data as data_mod
+
+
+def data_source(cfg):
+    """cfg の読み込み元（キャッシュDB・funding履歴と、履歴の無い銘柄の既定年率）。"""
+    return {"db_path": cfg.db_path, "funding_pkl": cfg.funding_pkl,
+            "funding_default_annual": dict(cfg.funding_default_annual or {})}
+
+
+def _frozen(arr):
+    arr.flags.writeable = False
+    return arr
+
+
+class MarketData:
+    """1つのユニバース・足種の価格とfundingを [T,N] 配列で持つ。
+
+    opens / closes は上場前・欠損バーがNaN。funding はバーごとのレート [T,N]、
+    conservative は実レート履歴の無い銘柄 [N]（ETFは全銘柄0・False）。
+    dtype は [T,N] 系列の保持精度（config の [engine] dtype）。
+    closes_ff_head はチャンク分割（stream.py）用: 先頭行の closes_ff の値
+    （前のチャンクから持ち越した直近有効終値）。
+    source: 読み込み元（data_source(cfg)）。load() が設定し、check() で照合する
+    （配列から直接作った束は None＝照合しない）。"""
+
+    def __init__(self, symbols, times, opens, closes, funding, conservative,
+                 timeframe_min, market="crypto", dtype="float64",
+                 closes_ff_head=None, source=None):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"storage_dtype は float64 か float32: {dtype!r}")
+        self.symbols = list(symbols)
+        self.timeframe_min = timeframe_min
+        self.market = market
+        self.times = _frozen(np.asarray(times, dtype=float))
+        self.opens = _frozen(np.asarray(opens, dtype=self.dtype))
+        self.closes = _frozen(np.asarray(closes, dtype=self.dtype))
+        self.funding = _frozen(np.asarray(funding, dtype=self.dtype))
+        self.conservative = _frozen(np.asarray(conservative, dtype=bool))
+        self.closes_ff_head = closes_ff_head
+        self.source = source
+        self._data_fp = {}
+
+    @classmethod
+    def load(cls, cfg):
+        """cfg のユニバースをキャッシュDB（とfunding履歴）から読み込む。"""
+        dtype = np.dtype(cfg.storage_dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError(f"storage_dtype は float64 か float32: {cfg.storage_dtype!r}")
+        if cfg.is_etf:
+            from . import etf_data
+            times, opens_df, closes_df = etf_data.load_universe(cfg.db_path,
+                                                                cfg.symbols)
+            # ETFにfundingは無い（保有コストは信託報酬として価格に内包済み）
+            funding = np.zeros(closes_df.shape, dtype=dtype)
+            conservative = np.zeros(len(cfg.symbols), dtype=bool)
+        else:
+            times, opens_df, closes_df = data_mod.load_universe(
+                cfg.db_path, cfg.symbols, cfg.timeframe_min)
+            funding, conservative = data_mod.load_funding(
+                cfg.funding_pkl, cfg.symbols, times, cfg.timeframe_min,
+                cfg.funding_default_annual)
+        return cls(cfg.symbols, times, opens_df.to_numpy(dtype),
+                   closes_df.to_numpy(dtype), funding.astype(dtype, copy=False),
+                   conservative, cfg.timeframe_min, cfg.market, dtype,
+                   source=data_source(cfg))
+
+    def check(self, cfg):
+        """cfg と同じユニバース・足種・精度で、同じ読み込み元（DB・funding設定）
+        から読んだデータか確かめる。"""
+        want = (list(cfg.symbols), cfg.timeframe_min, cfg.market,
+                np.dtype(cfg.storage_dtype))
+        have = (self.symbols, self.timeframe_min, self.market, self.dtype)
+        if self.source is not None:
+            want += (data_source(cfg),)
+            have += (self.source,)
+        if want != have:
+            raise ValueError(f"MarketData does not match config: "
+                             f"{have} != {want}")
+
+    def rows(self, lo, hi=None):
+        """lo..hi 行の束（スナップショットからの再開用）。配列はビューで、
+        先頭行の closes_ff はこの束の値（それより前の直近有効終値）を持ち越す。"""
+        head = self.closes_ff[lo] if lo < len(self.times) else None
+        return MarketData(self.symbols, self.times[lo:hi], self.opens[lo:hi],
+                          self.closes[lo:hi], self.funding[lo:hi], self.conservative,
+                          self.timeframe_min, self.market, self.dtype,
+                          closes_ff_head=head, source=self.source)
+
+    @property
+    def shape(self):
+        return self.closes.shape
+
+    @functools.cached_property
+    def closes_ff(self):
+        """時価評価用: 上場前はNaNのまま、欠損バーは直近の有効終値で埋めた終値。"""
+        c = self.closes
+        if self.closes_ff_head is not None and len(c):
+            c = c.copy()
+            c[0] = self.closes_ff_head
+        T, N = c.shape
+        last = np.where(np.isnan(c), 0, np.arange(T)[:, None])
+        np.maximum.accumulate(last, axis=0, out=last)
+        return _frozen(c[last, np.arange(N)])
+
+    @functools.cached_property
+    def logc(self):
+        return _frozen(np.log(self.closes))
+
+    @functools.cached_property
+    def rets(self):
+        """対数リターン [T,N]（先頭行はNaN）。"""
+        N = self.closes.shape[1]
+        return _frozen(np.vstack([np.full((1, N), np.nan, dtype=self.dtype),
+                                  np.diff(self.logc, axis=0)]))
+
+    @functools.cached_property
+    def fingerprint(self):
+        """対数終値パネルの指紋（sig/vol キャッシュのキー）。"""
+        return cache_mod.fingerprint(self.logc)
+
+    def data_fingerprint(self, n_bars=None):
+        """先頭 n_bars 本（省略時は全部）の入力（時刻・始値・終値・funding・
+        保守的課金フラグ）の指紋。バックテストは因果的なので、終了バーまでの
+        入力が同じなら結果も同じ（ライブバックテスト・結果キャッシュのキー）。"""
+        n = len(self.times) if n_bars is None else int(n_bars)
+        if n not in self._data_fp:
+            parts = [cache_mod.fingerprint(a[:n]) for a in
+                     (self.times, self.opens, self.closes, self.funding)]
+            parts.append(cache_mod.fingerprint(self.conservative))
+            self._data_fp[n] = cache_mod.make_key("data", parts=parts)
+        return self._data_fp[n]
@@ -3,70 +3,336 @@ import datetime as dt
 
 import numpy as np
 
+from . import execution as ex
 
-def compute_metrics(res, bars_per_year):
-    """BacktestResult -> dict。equity系列とfillsから全指標を計算する。"""
-    eq = res.equity
+
+def _quarterly_sums(times, values):
+    """時刻順の values を times の四半期（UTC）ごとに先頭から順に足した
+    {"2024Q1": 合計, ...}（出現順）。
+
+    四半期は epoch を datetime64 の月に落として求め、各四半期の合計は
+    execution.sequential_sum でバー順に足す（1本ずつ dict に足していたときと
+    丸めまで一致させる。np.sum / reduceat はペアワイズ加算になりうる）。"""
+    if len(values) == 0:
+        return {}
+    months = np.floor(times).astype(np.int64).astype("datetime64[s]") \
+        .astype("datetime64[M]").astype(np.int64)
+    quarters = months // 3
+    starts = np.r_[0, np.flatnonzero(np.diff(quarters)) + 1]
+    lens = np.diff(np.r_[starts, len(values)])
+    # 四半期×バーの表に詰めて行ごとに足す（末尾の0埋めは合計を変えない）
+    table = np.zeros((len(starts), int(lens.max())))
+    table[np.repeat(np.arange(len(starts)), lens),
+          np.arange(len(values)) - np.repeat(starts, lens)] = values
+    sums = ex.sequential_sum(0.0, table)
+    return {f"{q // 4 + 1970}Q{q % 4 + 1}": sums[i]
+            for i, q in enumerate(quarters[starts].tolist())}
+
+
+_MOMENT_CHUNK = 256
+
+
+def _chan(na, ma, m2a, nb, mb, m2b):
+    """(本数, 平均, 偏差平方和) の2組を合併する（Chan らの並列公式）。"""
+    if na == 0:
+        return nb, mb, m2b
+    n = na + nb
+    delta = mb - ma
+    return n, ma + delta * nb / n, m2a + m2b + delta * delta * na * nb / n
+
+
+class _Moments:
+    """系列の本数・平均・偏差平方和。先頭から _MOMENT_CHUNK 本ずつの塊ごとに
+    平均と偏差平方和を取り、塊の順に _chan() で畳み込む。塊の切れ目は系列の
+    先頭からの本数で決まるので、何回に分けて push しても（全系列を一度に
+    渡しても）値はビット単位で同じになる。"""
+
+    def __init__(self):
+        self.n, self.mean, self.m2 = 0, 0.0, 0.0
+        self._pending = np.empty(0)
+
+    @staticmethod
+    def _chunk(x):
+        mean = x.sum() / len(x)
+        return len(x), mean, ((x - mean) ** 2).sum()
+
+    def push(self, x):
+        x = np.concatenate([self._pending, np.asarray(x, dtype=float)])
+        C = _MOMENT_CHUNK
+        full = len(x) // C * C
+        for a in range(0, full, C):
+            self.n, self.mean, self.m2 = _chan(self.n, self.mean, self.m2,
+                                               *self._chunk(x[a:a + C]))
+        self._pending = x[full:].copy()
+
+    def result(self):
+        """(本数, 平均, 偏差平方和)。端数の塊も合併した値（状態は変えない）。"""
+        if len(self._pending) == 0:
+            return self.n, self.mean, self.m2
+        return _chan(self.n, self.mean, self.m2, *self._chunk(self._pending))
+
+
+def _sd(moments):
+    """母標準偏差（ddof=0）。"""
+    n, _, m2 = moments.result()
+    return float(np.sqrt(m2 / n))
+
+
+def _sequential_mean(x):
+    """先頭から順に足した平均（逐次集計の RunningEquityStats と丸めまで揃える）。"""
+    return float(ex.sequential_sum(0.0, np.asarray(x, dtype=float)[None])[0] / len(x))
+
+
+def equity_stats(times, eq):
+    """equity系列から、年率化前の統計（bars_per_year に依らない部分）を求める。
+
+    record="summary" のバックテストは系列を持たず、同じ統計を
+    RunningEquityStats で逐次集計する（値はビット単位で一致する）。
+    系列が短すぎる・初期equityが0以下なら None。"""
     if len(eq) < 3 or eq[0] <= 0:
-        return {"valid": False}
+        return None
     rets = np.diff(np.log(np.maximum(eq, 1e-9)))
-    years = len(eq) / bars_per_year
-
-    ann_ret = (eq[-1] / eq[0]) ** (1 / years) - 1 if years > 0 else 0.0
-    mu, sd = rets.mean(), rets.std()
-    sharpe = mu / sd * np.sqrt(bars_per_year) if sd > 0 else 0.0
-    downside = rets[rets < 0]
-    sortino = (mu / downside.std() * np.sqrt(bars_per_year)
-               if len(downside) > 1 and downside.std() > 0 else 0.0)
+    ret_m, down_m = _Moments(), _Moments()
+    ret_m.push(rets)
+    down_m.push(rets[rets < 0])
+    down_sd = _sd(down_m) if down_m.result()[0] > 1 else 0.0
 
     peak = np.maximum.accumulate(eq)
     dd = 1 - eq / peak
-    maxdd = float(dd.max())
-    # DD継続期間（最長の水面下バー数 → 日数）
-    under, longest, cur = dd > 1e-9, 0, 0
-    for u in under:
-        cur = cur + 1 if u else 0
-        longest = max(longest, cur)
-    dd_days = longest / (bars_per_year / 365)
+    # DD継続期間（最長の水面下バー数）: 水面下の連続区間の長さの最大
+    edges = np.diff(np.r_[0, (dd > 1e-9).astype(np.int8), 0])
+    runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    longest = int(runs.max()) if len(runs) else 0
 
-    # 取引統計
+    # 四半期別PnL（バー i の損益 eq[i]-eq[i-1] を times[i] の四半期に入れる）
+    qpnl = _quarterly_sums(times[1:], np.diff(eq))
+    return {"n_bars": len(eq), "start": float(times[0]), "end": float(times[-1]),
+            "first": float(eq[0]), "last": float(eq[-1]),
+            "mean_ret": float(ret_m.result()[1]), "sd_ret": _sd(ret_m),
+            "down_sd": down_sd, "maxdd": float(dd.max()), "dd_bars": longest,
+            "quarterly_pnl": qpnl, "avg_equity": _sequential_mean(eq)}
+
+
+class RunningEquityStats:
+    """equity_stats() を系列を持たずに逐次集計する
+    （record="summary" のバックテスト用。S 本のシナリオを [S] の配列で持つ）。
+
+    add() / add_block() に時刻と equity の行 [S]（ブロックは [L,S]）を渡す。
+    NaN はそのシナリオの記録対象外のバー（開始前・窓の終了後）。行は
+    固定長のバッファに溜めてまとめて畳み込むので、メモリは本数に依らない。
+      - 対数リターンと下方リターンの平均・分散: equity_stats() と同じ
+        塊ごとの集計を Chan の式で合併（_Moments）
+      - 最大DD・水面下の最長連続本数: 直近のピークと連続本数を持ち越す
+      - 四半期PnL・平均equity・平均グロス: バー順に足す（execution.sequential_sum）
+    どれも切れ目を系列の先頭からの本数で決めるかバー順に足すので、値は
+    畳み込みの切り方（窓をまとめて回すか個別に回すか）に依らず、
+    equity_stats() とビット単位で一致する。"""
+
+    _BUFFER = 512
+
+    def __init__(self, n_scenarios):
+        S = n_scenarios
+        self.n = np.zeros(S, dtype=np.int64)
+        self.first, self.last = np.full(S, np.nan), np.full(S, np.nan)
+        self.start, self.end = np.full(S, np.nan), np.full(S, np.nan)
+        self._ret = [_Moments() for _ in range(S)]
+        self._down = [_Moments() for _ in range(S)]
+        self.peak, self.maxdd = np.full(S, -np.inf), np.zeros(S)
+        self.run, self.longest = np.zeros(S, dtype=np.int64), np.zeros(S, dtype=np.int64)
+        self.eq_sum = np.zeros(S)
+        self.gross_sum, self.gross_max = np.zeros(S), np.full(S, -np.inf)
+        self.quarters = [{} for _ in range(S)]
+        self._q, self._q_sum = np.full(S, -1, dtype=np.int64), np.zeros(S)
+        self._times = np.empty(self._BUFFER)
+        self._eq = np.empty((self._BUFFER, S))
+        self._gross = np.zeros((self._BUFFER, S))
+        self._len = 0
+
+    def add(self, time, eq, gross=None):
+        """1バー分（eq / gross は [S]）。"""
+        if self._len == self._BUFFER:
+            self._flush()
+        i = self._len
+        self._times[i], self._eq[i] = time, eq
+        self._gross[i] = 0.0 if gross is None else gross
+        self._len += 1
+
+    def add_block(self, times, eq, gross=None):
+        """連続する L バー分（times [L]、eq / gross は [L,S]）。"""
+        L, i = len(times), 0
+        while i < L:
+            if self._len == self._BUFFER:
+                self._flush()
+            n = min(self._BUFFER - self._len, L - i)
+            rows = slice(self._len, self._len + n)
+            self._times[rows], self._eq[rows] = times[i:i + n], eq[i:i + n]
+            self._gross[rows] = 0.0 if gross is None else gross[i:i + n]
+            self._len += n
+            i += n
+
+    def _flush(self):
+        if self._len:
+            n, self._len = self._len, 0
+            self._fold(self._times[:n], self._eq[:n], self._gross[:n])
+
+    def _fold(self, times, eq, gross):
+        L, S = eq.shape
+        ok = ~np.isnan(eq)
+        has = ok.any(axis=0)
+        if not has.any():
+            return
+        first_i = ok.argmax(axis=0)
+        last_i = L - 1 - ok[::-1].argmax(axis=0)
+        new = has & (self.n == 0)
+        cols = np.arange(S)
+        self.first[new] = eq[first_i, cols][new]
+        self.start[new] = times[first_i][new]
+
+        # 前のブロックの最終値を先頭に付けて差分を取る（記録対象外の境目は NaN）
+        prev = np.where(self.n > 0, self.last, np.nan)
+        logs = np.log(np.maximum(np.vstack([prev, eq]), 1e-9))
+        rets = np.diff(logs, axis=0)
+        for k in np.flatnonzero(~np.isnan(rets).all(axis=0)):
+            r = rets[:, k]
+            r = r[~np.isnan(r)]          # 記録対象のバーは連続している
+            self._ret[k].push(r)
+            self._down[k].push(r[r < 0])
+
+        with np.errstate(invalid="ignore"):
+            peak = np.fmax.accumulate(np.vstack([self.peak, eq]), axis=0)[1:]
+            dd = 1 - eq / peak
+        self.peak = peak[-1]
+        self.maxdd = np.fmax(self.maxdd, np.fmax.reduce(dd, axis=0))
+        # 水面下の連続本数: 直近の水面上のバーからの本数（ブロック内に無ければ持ち越し）
+        idx = np.arange(L)[:, None]
+        with np.errstate(invalid="ignore"):
+            under = dd > 1e-9
+        reset = np.maximum.accumulate(np.where(under, -1, idx), axis=0)
+        runs = np.where(reset < 0, idx + 1 + self.run, idx - reset)
+        self.longest = np.maximum(self.longest, runs.max(axis=0))
+        self.run = runs[-1]
+
+        # 四半期PnL（バーの損益はそのバーの四半期へ。四半期内はバー順に足す）
+        pnl = np.diff(np.vstack([prev, eq]), axis=0)
+        quarters = (np.floor(times).astype(np.int64).astype("datetime64[s]")
+                    .astype("datetime64[M]").astype(np.int64) // 3)
+        starts = np.r_[0, np.flatnonzero(np.diff(quarters)) + 1, L]
+        for a, b in zip(starts[:-1], starts[1:]):
+            q = int(quarters[a])
+            seg = pnl[a:b]
+            opened = (~np.isnan(seg)).any(axis=0)
+            for k in np.flatnonzero(opened & (self._q != q)):
+                self._close_quarter(k)
+                self._q[k], self._q_sum[k] = q, 0.0
+            self._q_sum[opened] = ex.sequential_sum(
+                self._q_sum[opened], np.nan_to_num(seg[:, opened].T))
+
+        self.eq_sum = ex.sequential_sum(self.eq_sum, np.where(ok, eq, 0.0).T)
+        if gross is not None:
+            g = np.where(ok, gross, 0.0)
+            self.gross_sum = ex.sequential_sum(self.gross_sum, g.T)
+            self.gross_max = np.fmax(self.gross_max,
+                                     np.where(ok, gross, -np.inf).max(axis=0))
+        self.n += ok.sum(axis=0)
+        self.last[has] = eq[last_i, cols][has]
+        self.end[has] = times[last_i][has]
+
+    def _close_quarter(self, k):
+        q = int(self._q[k])
+        if q >= 0:
+            self.quarters[k][f"{q // 4 + 1970}Q{q % 4 + 1}"] = float(self._q_sum[k])
+            self._q[k] = -1
+
+    def result(self, k):
+        """シナリオ k の equity_stats() 相当の dict（短すぎる・初期equityが
+        0以下なら None）。"""
+        self._flush()
+        n = int(self.n[k])
+        if n < 3 or self.first[k] <= 0:
+            return None
+        self._close_quarter(k)
+        ret_m, down_m = self._ret[k], self._down[k]
+        return {"n_bars": n, "start": float(self.start[k]), "end": float(self.end[k]),
+                "first": float(self.first[k]), "last": float(self.last[k]),
+                "mean_ret": float(ret_m.result()[1]), "sd_ret": _sd(ret_m),
+                "down_sd": _sd(down_m) if down_m.result()[0] > 1 else 0.0,
+                "maxdd": float(self.maxdd[k]), "dd_bars": int(self.longest[k]),
+                "quarterly_pnl": self.quarters[k],
+                "avg_equity": float(self.eq_sum[k] / n)}
+
+    def gross(self, k):
+        """シナリオ k の (平均グロス, 最大グロス)（記録したバーが無ければ 0）。"""
+        self._flush()
+        n = int(self.n[k])
+        if n == 0:
+            return 0.0, 0.0
+        return float(self.gross_sum[k] / n), float(self.gross_max[k])
+
+
+def _trade_stats(res):
+    """取引・資産別・グロスの集計。record="full" なら配列とfillsから求め、
+    それ以外はエンジンが記録中に集計した res.stats を使う。"""
+    if res.record != "full":
+        return res.stats
     fills = res.fills
-    n_trades = len(fills)
-    total_slip = sum(abs(f.slippage_usd) for f in fills)
-    total_dev = sum(f.signal_deviation_usd for f in fills)
+    gross = np.abs(res.weights).sum(axis=1, dtype=float)
+    return {"n_trades": len(fills),
+            "slippage_usd": fills.total(np.abs(fills.slippage_usd)),
+            "signal_deviation_usd": fills.total(fills.signal_deviation_usd),
+            # float32保持でもfloat64で集計
+            "asset_pnl": res.asset_pnl.sum(axis=0, dtype=float),
+            "avg_gross": _sequential_mean(gross), "max_gross": float(gross.max())}
+
+
+def compute_metrics(res, bars_per_year):
+    """BacktestResult -> dict。equity系列とfillsから全指標を計算する。
+
+    record="equity" / "summary" の結果でも同じ dict を返す（記録中に集計した
+    値を使うので、record="full" と値は一致する）。"""
+    es = (res.stats["equity"] if res.record == "summary"
+          else equity_stats(res.times, res.equity))
+    if es is None:
+        return {"valid": False}
+    years = es["n_bars"] / bars_per_year
+
+    ann_ret = (es["last"] / es["first"]) ** (1 / years) - 1 if years > 0 else 0.0
+    mu, sd, down_sd = es["mean_ret"], es["sd_ret"], es["down_sd"]
+    sharpe = mu / sd * np.sqrt(bars_per_year) if sd > 0 else 0.0
+    sortino = mu / down_sd * np.sqrt(bars_per_year) if down_sd > 0 else 0.0
+    dd_days = es["dd_bars"] / (bars_per_year / 365)
+
+    # 取引統計
+    ts = _trade_stats(res)
+    total_slip = ts["slippage_usd"]
 
     # 四半期別PnLと利益集中度
-    qpnl = {}
-    for i in range(1, len(eq)):
-        d = dt.datetime.utcfromtimestamp(res.times[i])
-        q = f"{d.year}Q{(d.month - 1) // 3 + 1}"
-        qpnl[q] = qpnl.get(q, 0.0) + (eq[i] - eq[i - 1])
-    total_pnl = eq[-1] - eq[0]
+    qpnl = es["quarterly_pnl"]
+    total_pnl = es["last"] - es["first"]
     pos_q = {k: v for k, v in qpnl.items() if v > 0}
     top_q_share = (max(pos_q.values()) / sum(pos_q.values())
                    if pos_q else 0.0)
 
     # 資産別PnL集中度
-    asset_tot = res.asset_pnl.sum(axis=0)
+    asset_tot = ts["asset_pnl"]
     pos_assets = asset_tot[asset_tot > 0]
     top_asset_share = (pos_assets.max() / pos_assets.sum()
                        if len(pos_assets) and pos_assets.sum() > 0 else 0.0)
 
-    avg_eq = float(np.mean(eq))
+    avg_eq = es["avg_equity"]
     return {
         "valid": True,
-        "start": dt.datetime.utcfromtimestamp(res.times[0]).strftime("%Y-%m-%d"),
-        "end": dt.datetime.utcfromtimestamp(res.times[-1]).strftime("%Y-%m-%d"),
+        "start": dt.datetime.utcfromtimestamp(es["start"]).strftime("%Y-%m-%d"),
+        "end": dt.datetime.utcfromtimestamp(es["end"]).strftime("%Y-%m-%d"),
         "years": years,
-        "final_equity": float(eq[-1]),
+        "final_equity": es["last"],
         "total_pnl": float(total_pnl),
         "ann_return": float(ann_ret),
         "ann_vol": float(sd * np.sqrt(bars_per_year)),
         "sharpe": float(sharpe),
         "sortino": float(sortino),
-        "maxdd": maxdd,
+        "maxdd": es["maxdd"],
         "maxdd_days": float(dd_days),
-        "n_trades": n_trades,
+        "n_trades": ts["n_trades"],
         "turnover_usd": res.turnover_usd,
         "turnover_x": res.turnover_usd / avg_eq / years if years > 0 else 0.0,
         "fees_usd": res.fees_usd,
@@ -74,13 +340,13 @@ def compute_metrics(res, bars_per_year):
         "slippage_usd": total_slip,
         "cost_drag_pct": ((res.fees_usd + res.funding_usd + total_slip)
                           / avg_eq / years * 100 if years > 0 else 0.0),
-        "signal_deviation_usd": total_dev,
+        "signal_deviation_usd": ts["signal_deviation_usd"],
         "top_quarter_share": float(top_q_share),
         "top_asset_share": float(top_asset_share),
         "quarterly_pnl": qpnl,
         "asset_pnl": {s: float(v) for s, v in zip(res.symbols, asset_tot)},
-        "avg_gross": float(np.abs(res.weights).sum(axis=1).mean()),
-        "max_gross": float(np.abs(res.weights).sum(axis=1).max()),
+        "avg_gross": ts["avg_gross"],
+        "max_gross": ts["max_gross"],
         "halted": res.halted_at is not None,
     }
 
@@ -88,11 +354,14 @@ def compute_metrics(res, bars_per_year):
 def yearly_metrics(res, bars_per_year):
     """暦年ごとの指標（walk-forward窓・レジーム分析用）。"""
     out = {}
-    years = sorted({dt.datetime.utcfromtimestamp(t).year for t in res.times})
-    for y in years:
-        t0 = dt.datetime(y, 1, 1).replace(tzinfo=dt.timezone.utc).timestamp()
-        t1 = dt.datetime(y + 1, 1, 1).replace(tzinfo=dt.timezone.utc).timestamp()
-        sub = res.slice(t0, t1)
+    if len(res.times) == 0:
+        return out
+    y0 = dt.datetime.utcfromtimestamp(res.times[0]).year
+    y1 = dt.datetime.utcfromtimestamp(res.times[-1]).year
+    years = range(y0, y1 + 1)
+    bounds = [dt.datetime(y, 1, 1, tzinfo=dt.timezone.utc).timestamp()
+              for y in range(y0, y1 + 2)]
+    for y, sub in zip(years, res.windows(bounds)):
         if len(sub.equity) > bars_per_year // 12:  # 1ヶ月分以上あるときのみ
             out[y] = compute_metrics(sub, bars_per_year)
     return out
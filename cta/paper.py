@@ -18,7 +18,9 @@ import time
 import numpy as np
 
 from . import data as data_mod
+from . import decision
 from . import execution as ex
+from . import signal_state
 from . import strategy as st
 
 STATE_FILE = "state/paper_state.json"
@@ -41,6 +43,8 @@ class PaperTrader:
         self.state_path = os.path.join(base_dir, f"state/{pre}paper_state.json")
         self.trades_path = os.path.join(base_dir, f"state/{pre}paper_trades.csv")
         self.equity_path = os.path.join(base_dir, f"state/{pre}paper_equity.csv")
+        self.signal_state_path = os.path.join(
+            base_dir, f"state/{pre}paper_signal_state.json")
         os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
         self.cost_model = ex.CostModel(cfg.fee_rate, cfg.slip_rate,
                                        cfg.min_notional_usd)
@@ -64,7 +68,7 @@ class PaperTrader:
     def _save_state(self):
         with open(self.state_path, "w") as f:
             json.dump({"cash_usd": self.pf.cash_usd,
-                       "positions": self.pf.positions,
+                       "positions": dict(self.pf.positions),
                        "peak": self.breaker.peak,
                        "halted": self.breaker.halted,
                        "last_bar": self.last_bar,
@@ -110,12 +114,21 @@ class PaperTrader:
                                      self.cfg.timeframe_min, since,
                                      time.time(), self.exchange_id)
 
-    def _load_universe(self):
+    def _load_universe(self, since_epoch=None):
         if self.cfg.is_etf:
             from . import etf_data
-            return etf_data.load_universe(self.cfg.db_path, self.cfg.symbols)
+            return etf_data.load_universe(self.cfg.db_path, self.cfg.symbols,
+                                          since_epoch)
         return data_mod.load_universe(self.cfg.db_path, self.cfg.symbols,
-                                      self.cfg.timeframe_min)
+                                      self.cfg.timeframe_min, since_epoch)
+
+    def _history_fingerprint(self, until_epoch):
+        if self.cfg.is_etf:
+            from . import etf_data
+            return etf_data.history_fingerprint(self.cfg.db_path, self.cfg.symbols,
+                                                until_epoch)
+        return data_mod.history_fingerprint(self.cfg.db_path, self.cfg.symbols,
+                                            self.cfg.timeframe_min, until_epoch)
 
     def live_mid(self, symbol):
         if self.cfg.is_etf:
@@ -140,10 +153,12 @@ class PaperTrader:
         cfg = self.cfg
         if refresh:
             self.refresh_cache()
-        times, opens_df, closes_df = self._load_universe()
-        closes = closes_df.to_numpy(float)
         now = now or time.time()
-        t = int(np.searchsorted(times, now, side="right")) - 1
+        # シグナル状態が有効なら前回バー以降のキャッシュだけを読んで逐次更新する
+        times, opens_df, closes_df, t, sig_state = signal_state.load_market(
+            cfg, self.signal_state_path, now, self._load_universe,
+            self._history_fingerprint)
+        closes = closes_df.to_numpy(float)
         if t < 0:
             raise RuntimeError("no completed bar in cache")
         is_new_bar = times[t] > self.last_bar
@@ -195,32 +210,13 @@ class PaperTrader:
             return {"skipped": "bar already processed", "bar": float(times[t]),
                     "equity": eq, "halted": False}
         else:
-            bpd, bpy = cfg.bars_per_day, cfg.bars_per_year
-            logc = np.log(closes)
-            rets = np.vstack([np.full((1, closes.shape[1]), np.nan),
-                              np.diff(logc, axis=0)])
-            horizons = [(f * bpd, s * bpd) for f, s in cfg.horizons_days]
-            sig_t = np.array([st.trend_signal(logc[:t + 1, j], horizons)[-1]
-                              for j in range(closes.shape[1])])
-            vol_t = np.array([st.trailing_vol(rets[:t + 1, j],
-                                              cfg.vol_window_days * bpd, bpy)[-1]
-                              for j in range(closes.shape[1])])
-            w = st.target_weights(sig_t, vol_t,
-                                  rets[t - cfg.vol_window_days * bpd:t],
-                                  cfg.target_vol * vol_scale, cfg.max_gross, bpy,
-                                  long_only=cfg.long_only)
-            for j, sym in enumerate(cfg.symbols):
-                if sym not in prices or np.isnan(closes[t, j]):
-                    continue
-                od = ex.plan_rebalance(sym, self.pf.positions.get(sym, 0.0),
-                                       w[j] * eq, closes[t, j], eq,
-                                       self.cost_model, cfg.no_trade_band_pct,
-                                       integer_shares=cfg.integer_shares,
-                                       lot_size=cfg.lot_size(sym))
-                if od is not None:
-                    # ref価格=発注時のlive mid（backtestでは次足始値に相当）
-                    fills.append(ex.execute_order(od, prices[sym],
-                                                  self.cost_model, ts=now))
+            orders = decision.plan_orders(cfg, closes, t, self.pf.positions, eq,
+                                          vol_scale, self.cost_model, prices,
+                                          signal_state=sig_state)
+            for od in orders:
+                # ref価格=発注時のlive mid（backtestでは次足始値に相当）
+                fills.append(ex.execute_order(od, prices[od.symbol],
+                                              self.cost_model, ts=now))
 
         for f in fills:
             self.pf.apply_fill(f)
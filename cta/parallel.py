@@ -0,0 +1,108 @@
+"""検証ゲートのプロセス並列実行（価格パネルは共有メモリ）。
+
+run_validation.py の全期間・walk-forward・コストストレス・感応度は合計50本前後の
+バックテストで、1コアで順に回していた。CellPool は
+  - MarketData の times / opens / closes / funding / conservative を
+    multiprocessing.shared_memory に1回だけ置き、
+  - ワーカープロセスは起動時にそれをコピーせずに MarketData として開き
+    （SQLite・funding pickle を読み直さない）、
+  - セル（暦年窓・シナリオの塊）を map して入力と同じ順に結果を返す
+ことで、コア数ぶん並べて回す。各セルの計算は直列のときと同じ関数・同じ入力
+なので、結果はワーカー数によらずビット単位で同じ。
+
+ワーカーは spawn で起動する（numba / BLAS のスレッドが動いた後の fork は安全でない）。
+workers が1以下なら共有メモリもプロセスも作らず、その場で順に回す。
+"""
+import concurrent.futures
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import cache as cache_mod
+from .market import MarketData
+
+_FIELDS = ("times", "opens", "closes", "funding", "conservative")
+
+# ワーカー内の状態（_attach で設定）
+_market = None
+_blocks = []
+
+
+def _attach(spec, disk_dir, max_disk_bytes):
+    """ワーカーの初期化: 共有メモリのパネルを MarketData として開く。"""
+    global _market
+    arrays = {}
+    for name, (block, shape, dtype) in spec["arrays"].items():
+        shm = shared_memory.SharedMemory(name=block)
+        _blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _market = MarketData(spec["symbols"], *(arrays[f] for f in _FIELDS),
+                         spec["timeframe_min"], spec["market"], spec["dtype"],
+                         source=spec["source"])
+    if disk_dir:
+        cache_mod.set_disk_dir(disk_dir, max_disk_bytes)
+
+
+def _call(fn, cfg, item):
+    return fn(cfg, _market, item)
+
+
+class CellPool:
+    """market を共有するワーカープール。with で使い、抜けると共有メモリを解放する。
+
+    map(fn, cfg, items) は fn(cfg, market, item) を items の順に並べたリストを返す。
+    fn はモジュールのトップレベル関数（pickle できるもの）であること。"""
+
+    def __init__(self, market, workers=1):
+        self.market = market
+        self.workers = max(1, int(workers or 1))
+        self._blocks = []
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _spec(self):
+        m = self.market
+        spec = {"symbols": m.symbols, "timeframe_min": m.timeframe_min,
+                "market": m.market, "dtype": m.dtype.name, "source": m.source,
+                "arrays": {}}
+        for name in _FIELDS:
+            arr = getattr(m, name)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            self._blocks.append(shm)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            spec["arrays"][name] = (shm.name, arr.shape, arr.dtype.str)
+        return spec
+
+    def _start(self):
+        if self._executor is None:
+            dc = cache_mod.default_cache()
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_attach,
+                initargs=(self._spec(), dc.disk_dir, dc.max_disk_bytes))
+        return self._executor
+
+    def map(self, fn, cfg, items):
+        items = list(items)
+        if self.workers == 1 or len(items) <= 1:
+            return [fn(cfg, self.market, item) for item in items]
+        return list(self._start().map(_call, itertools.repeat(fn),
+                                      itertools.repeat(cfg), items))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
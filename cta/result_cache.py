@@ -0,0 +1,97 @@
+"""バックテスト結果（メトリクスとequity系列）の永続キャッシュ。
+
+検証ゲートは、レポートだけ直したときや walk-forward に1年足しただけのときでも、
+全セルを回し直していた。ここでは1本のバックテストの
+  compute_metrics の dict
+を .npz に保存し、次のキーで引く（ゲートは指標しか使わず record="summary" で
+回すので系列は持たない）。
+  - 設定: cfg.config_sha1 と、結果に効く設定値の指紋
+  - カーネル: 実際に使われるバックエンド（numba と numpy は丸めまで一致する
+    保証が無いので、片方で計算した結果をもう片方の実行に返さない）
+  - データ: 終了バーまでの入力の指紋（それより後のバーが増えても変わらない）
+  - コード: 結果に効くコード（cta/ から report.py を除いたもの）を最後に変えた
+    git コミットと、未コミットの差分の指紋
+  - 上書き: 期間（start/end）とシナリオ（cost_mult / target_vol / horizons / vol窓 ...）
+ディレクトリの合計サイズに上限を持ち、最終アクセスの古いものから消す（LRU）。
+git が使えずコードの版が分からないときはキャッシュしない。
+"""
+import json
+import os
+
+import numpy as np
+
+from . import cache as cache_mod
+from . import kernels
+from .cache import code_version
+from .engine import _resolve_scenario
+from .live_backtest import config_fingerprint
+
+DEFAULT_MAX_BYTES = 2**30
+
+
+class ResultCache:
+    """directory 直下の .npz に結果を持つキャッシュ（合計 max_bytes まで）。"""
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+
+    def key(self, cfg, market, scenario=None, start_epoch=None, end_epoch=None):
+        """キー文字列（コードの版が分からなければ None＝キャッシュしない）。"""
+        code = code_version()
+        if code is None:
+            return None
+        t_end = (len(market.times) if end_epoch is None
+                 else int(np.searchsorted(market.times, end_epoch)))
+        return cache_mod.make_key(
+            "result", config_sha1=cfg.config_sha1, config=config_fingerprint(cfg),
+            data=market.data_fingerprint(t_end), code=code,
+            backend=kernels.resolve(cfg.kernel_backend),
+            scenario=_resolve_scenario(cfg, scenario or {}),
+            start_epoch=start_epoch, end_epoch=end_epoch)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """メトリクスの dict か、無ければ None。"""
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                out = json.loads(str(z["metrics"]))
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)             # LRU順はmtimeで管理
+        except OSError:                # 読んだ直後に他プロセスの上限管理が消した
+            pass
+        self.hits += 1
+        return out
+
+    def put(self, key, metrics):
+        if key is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, metrics=np.array(json.dumps(metrics, default=float)))
+        os.replace(tmp, self._path(key))
+        cache_mod.evict_lru(self.directory, self.max_bytes)
+
+
+_default = None
+
+
+def default():
+    """set_dir() で有効にしたキャッシュ（既定は無効＝None）。"""
+    return _default
+
+
+def set_dir(path, max_bytes=DEFAULT_MAX_BYTES):
+    """結果キャッシュの置き場を設定する（Noneで無効化）。"""
+    global _default
+    _default = ResultCache(path, max_bytes) if path else None
@@ -0,0 +1,282 @@
+"""シグナルの逐次更新状態（ペーパー/ライブの4H cron用）。
+
+判断に必要なのは最終バーのシグナル・vol・共分散窓だけなのに、毎サイクル
+全履歴の log・リターン・EWMA・trailing vol を計算し直すのは無駄が大きい
+（RPiで数年分のキャンドルを読み直していた）。本モジュールは
+  - スパンごとのEWMA値・有効本数（成熟判定用）
+  - 直近vol窓分のリターンのリングバッファ（trailing vol と共分散窓を兼ねる）
+を銘柄ごとに保持し、新しいバー1本あたり O(N·H) で更新する。
+
+計算式は strategy.trend_signal_panel / trailing_vol と同じで、EWMAは
+ビット単位で一致する（volは累積和版と同程度の丸め差のみ）。
+状態は paper_state.json / live_state.json の隣にJSONで保存し、
+最終処理バーの時刻と終値、および最終処理バーまでの履歴の指紋
+（data.history_fingerprint: キャッシュDBの集計）が読み込んだキャッシュと
+一致しない場合（過去バーの修正・ユニバース変更など）は全履歴から作り直す。
+"""
+import json
+import os
+
+import numpy as np
+
+from . import strategy as st
+
+
+class IncrementalSignalState:
+    def __init__(self, symbols, horizons_bars, vol_window, bars_per_year):
+        self.symbols = list(symbols)
+        self.horizons_bars = [(int(f), int(s)) for f, s in horizons_bars]
+        self.vol_window = int(vol_window)
+        self.bars_per_year = bars_per_year
+        N = len(self.symbols)
+        self.spans = sorted({s for h in self.horizons_bars for s in h})
+        self.alpha = 2.0 / (np.array(self.spans, dtype=float) + 1.0)[:, None]
+        self.ewma = np.full((len(self.spans), N), np.nan)
+        self.n_valid = np.zeros(N, dtype=int)
+        self.last_logc = np.full(N, np.nan)
+        # ring: rets[t-W..t-1]（最終バーtの判定に使う窓）。pending_ret=rets[t]は
+        # 次のバーが来たときに窓へ入れる
+        self.ring = np.full((self.vol_window, N), np.nan)
+        self.head = 0
+        self.pending_ret = np.full(N, np.nan)
+        self.n_bars = 0
+        self.last_time = None
+        self.last_close = None
+        self.history_fp = None      # 最終処理バーまでの履歴の指紋（load_market が設定）
+        self._sums()
+
+    @classmethod
+    def for_config(cls, cfg):
+        bpd = cfg.bars_per_day
+        return cls(cfg.symbols, [(f * bpd, s * bpd) for f, s in cfg.horizons_days],
+                   cfg.vol_window_days * bpd, cfg.bars_per_year)
+
+    def params(self):
+        return {"symbols": self.symbols,
+                "horizons_bars": [list(h) for h in self.horizons_bars],
+                "vol_window": self.vol_window,
+                "bars_per_year": self.bars_per_year}
+
+    # --- 構築 -----------------------------------------------------------
+    @classmethod
+    def from_history(cls, symbols, horizons_bars, vol_window, bars_per_year,
+                     times, closes):
+        """全履歴 closes[T,N] を一括（ベクトル化）で処理し、最終バーの状態を作る。"""
+        self = cls(symbols, horizons_bars, vol_window, bars_per_year)
+        closes = np.asarray(closes, dtype=float)
+        T, N = closes.shape
+        if T == 0:
+            return self
+        logc = np.log(closes)
+        rets = np.vstack([np.full((1, N), np.nan), np.diff(logc, axis=0)])
+        K = len(self.spans)
+        ew = st.ewma(np.tile(logc, (1, K)), np.repeat(self.spans, N))
+        self.ewma = ew[-1].reshape(K, N).copy()
+        self.n_valid = (~np.isnan(logc)).sum(axis=0)
+        self.last_logc = logc[-1].copy()
+        W = self.vol_window
+        window = rets[max(0, T - 1 - W):T - 1]
+        self.ring[W - len(window):] = window
+        self.head = 0
+        self.pending_ret = rets[-1].copy()
+        self.n_bars = T
+        self.last_time = float(times[-1])
+        self.last_close = closes[-1].copy()
+        self._sums()
+        return self
+
+    # --- 逐次更新 -------------------------------------------------------
+    def update(self, time, close_row):
+        """新しい確定バー1本（時刻と終値 [N]）を取り込む。"""
+        close_row = np.asarray(close_row, dtype=float)
+        if self.n_bars > 0:
+            self._push(self.pending_ret)
+        logc = np.log(close_row)
+        self.pending_ret = logc - self.last_logc
+        nxt = self.alpha * logc + (1 - self.alpha) * self.ewma
+        nxt = np.where(np.isnan(self.ewma), logc, nxt)
+        self.ewma = np.where(np.isnan(logc), self.ewma, nxt)
+        self.n_valid = self.n_valid + ~np.isnan(logc)
+        self.last_logc = logc
+        self.n_bars += 1
+        self.last_time = float(time)
+        self.last_close = close_row.copy()
+
+    def _push(self, r):
+        old = self.ring[self.head]
+        self._accumulate(old, -1)
+        self.ring[self.head] = r
+        self._accumulate(r, +1)
+        self.head = (self.head + 1) % self.vol_window
+        if self.head == 0:
+            self._sums()  # 1周ごとに和を取り直し、加減算の丸め誤差を溜めない
+
+    def _accumulate(self, r, sign):
+        ok = ~np.isnan(r)
+        x = np.where(ok, r, 0.0)
+        self.s1 += sign * x
+        self.s2 += sign * x * x
+        self.cnt += sign * ok
+
+    def _sums(self):
+        ok = ~np.isnan(self.ring)
+        x = np.where(ok, self.ring, 0.0)
+        self.s1 = x.sum(axis=0)
+        self.s2 = (x * x).sum(axis=0)
+        self.cnt = ok.sum(axis=0)
+
+    # --- 出力 -----------------------------------------------------------
+    def signal(self):
+        """最終バーのトレンドシグナル [N]（trend_signal_panel の最終行と同じ）。"""
+        col = {s: k for k, s in enumerate(self.spans)}
+        N = len(self.symbols)
+        sig, valid = np.zeros(N), np.zeros(N)
+        for f, s in self.horizons_bars:
+            d = self.ewma[col[f]] - self.ewma[col[s]]
+            ok = (~np.isnan(d)) & (self.n_valid >= s)
+            sig[ok] += np.sign(d[ok])
+            valid[ok] += 1
+        return np.where(valid == len(self.horizons_bars),
+                        sig / len(self.horizons_bars), np.nan)
+
+    def vol(self):
+        """最終バーの年率trailing vol [N]（trailing_vol の最終行と同じ規則）。"""
+        W = self.vol_window
+        if self.n_bars - 1 < W:
+            return np.full(len(self.symbols), np.nan)
+        n = self.cnt
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.s1 / n
+            var = np.maximum(self.s2 / n - mean * mean, 0.0)
+        var[n == 1] = 0.0
+        return np.where(n >= W // 2, np.sqrt(var) * np.sqrt(self.bars_per_year),
+                        np.nan)
+
+    def rets_window(self):
+        """最終バーtの共分散窓 rets[t-W:t]（時系列順の [W,N]）。"""
+        return np.roll(self.ring, -self.head, axis=0)
+
+    # --- データとの突合 -------------------------------------------------
+    def locate(self, times, closes):
+        """最終処理バーが読み込んだデータ内のどこにあるかを返す。
+
+        時刻が無い・そのバーの終値が変わっているならNone（要作り直し）。
+        見るのは最終処理バーの行だけで、それより前の履歴の修正は
+        load_market が履歴の指紋（history_fp）で検出する。"""
+        if self.last_time is None:
+            return None
+        k = int(np.searchsorted(times, self.last_time))
+        if k >= len(times) or times[k] != self.last_time:
+            return None
+        if not np.array_equal(np.asarray(closes[k], dtype=float),
+                              self.last_close, equal_nan=True):
+            return None
+        return k
+
+    def advance(self, times, closes, t):
+        """データの時点tまで逐次更新する。突合に失敗したらFalse（要作り直し）。"""
+        k = self.locate(times, closes)
+        if k is None or k > t:
+            return False
+        for i in range(k + 1, t + 1):
+            self.update(times[i], closes[i])
+        return True
+
+    # --- 永続化 ---------------------------------------------------------
+    def to_dict(self):
+        return {"params": self.params(),
+                "ewma": self.ewma.tolist(), "n_valid": self.n_valid.tolist(),
+                "last_logc": self.last_logc.tolist(), "ring": self.ring.tolist(),
+                "head": self.head, "pending_ret": self.pending_ret.tolist(),
+                "n_bars": self.n_bars, "last_time": self.last_time,
+                "last_close": (None if self.last_close is None
+                               else self.last_close.tolist()),
+                "history_fp": self.history_fp}
+
+    @classmethod
+    def from_dict(cls, d):
+        p = d["params"]
+        self = cls(p["symbols"], p["horizons_bars"], p["vol_window"],
+                   p["bars_per_year"])
+        self.ewma = np.array(d["ewma"], dtype=float)
+        self.n_valid = np.array(d["n_valid"], dtype=int)
+        self.last_logc = np.array(d["last_logc"], dtype=float)
+        self.ring = np.array(d["ring"], dtype=float).reshape(self.ring.shape)
+        self.head = d["head"]
+        self.pending_ret = np.array(d["pending_ret"], dtype=float)
+        self.n_bars = d["n_bars"]
+        self.last_time = d["last_time"]
+        self.last_close = (None if d["last_close"] is None
+                           else np.array(d["last_close"], dtype=float))
+        self.history_fp = d.get("history_fp")
+        self._sums()
+        return self
+
+
+def load_state(path, cfg):
+    """保存済みの状態を読む。無い・壊れている・パラメータが変わったならNone。"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            state = IncrementalSignalState.from_dict(json.load(f))
+    except (ValueError, KeyError, TypeError):
+        return None
+    if state.params() != IncrementalSignalState.for_config(cfg).params():
+        return None
+    return state
+
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state.to_dict(), f)
+    os.replace(tmp, path)
+
+
+def load_market(cfg, path, now, load_universe, history_fingerprint=None):
+    """キャッシュを読み、時点 now の確定バーまで進めたシグナル状態と共に返す。
+
+    load_universe(since_epoch) は (times, opens_df, closes_df) を返す関数
+    （since_epoch=None で全履歴）。history_fingerprint(until_epoch) は
+    until_epoch までの履歴の指紋を返す関数（data.history_fingerprint）。
+    保存済みの状態がデータと突合できれば（最終バーまでの履歴の指紋と、
+    最終バーの時刻・終値が同じ）、その最終バー以降のキャッシュだけを読んで
+    逐次更新する。突合できなければ全履歴を読んで作り直す。更新後の状態は
+    path に保存する。
+
+    Returns: (times, opens_df, closes_df, t, state)
+    """
+    state = load_state(path, cfg)
+    if (state is not None and history_fingerprint is not None
+            and (state.history_fp is None
+                 or history_fingerprint(state.last_time) != state.history_fp)):
+        state = None        # 最終バーより前の履歴が直った → 作り直す
+    if state is not None:
+        try:
+            loaded = load_universe(state.last_time)
+        except ValueError:
+            loaded = None   # 直近バーの無い銘柄がある等 → 全履歴で作り直す
+        if loaded is not None and loaded[2].shape[1] == len(cfg.symbols):
+            times, opens_df, closes_df = loaded
+            closes = closes_df.to_numpy(float)
+            t = int(np.searchsorted(times, now, side="right")) - 1
+            if t >= 0 and state.advance(times, closes, t):
+                _save(path, state, history_fingerprint)
+                return times, opens_df, closes_df, t, state
+    times, opens_df, closes_df = load_universe(None)
+    closes = closes_df.to_numpy(float)
+    t = int(np.searchsorted(times, now, side="right")) - 1
+    fresh = IncrementalSignalState.for_config(cfg)
+    state = IncrementalSignalState.from_history(
+        fresh.symbols, fresh.horizons_bars, fresh.vol_window,
+        fresh.bars_per_year, times[:t + 1], closes[:t + 1])
+    if t >= 0:
+        _save(path, state, history_fingerprint)
+    return times, opens_df, closes_df, t, state
+
+
+def _save(path, state, history_fingerprint):
+    if history_fingerprint is not None:
+        state.history_fp = history_fingerprint(state.last_time)
+    save_state(path, state)
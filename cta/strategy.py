@@ -10,58 +10,179 @@ volターゲティングはリスクを一定化しDDのテールを削る。
 
 バックテストとペーパー/ライブは本モジュールの target_weights() を共有する。
 """
+import collections
+
 import numpy as np
 
+from . import kernels
 
-def ewma(x, span):
-    """NaN耐性EWMA（上場前NaNはスキップし、最初の有効値から開始）。"""
-    a = 2.0 / (span + 1.0)
-    out = np.full_like(x, np.nan, dtype=float)
-    prev = np.nan
-    for i in range(len(x)):
-        v = x[i]
-        if np.isnan(v):
-            out[i] = prev
-            continue
-        prev = v if np.isnan(prev) else a * v + (1 - a) * prev
+
+def _as_float(x):
+    """float32 の配列はそのまま（省メモリモード）、それ以外は float64 にする。"""
+    x = np.asarray(x)
+    return x if x.dtype == np.float32 else x.astype(float, copy=False)
+
+
+def ewma(x, span, prev=None):
+    """NaN耐性EWMA（上場前NaNはスキップし、最初の有効値から開始）。
+
+    x は [T] または [T,N] パネル、span はスカラーか列ごとの [N]。
+    時間方向の再帰 prev = a*v + (1-a)*prev を全列まとめて1本のループで回す
+    （銘柄ごとに要素単位のPythonループを回していた旧実装と同じ演算順なので
+    結果はビット単位で一致する）。NaNの足は直前値を持ち越す。
+    float32 の入力は再帰をfloat64で回し、結果だけfloat32で持つ。
+    prev: 再帰の状態（列ごとの直前値 [N]、float64、NaN=未開始）。渡すと
+    そこから続きを計算し、その場で最終バーの状態に更新する（チャンク分割用）。"""
+    x = _as_float(x)
+    panel = x.reshape(len(x), -1)
+    a = np.broadcast_to(2.0 / (np.asarray(span, dtype=float) + 1.0),
+                        panel.shape[1:])
+    b = 1 - a
+    k = kernels.jit()
+    out = np.full(panel.shape, np.nan, dtype=x.dtype)
+    state = prev
+    prev = (np.full(panel.shape[1:], np.nan) if state is None
+            else np.array(state, dtype=float).reshape(panel.shape[1:]))
+    if k is not None:
+        k.ewma(np.ascontiguousarray(panel), np.ascontiguousarray(a),
+               np.ascontiguousarray(b), prev, out)
+        if state is not None:
+            state[...] = prev.reshape(np.shape(state))
+        return out.reshape(x.shape)
+    isnan = np.isnan(panel)
+    # 全列が未開始（NaN）の先頭区間は結果もNaNのままなので飛ばす
+    first = 0
+    if len(panel) and np.isnan(prev).all():
+        first = int(np.argmin(isnan.all(axis=1)))
+    nxt = np.empty_like(prev)
+    for i in range(first, len(panel)):
+        v = panel[i]
+        np.multiply(a, v, out=nxt)
+        nxt += b * prev
+        # 最初の有効値はそのまま初期値、NaNの足は直前値を持ち越す
+        np.copyto(nxt, v, where=np.isnan(prev))
+        np.copyto(prev, nxt, where=~isnan[i])
         out[i] = prev
-    return out
+    if state is not None:
+        state[...] = prev.reshape(np.shape(state))
+    return out.reshape(x.shape)
 
 
-def trend_signal(log_close, horizons_bars):
-    """複数ホライズンのEWMA交差の符号平均 → [-1, 1]。
+def trend_signal_panel(logc, horizons_bars, state=None):
+    """全銘柄×全ホライズンのトレンドシグナルを1パスで計算する → [T,N]。
 
-    上場直後の未成熟なEWMAで取引しないよう、各ホライズンは有効データが
-    slowスパン分蓄積されるまでNaN（=取引対象外）とする。"""
-    n_valid = np.cumsum(~np.isnan(log_close))
-    sig = np.zeros(len(log_close))
-    valid = np.zeros(len(log_close))
+    ホライズン間で共有されるスパン（例: 10/40 と 40/160 の40）は1回だけ
+    EWMAを取り、全スパン×全銘柄を横に並べたパネルに ewma() を1回だけ適用する。
+    有効本数の累積（成熟判定）も全ホライズンで共有する。
+    state: チャンク分割用の状態 dict（空の dict で始める）。EWMAの再帰状態と
+    有効本数を持ち越し、続きのチャンクを全履歴で計算した場合と一致させる。"""
+    logc = _as_float(logc)
+    panel = logc.reshape(len(logc), -1)
+    N = panel.shape[1]
+    spans = sorted({s for h in horizons_bars for s in h})
+    col = {s: k for k, s in enumerate(spans)}
+    prev = None
+    if state is not None:
+        prev = state.setdefault("ewma", np.full(len(spans) * N, np.nan))
+    ew = ewma(np.tile(panel, (1, len(spans))), np.repeat(spans, N), prev=prev)
+    ew = ew.reshape(len(panel), len(spans), N)
+    n_valid = np.cumsum(~np.isnan(panel), axis=0)
+    if state is not None:
+        n_valid += state.get("n_valid", 0)
+        if len(panel):
+            state["n_valid"] = n_valid[-1].copy()
+    sig = np.zeros(panel.shape, dtype=logc.dtype)
+    valid = np.zeros(panel.shape, dtype=logc.dtype)
     for (f, s) in horizons_bars:
-        ef, es = ewma(log_close, f), ewma(log_close, s)
-        d = ef - es
+        d = ew[:, col[f]] - ew[:, col[s]]
         ok = (~np.isnan(d)) & (n_valid >= s)
         sig[ok] += np.sign(d[ok])
         valid[ok] += 1
-    out = np.full(len(log_close), np.nan)
+    out = np.full(panel.shape, np.nan, dtype=logc.dtype)
     ok = valid == len(horizons_bars)
     out[ok] = sig[ok] / len(horizons_bars)
-    return out
+    return out.reshape(logc.shape)
+
 
+def trend_signal(log_close, horizons_bars):
+    """複数ホライズンのEWMA交差の符号平均 → [-1, 1]。
 
-def trailing_vol(rets, window, bars_per_year):
-    """各時点の年率ボラ（過去window本、NaNは除外。有効本数が半分未満ならNaN）。"""
-    T = len(rets)
-    out = np.full(T, np.nan)
-    for i in range(window, T):
-        w = rets[i - window:i]
-        w = w[~np.isnan(w)]
-        if len(w) >= window // 2:
-            out[i] = w.std() * np.sqrt(bars_per_year)
-    return out
+    log_close は [T] または [T,N] パネル（列=銘柄）。
+    上場直後の未成熟なEWMAで取引しないよう、各ホライズンは有効データが
+    slowスパン分蓄積されるまでNaN（=取引対象外）とする。
+    計算本体は trend_signal_panel()。"""
+    return trend_signal_panel(log_close, horizons_bars)
+
+
+def trailing_vol(rets, window, bars_per_year, state=None):
+    """各時点の年率ボラ（過去window本、NaNは除外。有効本数が半分未満ならNaN）。
+
+    rets は [T] または [T,N] パネル。時点iの値は rets[i-window:i] の母標準偏差
+    （ddof=0）で、x・x²・有効本数の累積和の差分から全時点をO(T)で求める。
+    累積和の桁落ちを避けるため、列ごとの最初の有効値で中心化してから二乗する
+    （分散は平行移動で不変）。全期間平均ではなく先頭値を使うのは因果性のため:
+    後からバーを追記しても過去時点の値が丸め誤差レベルでも変わらない。
+    state: チャンク分割用の状態 dict（空の dict で始める）。中心化定数・
+    処理済み本数・直近window本分の累積和を持ち越す。"""
+    r = _as_float(rets)
+    panel = r.reshape(len(r), -1)
+    L, N = panel.shape
+    st_ = {} if state is None else state
+    rows0 = st_.get("rows", 0)
+    ok = ~np.isnan(panel)
+    center = st_.get("center")
+    if center is None:
+        center = np.full(N, np.nan)
+    todo = np.isnan(center) & ok.any(axis=0)
+    if todo.any():
+        center = center.copy()
+        first = ok.argmax(axis=0)
+        center[todo] = panel[first, np.arange(N)][todo]
+    # 累積和 c[i] = rows[<i] の和。持ち越しの末尾 window+1 行に続けて積む
+    zero = (np.zeros((1, N)), np.zeros((1, N)), np.zeros((1, N), dtype=np.int64))
+    head = st_.get("tail", zero)
+    P = len(head[0]) - 1
+    k = kernels.jit()
+    if k is not None:
+        out, c1, c2, cn = k.trailing_vol(
+            np.ascontiguousarray(panel), center, int(window),
+            float(np.sqrt(bars_per_year)), np.ascontiguousarray(head[0]),
+            np.ascontiguousarray(head[1]), np.ascontiguousarray(head[2]), rows0)
+        out = out.astype(r.dtype, copy=False)
+    else:
+        z = np.where(ok, panel - center, 0.0)
+        c1 = np.concatenate([head[0][:-1],
+                             np.cumsum(np.concatenate([head[0][-1:], z]), axis=0)])
+        c2 = np.concatenate([head[1][:-1],
+                             np.cumsum(np.concatenate([head[1][-1:], z * z]), axis=0)])
+        cn = np.concatenate([head[2][:-1],
+                             np.cumsum(np.concatenate([head[2][-1:], ok]), axis=0)])
+        out = np.full(panel.shape, np.nan, dtype=r.dtype)
+        a = min(max(window - rows0, 0), L)   # 最初に値が出るチャンク内の行
+        i = np.arange(a, L) + P              # 累積和上の添字
+        n = cn[i] - cn[i - window]
+        s1 = c1[i] - c1[i - window]
+        s2 = c2[i] - c2[i - window]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = s1 / n
+            var = np.maximum(s2 / n - mean * mean, 0.0)
+            var[n == 1] = 0.0  # 1本だけの窓は丸め誤差を残さず厳密に0
+            out[a:] = np.where(n >= window // 2,
+                               np.sqrt(var) * np.sqrt(bars_per_year), np.nan)
+    if state is not None:
+        keep = min(P + L, window) + 1
+        state.update(rows=rows0 + L, center=center,
+                     tail=(c1[-keep:], c2[-keep:], cn[-keep:]))
+    return out.reshape(r.shape)
 
 
 def portfolio_vol(weights, rets_window, bars_per_year):
-    """重みベクトルとリターン窓から年率ポートフォリオvolを推定（サンプル共分散）。"""
+    """重みベクトルとリターン窓から年率ポートフォリオvolを推定（サンプル共分散）。
+
+    rets_window は [W,N] のリターン窓、または窓を逐次更新する
+    RollingCovariance（毎バー np.cov を作り直さないバックテスト用）。"""
+    if isinstance(rets_window, RollingCovariance):
+        return rets_window.portfolio_vol(weights, bars_per_year)
     active = np.abs(weights) > 1e-12
     if not active.any():
         return 0.0
@@ -76,12 +197,129 @@ def portfolio_vol(weights, rets_window, bars_per_year):
     return float(np.sqrt(max(w @ cov @ w, 0.0)))
 
 
+class RollingCovariance:
+    """直近window本のリターンのサンプル共分散を逐次更新で保持する。
+
+    portfolio_vol() と同じく「アクティブ資産のどれかがNaNの行は捨てる」
+    （リストワイズ除外）を厳密に守るため、行をNaNパターン（どの資産が欠損か）
+    ごとのグループに分け、グループ別に本数・和・クロス積和を持つ。
+    問い合わせ時はアクティブ資産に欠損を含まないグループだけを合算する。
+    NaNパターンは上場日と欠損バーの種類しかないので、グループ数は少ない。
+
+    push() はO(N²)。加減算の丸め誤差が溜まらないよう、window回ごとに
+    保持中の行から和を取り直す。"""
+
+    def __init__(self, n_assets, window):
+        self.n_assets = n_assets
+        self.window = window
+        self._rows = collections.deque()   # (NaNパターン, NaNを0にした行)
+        self._groups = {}                  # パターン -> [mask, 本数, 和, クロス積和]
+        self._since_rebuild = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def push(self, row):
+        """最新バーのリターン行 [N] を窓へ入れ、窓から溢れた最古の行を外す。"""
+        row = np.asarray(row, dtype=float)
+        nan = np.isnan(row)
+        x = np.where(nan, 0.0, row)
+        key = nan.tobytes()
+        self._rows.append((key, x))
+        self._add(key, nan, x, +1)
+        if len(self._rows) > self.window:
+            k, old = self._rows.popleft()
+            self._add(k, None, old, -1)
+        self._since_rebuild += 1
+        if self._since_rebuild >= self.window:
+            self._rebuild()
+
+    def _add(self, key, nan, x, sign):
+        g = self._groups.get(key)
+        if g is None:
+            n = self.n_assets
+            g = self._groups[key] = [nan, 0, np.zeros(n), np.zeros((n, n))]
+        g[1] += sign
+        if g[1] == 0:
+            del self._groups[key]
+            return
+        if sign > 0:
+            g[2] += x
+            g[3] += np.outer(x, x)
+        else:
+            g[2] -= x
+            g[3] -= np.outer(x, x)
+
+    def _rebuild(self):
+        rows = list(self._rows)
+        self._groups = {}
+        for key, x in rows:
+            self._add(key, np.frombuffer(key, dtype=bool).copy(), x, +1)
+        self._since_rebuild = 0
+
+    def to_arrays(self):
+        """状態を配列の dict にする（ライブバックテストの成果物保存用）。
+        from_arrays() で戻すと、以後の push() / cov() はビット単位で一致する
+        （グループの並び順も合算順に効くので保つ）。"""
+        n = self.n_assets
+        groups = list(self._groups.values())
+        return {"n_assets": n, "window": self.window,
+                "since_rebuild": self._since_rebuild,
+                "row_mask": np.array([np.frombuffer(k, dtype=bool)
+                                      for k, _ in self._rows], dtype=bool).reshape(-1, n),
+                "row_x": np.array([x for _, x in self._rows]).reshape(-1, n),
+                "group_mask": np.array([g[0] for g in groups], dtype=bool).reshape(-1, n),
+                "group_cnt": np.array([g[1] for g in groups], dtype=np.int64),
+                "group_sum": np.array([g[2] for g in groups]).reshape(-1, n),
+                "group_cross": np.array([g[3] for g in groups]).reshape(-1, n, n)}
+
+    @classmethod
+    def from_arrays(cls, d):
+        """to_arrays() の dict から戻す。"""
+        rc = cls(int(d["n_assets"]), int(d["window"]))
+        for mask, x in zip(d["row_mask"], d["row_x"]):
+            rc._rows.append((mask.tobytes(), np.array(x, dtype=float)))
+        for mask, cnt, sm, cp in zip(d["group_mask"], d["group_cnt"],
+                                     d["group_sum"], d["group_cross"]):
+            rc._groups[mask.tobytes()] = [mask.copy(), int(cnt),
+                                          np.array(sm, dtype=float),
+                                          np.array(cp, dtype=float)]
+        rc._since_rebuild = int(d["since_rebuild"])
+        return rc
+
+    def cov(self, active):
+        """アクティブ資産（bool [N]）の共分散行列と使用した行数を返す。"""
+        k = int(active.sum())
+        n, s, o = 0, np.zeros(k), np.zeros((k, k))
+        for mask, cnt, sm, cp in self._groups.values():
+            if mask[active].any():
+                continue  # アクティブ資産に欠損がある行は使わない
+            n += cnt
+            s += sm[active]
+            o += cp[np.ix_(active, active)]
+        if n < 2:
+            return np.full((k, k), np.nan), n
+        return (o - np.outer(s, s) / n) / (n - 1), n
+
+    def portfolio_vol(self, weights, bars_per_year):
+        """portfolio_vol() と同じ規則（有効行10本未満は0）で年率volを返す。"""
+        active = np.abs(weights) > 1e-12
+        if not active.any():
+            return 0.0
+        cov, n = self.cov(active)
+        if n < 10:
+            return 0.0
+        w = weights[active]
+        return float(np.sqrt(max(w @ (cov * bars_per_year) @ w, 0.0)))
+
+
 def target_weights(sig_t, vol_t, rets_window, target_vol, max_gross, bars_per_year,
                    long_only=False):
     """時点tの目標ウェイト（対equity比、符号付き）を返す。
 
     1. 逆volでシグナルを配分（リスク均等化）
     2. ポートフォリオvolがtarget_volになるようスケール
+       （rets_window は [W,N] 窓または RollingCovariance。portfolio_vol() 参照）
     3. グロスレバレッジをmax_grossでキャップ
 
     long_only=True の場合、下降トレンド銘柄はショートせず現金化する。
@@ -90,28 +328,78 @@ def target_weights(sig_t, vol_t, rets_window, target_vol, max_gross, bars_per_ye
     性質があり、ショートはそれに逆らうため。実務上も信用取引口座・貸株調達が
     不要になり、端数株（fractional shares）が使える利点がある。
     """
-    N = len(sig_t)
-    raw = np.zeros(N)
-    for j in range(N):
-        s, v = sig_t[j], vol_t[j]
-        if not np.isnan(s) and not np.isnan(v) and v > 1e-6:
-            raw[j] = s / v
+    w = unit_weights(sig_t, vol_t, long_only=long_only)
+    pvol = portfolio_vol(w, rets_window, bars_per_year)
+    return scale_weights(w, pvol, target_vol, max_gross)
+
+
+def unit_weights(sig, vol, long_only=False):
+    """逆vol配分をグロス1に正規化したウェイト（target_weights の手順1）。
+
+    sig/vol は時点tの [N]、または全時点の [T,N]（行ごとに正規化）。
+    シグナル・volが無い銘柄、vol<=1e-6 の銘柄は0。全銘柄0なら行全体が0。
+    target_vol にもサーキットブレーカーのスケールにも依存しないので、
+    バックテストでは全バー分を一括で前計算できる。"""
+    sig, vol = _as_float(sig), _as_float(vol)
+    ok = ~np.isnan(sig) & (vol > 1e-6)  # NaNとの比較はFalse
+    raw = np.zeros(np.shape(sig), dtype=np.result_type(sig, vol))
+    np.divide(sig, vol, out=raw, where=ok)
     if long_only:
         raw = np.maximum(raw, 0.0)
-    gross_raw = np.abs(raw).sum()
-    if gross_raw < 1e-12:
-        return np.zeros(N)
-    w = raw / gross_raw  # gross=1に正規化
-    pvol = portfolio_vol(w, rets_window, bars_per_year)
-    if pvol < 1e-8:
-        return np.zeros(N)
-    w = w * (target_vol / pvol)
+    gross_raw = np.abs(raw).sum(axis=-1, keepdims=True)
+    flat = gross_raw < 1e-12
+    return np.where(flat, 0.0, raw / np.where(flat, 1.0, gross_raw))
+
+
+def scale_weights(w_unit, pvol, target_vol, max_gross):
+    """正規化ウェイトを target_vol にスケールし、グロスを max_gross でキャップする
+    （target_weights の手順2・3）。pvol は w_unit のポートフォリオvol。"""
+    if not pvol >= 1e-8:
+        return np.zeros(len(w_unit))
+    w = np.asarray(w_unit, dtype=float) * (target_vol / pvol)
     gross = np.abs(w).sum()
     if gross > max_gross:
         w = w * (max_gross / gross)
     return w
 
 
+def unit_weight_path(sig, vol, rets, window, bars_per_year, bars,
+                     long_only=False, state=None, w_unit=None):
+    """バックテスト用の前計算: 全バーの正規化ウェイト [T,N] と、
+    指定バー bars での w_unit のポートフォリオvol [T]（他のバーはNaN）。
+
+    バーtのvolは rets[t-window:t] から推定する（target_weights と同じ窓）。
+    共分散は RollingCovariance を1行ずつ進めて求めるので、バーごとに
+    np.cov を作り直さない。バーループ側は scale_weights() を掛けるだけになる。
+    state: チャンク分割用の状態 dict（空の dict で始める）。共分散の逐次状態と
+    直近window本のリターンを持ち越す（bars はチャンク内の添字）。
+    w_unit: 計算済みの unit_weights(sig, vol)（あれば sig / vol は使わない）。"""
+    if w_unit is None:
+        w_unit = unit_weights(sig, vol, long_only=long_only)
+    T, N = w_unit.shape
+    pvol = np.full(T, np.nan)
+    st_ = {} if state is None else state
+    g0 = st_.get("rows", 0)                 # このチャンクの先頭行の通し番号
+    tail = st_.get("tail", np.zeros((0, N)))
+    ext = np.concatenate([tail, rets]) if len(tail) else rets
+    base = g0 - len(tail)                   # ext[0] の通し番号
+    cov, nxt = st_.get("cov"), st_.get("nxt")  # nxt: 次に窓へ入れる rets の行
+    for t in np.sort(np.asarray(bars, dtype=int)):
+        g = g0 + t
+        if g < window or t >= T:
+            continue
+        if nxt is None or g - nxt > window:
+            cov = RollingCovariance(N, window)  # 窓が丸ごと入れ替わるなら作り直す
+            nxt = g - window
+        for i in range(nxt, g):
+            cov.push(ext[i - base])
+        nxt = g
+        pvol[t] = cov.portfolio_vol(w_unit[t], bars_per_year)
+    if state is not None:
+        state.update(rows=g0 + T, cov=cov, nxt=nxt, tail=ext[-window:].copy())
+    return w_unit, pvol
+
+
 class CircuitBreaker:
     """DDに応じたデレバレッジ/停止。backtest/liveで同一ロジックを共有。
 
@@ -140,3 +428,28 @@ class CircuitBreaker:
     @property
     def state(self):
         return {"peak": self.peak, "halted": self.halted}
+
+
+def breaker_step(peak, halted, equity, dd_soft, dd_hard):
+    """CircuitBreaker.update() のシナリオ軸 [S] 版（バッチバックテスト用）。
+
+    dd_soft / dd_hard もシナリオごとに与えられる。
+    Returns: (peak, halted, scale)  いずれも [S]。"""
+    peak = np.maximum(peak, equity)
+    # peak<=0 のシナリオは比を1（dd=0）にする
+    dd = 1.0 - np.divide(equity, peak, out=np.ones(len(peak)), where=peak > 0)
+    halted = halted | (dd >= dd_hard)
+    scale = np.where(halted, 0.0, np.where(dd >= dd_soft, 0.5, 1.0))
+    return peak, halted, scale
+
+
+def breaker_span(peak, halted, equity, dd_hard):
+    """breaker_step() を equity [L,S] の各行に順に適用したときの peak の推移 [L,S] と
+    新規停止フラグ [L,S] を返す（イベント駆動エンジンの区間走査用）。
+
+    区間内はリバランスしないのでソフト側のスケールは不要。停止は最初に
+    hit が立った行で起きる（それ以降の行は呼び出し側で捨てる）。"""
+    path = np.maximum.accumulate(np.vstack([peak[None], equity]), axis=0)[1:]
+    ratio = np.divide(equity, path, out=np.ones(equity.shape), where=path > 0)
+    hit = ((1.0 - ratio) >= dd_hard) & ~halted
+    return path, hit
@@ -0,0 +1,222 @@
+"""チャンク分割・メモリマップのストリーミングバックテスト。
+
+run_backtest は opens / closes / funding の [T,N] パネル全体をメモリに載せる。
+1H足・15分足を多銘柄・長期間で検証するとこれがRAMに収まらないので、
+  1. build_panel(): キャッシュDB（SQLite）から [T,N] パネルを .npy の
+     メモリマップへ銘柄ごと・ページごとに書き出す（メモリに載るのは時刻列 [T]
+     と1ページ分だけ）
+  2. run_backtest_stream(): 時間方向に chunk_bars 本ずつ読み、
+       - EWMA・trailing vol・共分散の逐次状態（strategy の state 引数）
+       - エンジンの状態（EngineSnapshot）と closes_ff の直近有効終値
+     をチャンク境界で持ち越しながら回し、equity・ウェイト・約定を
+     チャンクごとに out_dir へ追記する
+の2段で回す。結果は out_dir のファイルをメモリマップした BacktestResult
+（record="full"）で、run_backtest を全期間で回した結果とビット単位で一致する。
+"""
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from . import data as data_mod
+from .engine import BacktestResult, run_backtest_batch, unit_path_chunk
+from .fill_log import FillLog
+from .market import MarketData, data_source
+
+DEFAULT_CHUNK_BARS = 4096
+_RESULT_SERIES = ("times", "equity", "weights", "pos_qty", "asset_pnl")
+_FILL_COLUMNS = ("ts", "sym", "qty", "signal_price", "ref_price", "fill_price",
+                 "fee_usd", "reason")
+
+
+def _panel_meta(cfg):
+    return {"symbols": list(cfg.symbols), "timeframe_min": cfg.timeframe_min,
+            "market": cfg.market, "dtype": np.dtype(cfg.storage_dtype).name,
+            "source": data_source(cfg)}
+
+
+def build_panel(cfg, path, page_rows=100_000):
+    """cfg のユニバースをキャッシュDBから path/ のメモリマップパネルへ書き出す。
+
+    times.npy [T] / opens.npy・closes.npy・funding.npy [T,N] / conservative.npy [N]
+    と meta.json を作る。時間グリッド・欠損の扱いは data.load_universe と同じ
+    （全銘柄のunion、上場前・欠損バーはNaN、同一close_timeは先勝ち）。"""
+    if cfg.is_etf:
+        raise ValueError("build_panel supports the crypto candle cache only")
+    dtype = np.dtype(cfg.storage_dtype)
+    os.makedirs(path, exist_ok=True)
+    syms, tf = list(cfg.symbols), cfg.timeframe_min
+    con = sqlite3.connect(cfg.db_path)
+    try:
+        for s in syms:
+            if con.execute("SELECT 1 FROM candles WHERE symbol=? AND time_frame=? "
+                           "LIMIT 1", (s, tf)).fetchone() is None:
+                raise ValueError(f"no cached data for {s}")
+        marks = ",".join("?" * len(syms))
+        times = np.array([r[0] for r in con.execute(
+            f"SELECT DISTINCT close_time FROM candles WHERE time_frame=? "
+            f"AND symbol IN ({marks}) ORDER BY close_time", (tf, *syms))],
+            dtype=float)
+        T, N = len(times), len(syms)
+        np.save(os.path.join(path, "times.npy"), times)
+        mm = {}
+        for name in ("opens", "closes", "funding"):
+            mm[name] = np.lib.format.open_memmap(
+                os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype,
+                shape=(T, N))
+        mm["opens"][:] = np.nan
+        mm["closes"][:] = np.nan
+        for j, s in enumerate(syms):
+            cur = con.execute(
+                "SELECT close_time, open_price, close_price FROM candles "
+                "WHERE symbol=? AND time_frame=? ORDER BY close_time", (s, tf))
+            last = None
+            while True:
+                page = cur.fetchmany(page_rows)
+                if not page:
+                    break
+                arr = np.array(page, dtype=float)
+                ct = arr[:, 0]
+                first = np.r_[ct[0] != last, ct[1:] != ct[:-1]]
+                idx = np.searchsorted(times, ct[first])
+                mm["opens"][idx, j] = arr[first, 1]
+                mm["closes"][idx, j] = arr[first, 2]
+                last = ct[-1]
+    finally:
+        con.close()
+    conservative = np.zeros(N, dtype=bool)
+    for j, col, cons in data_mod.funding_columns(cfg.funding_pkl, syms, times, tf,
+                                                 cfg.funding_default_annual):
+        mm["funding"][:, j] = col
+        conservative[j] = cons
+    for arr in mm.values():
+        arr.flush()
+    np.save(os.path.join(path, "conservative.npy"), conservative)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(_panel_meta(cfg), f)
+    return open_panel(path)
+
+
+def open_panel(path):
+    """build_panel() の出力を読み取り専用のメモリマップで開く → dict。"""
+    with open(os.path.join(path, "meta.json")) as f:
+        panel = json.load(f)
+    for name in ("times", "opens", "closes", "funding", "conservative"):
+        panel[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+    return panel
+
+
+class _ResultWriter:
+    """チャンクごとの結果を out_dir の生バイナリへ追記する。"""
+
+    def __init__(self, out_dir, symbols):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.symbols = list(symbols)
+        self.reasons = []
+        self.n_rows = self.n_fills = 0
+        self.dtype = None
+        self._files = {name: open(os.path.join(out_dir, f"{name}.bin"), "wb")
+                       for name in _RESULT_SERIES + tuple(
+                           "fill_" + c for c in _FILL_COLUMNS)}
+
+    def append(self, res):
+        self.dtype = res.weights.dtype
+        for name in _RESULT_SERIES:
+            np.ascontiguousarray(getattr(res, name)).tofile(self._files[name])
+        log = res.fills
+        for r in log.reasons:
+            if r not in self.reasons:
+                self.reasons.append(r)
+        for c in _FILL_COLUMNS:
+            col = getattr(log, c)
+            if c == "reason" and len(col):
+                col = np.array([self.reasons.index(r) for r in log.reasons],
+                               dtype=col.dtype)[col]
+            np.ascontiguousarray(col).tofile(self._files["fill_" + c])
+        self.n_rows += len(res.times)
+        self.n_fills += len(log)
+
+    def finish(self, last, config_sha1, dtype):
+        for f in self._files.values():
+            f.close()
+        meta = {"symbols": self.symbols, "reasons": self.reasons,
+                "n_rows": self.n_rows, "n_fills": self.n_fills,
+                "dtype": np.dtype(self.dtype or dtype).name,
+                "config_sha1": config_sha1,
+                "fees_usd": 0.0, "funding_usd": 0.0, "slippage_usd": 0.0,
+                "turnover_usd": 0.0, "halted_at": None}
+        if last is not None:
+            meta.update(fees_usd=last.fees_usd, funding_usd=last.funding_usd,
+                        slippage_usd=last.slippage_usd,
+                        turnover_usd=last.turnover_usd, halted_at=last.halted_at)
+        with open(os.path.join(self.out_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+
+def load_result(out_dir):
+    """run_backtest_stream() の出力をメモリマップした BacktestResult で開く。"""
+    with open(os.path.join(out_dir, "meta.json")) as f:
+        meta = json.load(f)
+    n, k, N = meta["n_rows"], meta["n_fills"], len(meta["symbols"])
+    dtype = np.dtype(meta["dtype"])
+    fill_dtypes = {"sym": np.int32, "reason": np.int8}
+
+    def _map(name, dt, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dt)
+        return np.memmap(os.path.join(out_dir, f"{name}.bin"), dtype=dt,
+                         mode="r", shape=shape)
+
+    series = {"times": _map("times", float, (n,)),
+              "equity": _map("equity", float, (n,))}
+    for name in ("weights", "pos_qty", "asset_pnl"):
+        series[name] = _map(name, dtype, (n, N))
+    fills = FillLog.from_arrays(
+        meta["symbols"], meta["reasons"],
+        **{c: _map("fill_" + c, fill_dtypes.get(c, float), (k,))
+           for c in _FILL_COLUMNS})
+    return BacktestResult(**series, fills=fills, symbols=meta["symbols"],
+                          fees_usd=meta["fees_usd"], funding_usd=meta["funding_usd"],
+                          slippage_usd=meta["slippage_usd"],
+                          turnover_usd=meta["turnover_usd"],
+                          halted_at=meta["halted_at"],
+                          config_sha1=meta["config_sha1"])
+
+
+def run_backtest_stream(cfg, panel_dir, out_dir, chunk_bars=DEFAULT_CHUNK_BARS,
+                        cost_mult=1.0):
+    """panel_dir のメモリマップパネルを chunk_bars 本ずつ回し、結果を out_dir に書く。
+
+    メモリに載るのはチャンク分の [chunk_bars,N] 配列と、窓・EWMA・エンジンの
+    状態だけ。Returns: out_dir をメモリマップした BacktestResult。"""
+    panel = open_panel(panel_dir)
+    want = _panel_meta(cfg)
+    have = {k: panel.get(k) for k in want}
+    if have != want:
+        raise ValueError(f"panel does not match config: {have} != {want}")
+    dtype = np.dtype(cfg.storage_dtype)
+    times = panel["times"]
+    T = len(times)
+    pre_state, snap, ff_last, last = {}, None, None, None
+    writer = _ResultWriter(out_dir, cfg.symbols)
+    for g0 in range(0, T, chunk_bars):
+        g1 = min(g0 + chunk_bars, T)
+        lo = max(g0 - 1, 0)      # 前チャンクの最終バーも1行含める（前バー終値・リターン用）
+        closes = np.array(panel["closes"][lo:g1])
+        up = unit_path_chunk(cfg, closes, g0, pre_state)
+        market = MarketData(cfg.symbols, times[lo:g1], panel["opens"][lo:g1],
+                            closes, panel["funding"][lo:g1], panel["conservative"],
+                            cfg.timeframe_min, cfg.market, dtype,
+                            closes_ff_head=ff_last if lo < g0 else None,
+                            source=want["source"])
+        ff_last = market.closes_ff[-1].copy()
+        if up is None:
+            continue             # warmup中: シグナルの状態だけ進める
+        last = run_backtest_batch(cfg, [{"cost_mult": cost_mult}], market=market,
+                                  snapshot_at=[np.inf], resume=snap, unit_path=up)[0]
+        snap = last.snapshots.pop()
+        writer.append(last)
+    writer.finish(last, cfg.config_sha1, dtype)
+    return load_result(out_dir)
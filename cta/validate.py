@@ -4,28 +4,205 @@
 walk-forwardは「fit→OOS」ではなく暦年ごとの独立評価＝レジーム頑健性テストとして行う。
 感応度分析は過学習の定量指標: 近傍パラメータでPnLが激しく振れる＝危険信号。
 """
+import collections
+import contextlib
 import datetime as dt
+import math
 
 import numpy as np
 
-from .engine import run_backtest
+from . import cache as cache_mod
+from . import parallel
+from . import result_cache
+from .engine import _resolve_scenario, run_backtest_batch
+from .market import MarketData
 from .metrics import compute_metrics
 
+# 1回のバッチで同時に回すシナリオ数の上限。ゲートは record="summary" で回すので
+# バッチが持つのは [S,N] の状態と1バー分の作業領域、固定長の集計バッファだけ
+# （[T,S,N] も [T,S] の equity 履歴も持たず、メモリは本数に依らない）
+BATCH_SIZE = 64
+
 
 def _ep(y, m=1, d=1):
     return dt.datetime(y, m, d, tzinfo=dt.timezone.utc).timestamp()
 
 
-def walk_forward(cfg, years=(2022, 2023, 2024, 2025, 2026)):
-    """暦年ごとに資本$initでリセットした独立窓評価（各窓の内部は連続運用）。"""
+def _market(cfg, market):
+    """各ゲートは market（MarketData）を受け取れる。省略時はここで1回だけ読む。"""
+    return MarketData.load(cfg) if market is None else market
+
+
+def _pool(cfg, market, workers):
+    """workers（ワーカー数か、ゲート間で共有する parallel.CellPool）からプールを得る。
+    共有プールはここでは閉じない。"""
+    if isinstance(workers, parallel.CellPool):
+        return contextlib.nullcontext(workers)
+    return parallel.CellPool(_market(cfg, market), workers)
+
+
+def _gate_market(cfg, market, workers):
+    if isinstance(workers, parallel.CellPool):
+        return workers.market
+    return _market(cfg, market)
+
+
+def _cell_metrics(cfg, market, cells):
+    """1バッチ分のセル（(シナリオ, start, end) のリスト）を1本のバーループで回す
+    （プールのセル）。指標しか使わないので系列とfillsは記録しない
+    （record="summary"）。→ (メトリクスのリスト,
+    このバッチで実際に計算した前計算の種別ごとの数)。"""
+    c = cache_mod.default_cache()
+    before = collections.Counter(c.misses_by_kind)
+    out = [compute_metrics(res, cfg.bars_per_year)
+           for res in run_backtest_batch(cfg, [sc for sc, _, _ in cells],
+                                         market=market, record="summary",
+                                         windows=[(a, b) for _, a, b in cells])]
+    return out, c.misses_by_kind - before
+
+
+def _cached(cfg, market, cells):
+    """cells（(シナリオ, start, end) のリスト）を結果キャッシュから引く。
+    → (キーのリスト, 結果か None のリスト)。キャッシュ無効ならすべて None。"""
+    rc = result_cache.default()
+    if rc is None:
+        return [None] * len(cells), [None] * len(cells)
+    keys = [rc.key(cfg, market, *c) for c in cells]
+    return keys, [rc.get(k) for k in keys]
+
+
+def _remember(keys, results):
+    rc = result_cache.default()
+    if rc is not None:
+        for key, r in zip(keys, results):
+            rc.put(key, r)
+
+
+def _kernel_key(cfg, scenario):
+    """シナリオの前計算（sig / vol / 逆vol配分の経路）を決める (ホライズン, vol窓)。"""
+    sc = _resolve_scenario(cfg, scenario)
+    return tuple(sc["horizons_days"]), sc["vol_window_days"]
+
+
+# 前計算の種別 → ArrayCache のキーの種別
+_KERNEL_KINDS = {"signal": "sig", "vol": "vol", "unit_path": "unitw"}
+
+
+def kernel_counts(cfg, scenarios):
+    """シナリオ群に要るユニークな前計算の数（キャッシュに有る分も数える）。
+    target_vol・コスト倍率などは前計算を変えないので、セル数よりずっと少ない。"""
+    keys = {_kernel_key(cfg, sc) for sc in scenarios}
+    return {"signal": len({h for h, _ in keys}), "vol": len({vw for _, vw in keys}),
+            "unit_path": len(keys)}
+
+
+def _run_cells(cfg, cells, market, batch_size=BATCH_SIZE, workers=None,
+               computed=None):
+    """セル（(シナリオ, start, end) のリスト）を回し、セル順のメトリクスを返す。
+
+    結果キャッシュ（result_cache.set_dir）にあるセルは回さない。残りは
+    前計算が同じセルが同じバッチ（並列時は同じワーカー）に入るように
+    (ホライズン, vol窓) 順に並べ、run_backtest_batch の windows で期間ごと
+    まとめて回して、結果を元の順に戻す。並列時はワーカー全員に行き渡るように
+    バッチを小さく切る。バッチ内のセルは互いに独立なので、並べ方・切り方に
+    よらず結果は同じ。
+    computed: Counter を渡すと、実際に計算した前計算（sig/vol キャッシュの
+    ミス）の数を種別ごとに足す（ワーカーで計算した分も含む）。"""
+    market = _gate_market(cfg, market, workers)
+    keys, out = _cached(cfg, market, cells)
+    order = sorted((i for i, r in enumerate(out) if r is None),
+                   key=lambda i: _kernel_key(cfg, cells[i][0]))
+    ordered = [cells[i] for i in order]
+    with _pool(cfg, market, workers) as p:
+        if p.workers > 1:
+            batch_size = min(batch_size, math.ceil(len(ordered) / p.workers))
+        batches = [ordered[i:i + batch_size]
+                   for i in range(0, len(ordered), batch_size)]
+        new = []
+        for rs, n in p.map(_cell_metrics, cfg, batches):
+            new += rs
+            if computed is not None:
+                computed.update(n)
+    for i, r in zip(order, new):
+        out[i] = r
+    _remember([keys[i] for i in order], new)
+    return out
+
+
+def _batch_metrics(cfg, scenarios, market, batch_size=BATCH_SIZE, workers=None):
+    """全期間のシナリオ群を回し、シナリオ順のメトリクスを返す。"""
+    return _run_cells(cfg, [(sc, None, None) for sc in scenarios], market,
+                      batch_size, workers)
+
+
+def full_period(cfg, market=None, workers=None):
+    """全期間・コスト1xのメトリクス（結果キャッシュ経由）。"""
+    return _batch_metrics(cfg, [{}], market, workers=workers)[0]
+
+
+def _month(y, m):
+    """y年m月1日(UTC)のepoch。m は12を超えてもよい（翌年に繰り上げ）。"""
+    y, m = y + (m - 1) // 12, (m - 1) % 12 + 1
+    return _ep(y, m), y, m
+
+
+def calendar_windows(t0, t1, months=12):
+    """[t0, t1] にかかる暦の区切り窓 [(ラベル, start, end)]。
+    months=12 で暦年（"2024"）、6 で半期（"2024H1"）、3 で四半期（"2024Q1"）、
+    1 で月（"2024-01"）。両端の窓はデータの範囲で途中まで。"""
+    if 12 % months:
+        raise ValueError(f"months は 12 の約数: {months}")
+    d0 = dt.datetime.fromtimestamp(t0, dt.timezone.utc)
+    y, m = d0.year, (d0.month - 1) // months * months + 1
+    out = []
+    while True:
+        start, y, m = _month(y, m)
+        if start > t1:
+            return out
+        end = _month(y, m + months)[0]
+        k = (m - 1) // months + 1
+        label = {12: f"{y}", 6: f"{y}H{k}", 3: f"{y}Q{k}"}.get(months, f"{y}-{m:02d}")
+        out.append((label, start, end))
+        m += months
+
+
+def rolling_windows(t0, t1, months, step_months=1):
+    """長さ months ヶ月の窓を step_months ヶ月ずつずらした列 [(ラベル, start, end)]。
+    窓は月初に揃え、[t0, t1] に収まるものだけ（ラベルは "2024-01..2024-12"）。"""
+    d0 = dt.datetime.fromtimestamp(t0, dt.timezone.utc)
+    y, m = d0.year, d0.month + (d0 != dt.datetime(d0.year, d0.month, 1,
+                                                  tzinfo=dt.timezone.utc))
+    out = []
+    while True:
+        start, y, m = _month(y, m)
+        end = _month(y, m + months)[0]
+        if end > t1:
+            return out
+        _, y2, m2 = _month(y, m + months - 1)
+        out.append((f"{y}-{m:02d}..{y2}-{m2:02d}", start, end))
+        m += step_months
+
+
+def walk_forward(cfg, years=(2022, 2023, 2024, 2025, 2026), market=None,
+                 workers=None, windows=None):
+    """窓ごとに資本$initでリセットした独立窓評価（各窓の内部は連続運用）。
+
+    windows: [(ラベル, start_epoch, end_epoch)]（calendar_windows /
+    rolling_windows）。省略時は years の暦年。データ読込・sig/vol・逆vol配分は
+    全窓で1回だけ作り、各窓は自分の期間だけを新しい口座・ブレーカーで回す
+    （窓は run_backtest_batch の windows でまとめて1本のバーループに載せる）。
+    workers: 窓を並べて回すワーカー数（か共有の parallel.CellPool）。
+    結果キャッシュにある窓は回さない（年を足しても既存の窓は再利用する）。"""
+    if windows is None:
+        windows = [(str(y), _ep(y), _ep(y + 1)) for y in years]
+    mets = _run_cells(cfg, [({}, a, b) for _, a, b in windows], market,
+                      workers=workers)
     out = {}
-    for y in years:
-        res = run_backtest(cfg, start_epoch=_ep(y), end_epoch=_ep(y + 1))
-        m = compute_metrics(res, cfg.bars_per_year)
+    for (label, _, _), m in zip(windows, mets):
         if m.get("valid"):
-            out[str(y)] = {k: m[k] for k in
-                           ("start", "end", "total_pnl", "ann_return", "sharpe",
-                            "maxdd", "n_trades", "halted")}
+            out[label] = {k: m[k] for k in
+                          ("start", "end", "total_pnl", "ann_return", "sharpe",
+                           "maxdd", "n_trades", "halted")}
     return out
 
 
@@ -44,12 +221,12 @@ def wf_gates(wf):
     }
 
 
-def cost_stress(cfg, mults=(1.0, 3.0, 5.0)):
+def cost_stress(cfg, mults=(1.0, 3.0, 5.0), market=None, workers=None):
     """コスト1x/3x/5xでの全期間成績。現実コストの3-5倍で有意にプラスが理想。"""
     out = {}
-    for m in mults:
-        res = run_backtest(cfg, cost_mult=m)
-        met = compute_metrics(res, cfg.bars_per_year)
+    mets = _batch_metrics(cfg, [{"cost_mult": m} for m in mults], market,
+                          workers=workers)
+    for m, met in zip(mults, mets):
         out[f"{m:g}x"] = {k: met[k] for k in
                           ("ann_return", "sharpe", "maxdd", "final_equity",
                            "cost_drag_pct", "halted")}
@@ -59,24 +236,47 @@ def cost_stress(cfg, mults=(1.0, 3.0, 5.0)):
 def sensitivity(cfg,
                 target_vols=(0.10, 0.15, 0.20, 0.25, 0.30),
                 horizon_scales=(0.5, 0.75, 1.0, 1.5, 2.0),
-                vol_windows=(15, 30, 60)):
+                vol_windows=(15, 30, 60), market=None, workers=None, stats=None):
     """2枚のヒートマップ用グリッド:
     (A) target_vol × horizon_scale — リスク水準とトレンド速度の感応度
     (B) target_vol × vol_window   — vol推定窓の感応度
-    各セル: sharpe / ann_return / maxdd / halted。滑らかであること＝低過学習の証拠。"""
-    def run(tv, hs=1.0, vw=None):
+    各セル: sharpe / ann_return / maxdd / halted。滑らかであること＝低過学習の証拠。
+    全セルをシナリオとして run_backtest_batch でまとめて回す
+    （workers>1 ならバッチをワーカーに分けて回す）。
+
+    40セルでも sig は horizon_scale の数、vol は vol窓の数、逆vol配分の経路は
+    その組の数しか要らない（target_vol はバーループでのスケールだけ）。
+    前計算はキャッシュ経由で1回ずつ作って全セルで共有する。
+    stats: dict を渡すと、セル数と前計算の数を書き込む。required はグリッドに
+    要るユニークな数（kernel_counts）、computed はこの呼び出しで実際に計算した数
+    （sig/vol キャッシュ・結果キャッシュに有った分は 0、ワーカー間で重なれば
+    required より多い）。"""
+    def scenario(tv, hs=1.0, vw=None):
         hd = [(max(1, round(f * hs)), max(2, round(s * hs)))
               for f, s in cfg.horizons_days]
-        res = run_backtest(cfg, target_vol=tv, horizons_days=hd,
-                           vol_window_days=vw or cfg.vol_window_days)
-        m = compute_metrics(res, cfg.bars_per_year)
-        return {k: m[k] for k in ("sharpe", "ann_return", "maxdd",
-                                  "final_equity", "halted")}
-
-    grid_a = {f"tv={tv:g}|hs={hs:g}": run(tv, hs=hs)
-              for tv in target_vols for hs in horizon_scales}
-    grid_b = {f"tv={tv:g}|vw={vw}": run(tv, vw=vw)
-              for tv in target_vols for vw in vol_windows}
+        return {"target_vol": tv, "horizons_days": hd,
+                "vol_window_days": vw or cfg.vol_window_days}
+
+    cells_a = [(f"tv={tv:g}|hs={hs:g}", scenario(tv, hs=hs))
+               for tv in target_vols for hs in horizon_scales]
+    cells_b = [(f"tv={tv:g}|vw={vw}", scenario(tv, vw=vw))
+               for tv in target_vols for vw in vol_windows]
+    scenarios = [sc for _, sc in cells_a + cells_b]
+    computed = collections.Counter()
+    mets = _run_cells(cfg, [(sc, None, None) for sc in scenarios], market,
+                      workers=workers, computed=computed)
+    if stats is not None:
+        stats.update(scenarios=len(scenarios),
+                     required=kernel_counts(cfg, scenarios),
+                     computed={k: computed[kind] for k, kind in _KERNEL_KINDS.items()})
+
+    def grid(cells, mets):
+        return {key: {k: m[k] for k in ("sharpe", "ann_return", "maxdd",
+                                        "final_equity", "halted")}
+                for (key, _), m in zip(cells, mets)}
+
+    grid_a = grid(cells_a, mets[:len(cells_a)])
+    grid_b = grid(cells_b, mets[len(cells_a):])
     return {"vol_x_horizon": grid_a, "vol_x_volwindow": grid_b,
             "axes": {"target_vols": list(target_vols),
                      "horizon_scales": list(horizon_scales),
@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 """バックテスト実行 + サマリ表示（+ 任意でHTMLレポート生成）。"""
 import argparse
+import dataclasses
 import datetime as dt
+import os
 import subprocess
 
+from cta import live_backtest, stream
 from cta.config import load_config
 from cta.engine import run_backtest
+from cta.market import MarketData
 from cta.metrics import compute_metrics, yearly_metrics
 
 
@@ -19,14 +23,47 @@ def main():
     ap.add_argument("--start", default=None, help="YYYY-MM-DD")
     ap.add_argument("--end", default=None, help="YYYY-MM-DD")
     ap.add_argument("--cost-mult", type=float, default=1.0)
+    ap.add_argument("--float32", action="store_true",
+                    help="[T,N]系列をfloat32で持つ省メモリモード（現金・equityはfloat64）")
+    ap.add_argument("--event", action="store_true",
+                    help="イベント駆動モード（約定・リバランス・ブレーカーのバーだけ回す。結果は同一）")
+    ap.add_argument("--live", default=None, metavar="NPZ",
+                    help="追記型のライブバックテスト成果物。前回からの新しいバーだけ回して"
+                         "継ぎ足す（過去データ・設定が変わっていれば作り直す）")
+    ap.add_argument("--stream", default=None, metavar="DIR",
+                    help="省メモリのストリーミング実行。DIR/panel にメモリマップのパネルを作り、"
+                         "チャンクごとに回して DIR/result に書き出す（結果は同一）")
+    ap.add_argument("--chunk-bars", type=int, default=stream.DEFAULT_CHUNK_BARS)
     ap.add_argument("--report", default=None, help="HTMLレポート出力パス")
     args = ap.parse_args()
+    if (args.live or args.stream) and (args.start or args.end):
+        ap.error("--live / --stream は全期間専用（--start/--end と併用不可）")
+    if args.live and args.cost_mult != 1.0:
+        ap.error("--live はコスト1x専用（--cost-mult と併用不可）")
+    if args.live and args.stream:
+        ap.error("--live と --stream は併用不可")
 
     cfg = load_config(args.config)
-    res = run_backtest(cfg,
-                       start_epoch=ep(args.start) if args.start else None,
-                       end_epoch=ep(args.end) if args.end else None,
-                       cost_mult=args.cost_mult)
+    if args.float32:
+        cfg = dataclasses.replace(cfg, storage_dtype="float32")
+    if args.event:
+        cfg = dataclasses.replace(cfg, engine_mode="event")
+    market = None if args.stream else MarketData.load(cfg)
+    if args.stream:
+        panel_dir = os.path.join(args.stream, "panel")
+        stream.build_panel(cfg, panel_dir)
+        res = stream.run_backtest_stream(cfg, panel_dir,
+                                         os.path.join(args.stream, "result"),
+                                         chunk_bars=args.chunk_bars,
+                                         cost_mult=args.cost_mult)
+    elif args.live:
+        res, status = live_backtest.update(cfg, args.live, market=market)
+        print(f"live backtest: {status} ({args.live})")
+    else:
+        res = run_backtest(cfg,
+                           start_epoch=ep(args.start) if args.start else None,
+                           end_epoch=ep(args.end) if args.end else None,
+                           cost_mult=args.cost_mult, market=market)
     m = compute_metrics(res, cfg.bars_per_year)
     try:
         commit = subprocess.check_output(
@@ -49,8 +86,9 @@ def main():
     print(f"gross lev  : avg {m['avg_gross']:.2f}x / max {m['max_gross']:.2f}x")
     print(f"concentr.  : top quarter {m['top_quarter_share']*100:.0f}% / "
           f"top asset {m['top_asset_share']*100:.0f}%")
+    yearly = yearly_metrics(res, cfg.bars_per_year)
     print("--- yearly ---")
-    for y, ym in yearly_metrics(res, cfg.bars_per_year).items():
+    for y, ym in yearly.items():
         if ym.get("valid"):
             print(f"  {y}: {ym['ann_return']*100:+7.1f}%/yr  "
                   f"sharpe {ym['sharpe']:5.2f}  maxDD {ym['maxdd']*100:4.1f}%  "
@@ -61,8 +99,7 @@ def main():
 
     if args.report:
         from cta.report import write_report
-        write_report(args.report, cfg, res, m,
-                     yearly_metrics(res, cfg.bars_per_year), commit)
+        write_report(args.report, cfg, res, m, yearly, commit)
         print(f"report -> {args.report}")
 
 
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """Phase 3 検証ゲート一式を実行し、out/validation.json に保存 + コンソール要約。"""
 import argparse
+import dataclasses
 import json
 import subprocess
 
 from cta.config import load_config
-from cta.engine import run_backtest
-from cta.metrics import compute_metrics
+from cta.market import MarketData
+from cta import cache
+from cta import result_cache
 from cta import validate as v
+from cta.parallel import CellPool
 
 
 def main():
@@ -15,54 +18,95 @@ def main():
     ap.add_argument("--config", default="config/default.ini")
     ap.add_argument("--out", default="out/validation.json")
     ap.add_argument("--skip-sensitivity", action="store_true")
+    ap.add_argument("--float32", action="store_true",
+                    help="[T,N]系列をfloat32で持つ省メモリモード（現金・equityはfloat64）")
+    ap.add_argument("--event", action="store_true",
+                    help="イベント駆動モード（約定・リバランス・ブレーカーのバーだけ回す。結果は同一）")
+    ap.add_argument("--cache-dir", default=None,
+                    help="sig/volの.npzキャッシュ置き場（例: out/cache）。"
+                         "省略時はプロセス内LRUのみ")
+    ap.add_argument("--result-cache", default="out/cache/results",
+                    help="バックテスト結果（メトリクス・equity）の永続キャッシュ置き場。"
+                         "設定・データ・コード・上書き引数が同じセルは回さない")
+    ap.add_argument("--no-result-cache", action="store_true")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="並列ワーカー数（価格パネルは共有メモリで渡す。結果は同一）")
+    ap.add_argument("--wf-windows", default="year",
+                    choices=("year", "quarter", "rolling6", "rolling12"),
+                    help="walk-forwardの窓（暦年 / 四半期 / 6・12ヶ月ローリング・1ヶ月ずらし）")
     args = ap.parse_args()
 
     cfg = load_config(args.config)
+    if args.float32:
+        cfg = dataclasses.replace(cfg, storage_dtype="float32")
+    if args.event:
+        cfg = dataclasses.replace(cfg, engine_mode="event")
+    if args.cache_dir:
+        cache.set_disk_dir(args.cache_dir)
+    if not args.no_result_cache:
+        result_cache.set_dir(args.result_cache)
     try:
         commit = subprocess.check_output(
             ["git", "rev-parse", "--short", "HEAD"], text=True).strip()
     except Exception:
         commit = "?"
 
-    print("=== full period ===")
-    res = run_backtest(cfg)
-    m = compute_metrics(res, cfg.bars_per_year)
-    print(f"  {m['start']}..{m['end']}  sharpe {m['sharpe']:.2f}  "
-          f"ann {m['ann_return']*100:+.1f}%  maxDD {m['maxdd']*100:.1f}%  "
-          f"halted {m['halted']}")
+    # 価格・fundingは1回だけ読み、全ゲート（と並列ワーカー）で共有する
+    market = MarketData.load(cfg)
+    # ワーカーと共有メモリは例外・Ctrl-C でも必ず片付ける
+    with CellPool(market, args.jobs) as pool:
+        print("=== full period ===")
+        m = v.full_period(cfg, market=market, workers=pool)
+        print(f"  {m['start']}..{m['end']}  sharpe {m['sharpe']:.2f}  "
+              f"ann {m['ann_return']*100:+.1f}%  maxDD {m['maxdd']*100:.1f}%  "
+              f"halted {m['halted']}")
 
-    print("=== walk-forward (暦年独立窓) ===")
-    wf = v.walk_forward(cfg)
-    for y, w in wf.items():
-        print(f"  {y}: pnl {w['total_pnl']:+8.2f}  sharpe {w['sharpe']:5.2f}  "
-              f"maxDD {w['maxdd']*100:4.1f}%  halted {w['halted']}")
-    gates = v.wf_gates(wf)
-    print(f"  gates: all_positive={gates['all_windows_positive']}  "
-          f"ex-best({gates.get('best_window')})={gates.get('sum_ex_best', 0):+.2f}")
+        print(f"=== walk-forward ({args.wf_windows} 独立窓) ===")
+        windows = None
+        if args.wf_windows != "year":
+            t0, t1 = float(market.times[0]), float(market.times[-1])
+            windows = (v.calendar_windows(t0, t1, 3) if args.wf_windows == "quarter"
+                       else v.rolling_windows(t0, t1, int(args.wf_windows[7:])))
+        wf = v.walk_forward(cfg, market=market, workers=pool, windows=windows)
+        for y, w in wf.items():
+            print(f"  {y}: pnl {w['total_pnl']:+8.2f}  sharpe {w['sharpe']:5.2f}  "
+                  f"maxDD {w['maxdd']*100:4.1f}%  halted {w['halted']}")
+        gates = v.wf_gates(wf)
+        print(f"  gates: all_positive={gates['all_windows_positive']}  "
+              f"ex-best({gates.get('best_window')})={gates.get('sum_ex_best', 0):+.2f}")
 
-    print("=== cost stress ===")
-    cs = v.cost_stress(cfg)
-    for k, c in cs.items():
-        print(f"  {k}: sharpe {c['sharpe']:5.2f}  ann {c['ann_return']*100:+6.1f}%  "
-              f"maxDD {c['maxdd']*100:4.1f}%  halted {c['halted']}")
+        print("=== cost stress ===")
+        cs = v.cost_stress(cfg, market=market, workers=pool)
+        for k, c in cs.items():
+            print(f"  {k}: sharpe {c['sharpe']:5.2f}  "
+                  f"ann {c['ann_return']*100:+6.1f}%  "
+                  f"maxDD {c['maxdd']*100:4.1f}%  halted {c['halted']}")
 
-    sens = None
-    if not args.skip_sensitivity:
-        print("=== sensitivity (数分かかります) ===")
-        sens = v.sensitivity(cfg)
-        for name, grid in (("target_vol × horizon_scale", sens["vol_x_horizon"]),
-                           ("target_vol × vol_window", sens["vol_x_volwindow"])):
-            print(f"  --- {name} (sharpe / halted) ---")
-            for key, cell in grid.items():
-                flag = " HALT" if cell["halted"] else ""
-                print(f"    {key:16s} sharpe {cell['sharpe']:5.2f}  "
-                      f"ann {cell['ann_return']*100:+6.1f}%  "
-                      f"maxDD {cell['maxdd']*100:4.1f}%{flag}")
+        sens = None
+        if not args.skip_sensitivity:
+            print("=== sensitivity ===")
+            kstats = {}
+            sens = v.sensitivity(cfg, market=market, workers=pool, stats=kstats)
+            req, done = kstats["required"], kstats["computed"]
+            print(f"  {kstats['scenarios']} cells / unique kernels "
+                  f"(required / computed): "
+                  + "  ".join(f"{k} {req[k]}/{done[k]}" for k in req))
+            for name, grid in (("target_vol × horizon_scale", sens["vol_x_horizon"]),
+                               ("target_vol × vol_window", sens["vol_x_volwindow"])):
+                print(f"  --- {name} (sharpe / halted) ---")
+                for key, cell in grid.items():
+                    flag = " HALT" if cell["halted"] else ""
+                    print(f"    {key:16s} sharpe {cell['sharpe']:5.2f}  "
+                          f"ann {cell['ann_return']*100:+6.1f}%  "
+                          f"maxDD {cell['maxdd']*100:4.1f}%{flag}")
 
     power = v.statistical_power(m)
     print(f"=== statistical power ===\n  trades {power['n_trades']} "
           f"(min {power['min_trades']})  sharpe_se {power['sharpe_se']:.2f}  "
           f"t-stat {power['sharpe_t']:.2f}")
+    rc = result_cache.default()
+    if rc is not None:
+        print(f"result cache: {rc.hits} hit / {rc.misses} miss ({rc.directory})")
 
     out = {"commit": commit, "config_sha1": cfg.config_sha1,
            "config_path": cfg.config_path,
@@ -0,0 +1,126 @@
+"""sig/volキャッシュの回帰テスト。キャッシュ有無で結果が1bitも変わらないこと。"""
+import os
+
+import numpy as np
+import pytest
+
+from cta import cache as cache_mod
+from cta.engine import run_backtest
+from tests.test_engine import make_cfg, trending_market
+
+
+def test_lru_evicts_oldest_by_total_bytes():
+    c = cache_mod.ArrayCache(max_bytes=3 * 800)
+    for k in "abc":
+        c.put(k, np.zeros(100))            # 800 bytes each
+    c.get("a")                             # a を最近使用に
+    c.put("d", np.zeros(100))
+    assert c.get("b") is None              # 最古の b が追い出される
+    assert all(c.get(k) is not None for k in "acd")
+
+
+def test_cached_arrays_are_read_only():
+    c = cache_mod.ArrayCache()
+    src = np.arange(5.0)
+    arr = c.get_or_compute("k", lambda: src)
+    src[0] = 99.0                          # 元配列の変更は波及しない
+    assert arr[0] == 0.0
+    with pytest.raises(ValueError):
+        arr[1] = 1.0
+
+
+def test_disk_layer_round_trip_and_size_bound(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_mod, "code_version", lambda: "v1")
+    d = str(tmp_path / "cache")
+    a = cache_mod.ArrayCache(disk_dir=d, max_disk_bytes=3000)
+    a.put("x", np.arange(100.0))
+    b = cache_mod.ArrayCache(disk_dir=d, max_disk_bytes=3000)   # 別プロセス相当
+    assert np.array_equal(b.get("x"), np.arange(100.0))
+    for k in "yzw":
+        b.put(k, np.arange(100.0))
+    names = os.listdir(d)
+    assert len(names) < 4 and any(n.startswith("w-") for n in names)
+
+
+def test_disk_layer_misses_after_code_or_backend_change(tmp_path, monkeypatch):
+    """コード（strategy.py 等）やカーネルのバックエンドが変われば、前の実行が
+    ディスクに残した配列は引かない。"""
+    d = str(tmp_path / "cache")
+    monkeypatch.setattr(cache_mod, "code_version", lambda: "v1")
+    # 書く側のバックエンドは環境（CTA_KERNEL_BACKEND）に依らず numpy に固定する
+    monkeypatch.setattr(cache_mod.kernels, "backend", lambda: "numpy")
+    cache_mod.ArrayCache(disk_dir=d).put("sig", np.arange(10.0))
+    assert cache_mod.ArrayCache(disk_dir=d).get("sig") is not None
+    monkeypatch.setattr(cache_mod.kernels, "backend", lambda: "numba")
+    assert cache_mod.ArrayCache(disk_dir=d).get("sig") is None
+    monkeypatch.undo()
+    monkeypatch.setattr(cache_mod, "code_version", lambda: "v2")
+    assert cache_mod.ArrayCache(disk_dir=d).get("sig") is None
+    monkeypatch.setattr(cache_mod, "code_version", lambda: None)   # 版不明は使わない
+    c = cache_mod.ArrayCache(disk_dir=d)
+    c.put("vol", np.arange(3.0))
+    assert not any(n.startswith("vol") for n in os.listdir(d))
+
+
+def test_disk_hit_survives_concurrent_eviction(tmp_path, monkeypatch):
+    """読み込んだ直後に他のワーカーがファイルを消しても（mtime を更新できなくても）
+    読めた配列はそのまま返す。"""
+    monkeypatch.setattr(cache_mod, "code_version", lambda: "v1")
+    d = str(tmp_path / "cache")
+    cache_mod.ArrayCache(disk_dir=d).put("x", np.arange(5.0))
+
+    def gone(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(cache_mod.os, "utime", gone)
+    assert np.array_equal(cache_mod.ArrayCache(disk_dir=d).get("x"), np.arange(5.0))
+
+
+def test_fingerprint_and_key_change_with_content():
+    x = np.arange(6.0).reshape(3, 2)
+    y = x.copy()
+    y[2, 1] = np.nextafter(y[2, 1], 10)
+    assert cache_mod.fingerprint(x) != cache_mod.fingerprint(y)
+    assert cache_mod.fingerprint(x) != cache_mod.fingerprint(x.reshape(2, 3))
+    assert (cache_mod.make_key("sig", a=1, b=[1, 2])
+            == cache_mod.make_key("sig", b=[1, 2], a=1))
+
+
+def test_backtest_reuses_precompute_across_cost_mults(tmp_path):
+    db, _, _ = trending_market(tmp_path)
+    cfg = make_cfg(db, ["A"])
+    c = cache_mod.ArrayCache()
+    r1 = run_backtest(cfg, cost_mult=1.0, cache=c)
+    assert (c.hits, c.misses) == (0, 4)            # w_unit / sig / vol / pvol
+    r3 = run_backtest(cfg, cost_mult=3.0, cache=c)
+    assert (c.hits, c.misses) == (2, 4)            # w_unit / pvol を再利用
+    fresh = run_backtest(cfg, cost_mult=3.0, cache=cache_mod.ArrayCache())
+    assert np.array_equal(r3.equity, fresh.equity)
+    assert r1.equity[-1] != r3.equity[-1]
+    run_backtest(cfg, vol_window_days=cfg.vol_window_days + 5, cache=c)
+    assert (c.hits, c.misses) == (3, 7)            # sigのみ再利用
+
+
+def test_sensitivity_computes_each_unique_kernel_once(tmp_path, monkeypatch):
+    from cta import validate
+    from cta.market import MarketData
+    from tests.test_market import _two_assets
+
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"], vol_window_days=5)
+    market = MarketData.load(cfg)
+    grid = dict(target_vols=(0.1, 0.2, 0.3), horizon_scales=(0.5, 1.0, 2.0),
+                vol_windows=(3, 5), market=market)
+    ref = validate.sensitivity(cfg, **grid)
+    c = cache_mod.ArrayCache()
+    monkeypatch.setattr(cache_mod, "_default", c)
+    stats = {}
+    assert validate.sensitivity(cfg, stats=stats, **grid) == ref
+    # A: 3 horizon × vw5 / B: horizon 1.0 × vw3,5（vw5 は A と共通）
+    need = {"signal": 3, "vol": 2, "unit_path": 4}
+    assert stats == {"scenarios": 15, "required": need, "computed": need}
+    # unit経路は w_unit と pvol の2つ
+    assert c.misses == need["signal"] + need["vol"] + 2 * need["unit_path"]
+    # 2回目はキャッシュから引くので何も計算しない
+    validate.sensitivity(cfg, stats=stats, **grid)
+    assert stats["required"] == need
+    assert stats["computed"] == {"signal": 0, "vol": 0, "unit_path": 0}
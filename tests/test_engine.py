@@ -3,6 +3,7 @@
 最重要: 同足約定が構造的に不可能であること（判定バー終値ではなく
 次バー始値±slippageで約定していること）を合成データで検証する。
 """
+import dataclasses
 import math
 import sqlite3
 
@@ -141,3 +142,329 @@ def test_min_notional_blocks_dust_capital(tmp_path):
     cfg = make_cfg(db, ["A"], init_capital_usd=3.0)  # 最小ロット5USD未満
     res = run_backtest(cfg)
     assert len(res.fills) == 0
+
+
+def test_float32_storage_within_documented_tolerance(tmp_path):
+    """省メモリモード（storage_dtype=float32）の許容誤差を固定する。
+
+    float32で持つのは価格・シグナル・vol・履歴などの [T,N] 系列だけで、
+    現金・equity・約定計算はfloat64のまま。価格の丸め（相対 ~6e-8）が
+    目標数量に乗るだけなので、float64版との差は
+      - equity: 全バーで相対 1e-4 以内
+      - Sharpe / 年率リターン / MaxDD: 相対 1e-4 以内
+      - 取引回数: 一致
+    に収まる（これを超えたら精度劣化として扱う）。"""
+    from cta.metrics import compute_metrics
+
+    rng = np.random.default_rng(7)
+    prices = {}
+    for k, sym in enumerate("ABC"):
+        closes = 100.0 * np.exp(np.cumsum(rng.normal(0.001 * (k - 1), 0.02, 800)))
+        prices[sym] = (np.r_[100.0, closes[:-1]] * (1 + rng.normal(0, 0.002, 800)),
+                       closes)
+    db = make_db(tmp_path, prices)
+    cfg = make_cfg(db, list("ABC"))
+    ref = run_backtest(cfg)
+    low = run_backtest(make_cfg(db, list("ABC"), storage_dtype="float32"))
+
+    assert low.equity.dtype == np.float64           # 集計はfloat64
+    assert low.weights.dtype == low.asset_pnl.dtype == np.float32
+    np.testing.assert_allclose(low.equity, ref.equity, rtol=1e-4)
+    m_ref, m_low = (compute_metrics(r, cfg.bars_per_year) for r in (ref, low))
+    for k in ("sharpe", "ann_return", "maxdd"):
+        assert m_low[k] == pytest.approx(m_ref[k], rel=1e-4)
+    assert m_low["n_trades"] == m_ref["n_trades"]
+
+
+def test_unknown_storage_dtype_is_rejected(tmp_path):
+    db, _, _ = trending_market(tmp_path)
+    with pytest.raises(ValueError):
+        run_backtest(make_cfg(db, ["A"], storage_dtype="float16"))
+
+
+def test_array_mark_bar_matches_per_symbol_portfolio_accounting():
+    """配列版のバーごと会計（funding・時価評価・資産別PnL・ウェイト）が
+    銘柄ごとに Portfolio を更新していた従来の処理とビット単位で一致すること。"""
+    from cta import execution as ex
+    from cta.engine import _mark_bar
+
+    rng = np.random.default_rng(4)
+    syms = [f"S{j}" for j in range(12)]
+    qty = np.where(rng.random(12) < 0.3, 0.0, rng.normal(0, 3, 12))
+    px = rng.uniform(10, 200, 12)
+    px[[2, 7]] = np.nan                       # 上場前
+    prev = px * (1 + rng.normal(0, 0.01, 12))
+    rate = np.where(rng.random(12) < 0.2, 0.0, rng.normal(0, 1e-4, 12))
+    cons = rng.random(12) < 0.5
+
+    pf = ex.Portfolio(1234.5, dict(zip(syms, qty)))
+    funding, pnl_ref, w_ref = 7.0, np.zeros(12), np.zeros(12)
+    for j, s in enumerate(syms):
+        if not np.isnan(px[j]):
+            cost = pf.apply_funding(s, px[j], rate[j], conservative=bool(cons[j]))
+            funding += cost
+            pnl_ref[j] -= cost
+    eq_ref = pf.cash_usd + sum(pf.positions[s] * px[j] for j, s in enumerate(syms)
+                               if not np.isnan(px[j]))
+    for j, s in enumerate(syms):
+        q = pf.positions[s]
+        if q != 0.0 and not np.isnan(px[j]):
+            pnl_ref[j] += q * (px[j] - prev[j])
+            w_ref[j] = q * px[j] / eq_ref
+
+    # シナリオ軸 [S,N]: 2行目は無保有のシナリオ（現金のまま・何も記録しない）
+    qty2 = np.vstack([qty, np.zeros(12)])
+    cash, fund = np.array([1234.5, 500.0]), np.array([7.0, 0.0])
+    pnl, w = np.zeros((2, 12)), np.zeros((2, 12))
+    eq = _mark_bar(qty2, cash, fund, px, prev, np.vstack([rate, rate]), cons, True,
+                   pnl, w)
+    assert (cash[0], eq[0], fund[0]) == (pf.cash_usd, eq_ref, funding)
+    assert np.array_equal(pnl[0], pnl_ref) and np.array_equal(w[0], w_ref)
+    assert (cash[1], eq[1], fund[1]) == (500.0, 500.0, 0.0)
+    assert not pnl[1].any() and not w[1].any()
+
+
+def test_batch_scenarios_match_individual_runs(tmp_path):
+    """run_backtest_batch の各シナリオが、同じパラメータの run_backtest と
+    ビット単位で一致すること（ホライズン・vol窓違いで開始バーがずれる場合や、
+    一部のシナリオだけブレーカーが発動する場合を含む）。"""
+    from cta.engine import run_backtest_batch
+
+    rng = np.random.default_rng(11)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        steps = rng.normal(0.003 * (1 - k), 0.004, 700)
+        steps[450] = -0.1                     # 急落（高レバのシナリオだけ停止する）
+        closes = 100.0 * np.exp(np.cumsum(steps))
+        prices[sym] = (np.r_[100.0, closes[:-1]], closes)
+    db = make_db(tmp_path, prices)
+    cfg = make_cfg(db, list("AB"))
+    scenarios = [{},
+                 {"cost_mult": 3.0},
+                 {"target_vol": 1.5, "dd_soft": 0.1, "dd_hard": 0.2},
+                 {"horizons_days": [(2, 6), (4, 10)], "vol_window_days": 8},
+                 {"no_trade_band_pct": 0.05, "target_vol": 0.2}]
+    batch = run_backtest_batch(cfg, scenarios)
+    assert len(batch) == len(scenarios)
+    for sc, res in zip(scenarios, batch):
+        over = {k: sc[k] for k in ("no_trade_band_pct", "dd_soft", "dd_hard")
+                if k in sc}
+        ref = run_backtest(make_cfg(db, list("AB"), **over),
+                           **{k: v for k, v in sc.items() if k not in over})
+        assert np.array_equal(res.times, ref.times)
+        assert np.array_equal(res.equity, ref.equity)
+        assert np.array_equal(res.weights, ref.weights)
+        assert np.array_equal(res.pos_qty, ref.pos_qty)
+        assert np.array_equal(res.asset_pnl, ref.asset_pnl)
+        assert res.fills == ref.fills
+        assert (res.fees_usd, res.funding_usd, res.turnover_usd, res.halted_at) == \
+            (ref.fees_usd, ref.funding_usd, ref.turnover_usd, ref.halted_at)
+    assert batch[2].halted_at is not None and batch[0].halted_at is None
+    assert batch[3].times[0] > batch[0].times[0]   # 長いホライズンほど遅く始まる
+
+
+def test_slice_and_windows_are_views(tmp_path):
+    """slice / windows はマスク抽出と同じ中身を、コピーせずに返すこと。"""
+    db, _, _ = trending_market(tmp_path, n=900)
+    res = run_backtest(make_cfg(db, ["A"]))
+    bounds = [res.times[0] - 1, res.times[100] + 0.5, res.times[400],
+              res.times[-1] + 1]
+    wins = list(res.windows(bounds))
+    assert sum(len(w.times) for w in wins) == len(res.times)
+    for (t0, t1), w in zip(zip(bounds[:-1], bounds[1:]), wins):
+        m = (res.times >= t0) & (res.times < t1)
+        sub = res.slice(t0, t1)
+        for got in (w, sub):
+            assert np.array_equal(got.equity, res.equity[m])
+            assert np.array_equal(got.asset_pnl, res.asset_pnl[m])
+            assert got.fills == [f for f in res.fills if t0 <= f.ts < t1]
+        assert np.shares_memory(sub.weights, res.weights)
+        assert np.shares_memory(sub.pos_qty, res.pos_qty)
+    assert len(res.slice(0, 1).times) == 0
+
+
+@pytest.mark.parametrize("engine_mode,dtype", [("bar", "float64"),
+                                                ("event", "float64"),
+                                                ("bar", "float32")])
+def test_record_levels_give_identical_metrics(tmp_path, engine_mode, dtype):
+    """record="equity" / "summary"（equity 統計の逐次集計）でも compute_metrics の
+    値が full と完全に一致し、記録しない系列・fillsは持たないこと。"""
+    from cta.engine import run_backtest_batch
+    from cta.metrics import compute_metrics
+
+    rng = np.random.default_rng(11)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        steps = rng.normal(0.003 * (1 - k), 0.004, 700)
+        steps[450] = -0.1
+        closes = 100.0 * np.exp(np.cumsum(steps))
+        prices[sym] = (np.r_[100.0, closes[:-1]] * 1.001, closes)
+    cfg = make_cfg(make_db(tmp_path, prices), list("AB"), engine_mode=engine_mode,
+                   storage_dtype=dtype, rebalance_days=2)
+    scenarios = [{}, {"target_vol": 1.5, "dd_soft": 0.1, "dd_hard": 0.2},
+                 {"horizons_days": [(2, 6), (4, 10)], "cost_mult": 3.0}]
+    full = run_backtest_batch(cfg, scenarios)
+    assert any(r.halted_at is not None for r in full)
+    for record in ("equity", "summary"):
+        light = run_backtest_batch(cfg, scenarios, record=record)
+        for ref, res in zip(full, light):
+            assert compute_metrics(res, cfg.bars_per_year) == \
+                compute_metrics(ref, cfg.bars_per_year)
+            assert res.weights is None and res.asset_pnl is None and res.fills == []
+            assert (res.equity is None) == (record == "summary")
+            with pytest.raises(ValueError):
+                res.slice(0, 1e12)
+    with pytest.raises(ValueError):
+        run_backtest(cfg, record="none")
+
+
+def test_batch_rejects_unknown_scenario_keys(tmp_path):
+    from cta.engine import run_backtest_batch
+
+    db, _, _ = trending_market(tmp_path)
+    with pytest.raises(ValueError):
+        run_backtest_batch(make_cfg(db, ["A"]), [{"target_voll": 0.2}])
+
+
+@pytest.mark.parametrize("kw", [{"rebalance_days": 1}, {"rebalance_days": 7},
+                                {"target_vol": 1.5, "dd_soft": 0.1, "dd_hard": 0.2}])
+def test_event_mode_matches_bar_by_bar(tmp_path, kw):
+    """イベント駆動モード（区間まとめの時価評価・区間内のブレーカー走査）が
+    バーごとのループとビット単位で一致すること。停止後の区間も含む。"""
+    rng = np.random.default_rng(11)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        steps = rng.normal(0.003 * (1 - k), 0.004, 700)
+        steps[450] = -0.1
+        closes = 100.0 * np.exp(np.cumsum(steps))
+        prices[sym] = (np.r_[100.0, closes[:-1]], closes)
+    prices["B"] = tuple(p[100:] for p in prices["B"])
+    db = make_db(tmp_path, prices)
+    ref = run_backtest(make_cfg(db, list("AB"), **kw), cost_mult=2.0)
+    res = run_backtest(make_cfg(db, list("AB"), engine_mode="event", **kw),
+                       cost_mult=2.0)
+    assert np.array_equal(res.times, ref.times)
+    assert np.array_equal(res.equity, ref.equity)
+    assert np.array_equal(res.weights, ref.weights)
+    assert np.array_equal(res.pos_qty, ref.pos_qty)
+    assert np.array_equal(res.asset_pnl, ref.asset_pnl)
+    assert res.fills == ref.fills
+    assert (res.funding_usd, res.halted_at) == (ref.funding_usd, ref.halted_at)
+    if "dd_hard" in kw:
+        assert res.halted_at is not None
+
+
+def test_unknown_engine_mode_is_rejected(tmp_path):
+    db, _, _ = trending_market(tmp_path)
+    with pytest.raises(ValueError):
+        run_backtest(make_cfg(db, ["A"], engine_mode="fast"))
+
+
+def test_snapshot_resume_reproduces_the_tail(tmp_path):
+    """途中のスナップショット（.npz 往復込み）から再開した結果が、
+    通しで回した結果の後半とビット単位で一致すること。"""
+    from cta.engine import EngineSnapshot
+
+    rng = np.random.default_rng(9)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        closes = 100.0 * np.exp(np.cumsum(rng.normal(0.002 * (1 - k), 0.01, 700)))
+        prices[sym] = (np.r_[100.0, closes[:-1]] * 1.002, closes)
+    db = make_db(tmp_path, prices)
+    cfg = make_cfg(db, list("AB"))
+    full = run_backtest(cfg, cost_mult=2.0)
+    cut = full.times[len(full.times) // 2]
+    snap_run = run_backtest(cfg, cost_mult=2.0, snapshot_at=[cut])
+    assert np.array_equal(snap_run.equity, full.equity)   # 取るだけでは変わらない
+    (snap,) = snap_run.snapshots
+    snap.save(str(tmp_path / "snap.npz"))
+    snap = EngineSnapshot.load(str(tmp_path / "snap.npz"))
+
+    res = run_backtest(cfg, cost_mult=2.0, resume=snap)
+    k = int(np.searchsorted(full.times, cut))
+    assert res.times[0] == cut
+    assert np.array_equal(res.equity, full.equity[k:])
+    assert np.array_equal(res.asset_pnl, full.asset_pnl[k:])
+    assert np.array_equal(res.pos_qty, full.pos_qty[k:])
+    assert res.fills == [f for f in full.fills if f.ts >= cut]
+    assert snap.n_fills + len(res.fills) == len(full.fills)
+    assert (res.fees_usd, res.funding_usd, res.turnover_usd) == \
+        (full.fees_usd, full.funding_usd, full.turnover_usd)
+
+
+def test_resume_with_carried_precompute_state(tmp_path):
+    """再開点までのシグナル・vol・共分散の状態を持ち越し、再開バーの直前から
+    切り出した market と新しいバー分だけの unit_path で再開しても、通しの
+    結果の後半とビット単位で一致すること（全履歴の前計算をしない経路）。"""
+    from cta.engine import unit_path_chunk
+    from cta.market import MarketData
+
+    rng = np.random.default_rng(9)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        closes = 100.0 * np.exp(np.cumsum(rng.normal(0.002 * (1 - k), 0.01, 700)))
+        closes[300 + 7 * k] = np.nan                    # 欠損バーも再開点付近に
+        prices[sym] = (np.r_[100.0, closes[:-1]] * 1.002, closes)
+    cfg = make_cfg(make_db(tmp_path, prices), list("AB"))
+    market = MarketData.load(cfg)
+    full = run_backtest(cfg, market=market)
+    for g0 in (301, 302, 450):
+        head = market.rows(0, g0)
+        state = {}
+        unit_path_chunk(cfg, head.closes, 0, state)
+        (snap,) = run_backtest(cfg, market=head, snapshot_at=[np.inf]).snapshots
+        lo = g0 - 1
+        res = run_backtest(cfg, market=market.rows(lo), resume=snap,
+                           unit_path=unit_path_chunk(cfg, market.closes[lo:], g0,
+                                                     state))
+        k = int(np.searchsorted(full.times, market.times[g0]))
+        assert np.array_equal(res.equity, full.equity[k:])
+        assert np.array_equal(res.weights, full.weights[k:])
+        assert res.fills == [f for f in full.fills if f.ts >= market.times[g0]]
+
+
+def test_batch_branches_from_a_common_snapshot(tmp_path):
+    from cta.engine import run_backtest_batch
+
+    db, _, _ = trending_market(tmp_path)
+    cfg = make_cfg(db, ["A"])
+    full = run_backtest(cfg)
+    cut = full.times[300]
+    snap = run_backtest(cfg, snapshot_at=[cut]).snapshots[0]
+    base, hot = run_backtest_batch(cfg, [{}, {"target_vol": 0.6}], resume=snap)
+    assert np.array_equal(base.equity, full.equity[300:])
+    assert hot.times[0] == cut and hot.equity[0] == base.equity[0]
+    assert hot.equity[-1] != base.equity[-1]
+    with pytest.raises(ValueError):                       # 別ユニバースの状態
+        run_backtest(cfg, resume=dataclasses.replace(snap, symbols=["X"]))
+    with pytest.raises(ValueError):                       # データに無いバー
+        run_backtest(cfg, resume=dataclasses.replace(snap, time=cut + 1.0))
+
+
+@pytest.mark.parametrize("engine_mode", ["bar", "event"])
+def test_batch_windows_match_individual_runs(tmp_path, engine_mode):
+    """windows で期間ごとに回したシナリオが、同じ期間の run_backtest と
+    ビット単位で一致すること（ブレーカーで止まる窓・端が開いた窓を含む）。"""
+    from cta.engine import run_backtest_batch
+
+    rng = np.random.default_rng(3)
+    steps = rng.normal(0.003, 0.006, 700)
+    steps[450] = -0.15
+    closes = 100.0 * np.exp(np.cumsum(steps))
+    db = make_db(tmp_path, {"A": (np.r_[100.0, closes[:-1]], closes)})
+    cfg = make_cfg(db, ["A"], target_vol=1.5, dd_soft=0.1, dd_hard=0.2,
+                   engine_mode=engine_mode)
+    windows = [(None, T0 + 300 * STEP), (T0 + 100 * STEP, T0 + 500 * STEP),
+               (T0 + 300 * STEP, T0 + 600 * STEP), (T0 + 460 * STEP, None)]
+    batch = run_backtest_batch(cfg, [{}] * len(windows), windows=windows)
+    for (a, b), res in zip(windows, batch):
+        ref = run_backtest(cfg, start_epoch=a, end_epoch=b)
+        assert np.array_equal(res.times, ref.times)
+        assert np.array_equal(res.equity, ref.equity)
+        assert np.array_equal(res.pos_qty, ref.pos_qty)
+        assert res.fills == ref.fills
+        assert (res.fees_usd, res.funding_usd, res.turnover_usd, res.halted_at) == \
+            (ref.fees_usd, ref.funding_usd, ref.turnover_usd, ref.halted_at)
+    assert batch[1].halted_at is not None and batch[3].halted_at is None
+    with pytest.raises(ValueError):
+        run_backtest_batch(cfg, [{}], windows=windows)
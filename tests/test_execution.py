@@ -1,4 +1,8 @@
 """執行モデルの回帰テスト。fill式・手数料・funding符号・最小ロットの仕様を固定する。"""
+import json
+import math
+
+import numpy as np
 import pytest
 
 from cta import execution as ex
@@ -122,3 +126,74 @@ def test_lot_size_does_not_affect_fractional_markets():
                            price=100.0, equity_usd=100000.0, cost_model=CM,
                            no_trade_band_pct=0.0, integer_shares=False, lot_size=10)
     assert od.qty == pytest.approx(27.0)
+
+
+def _plan_reference(cur, tgt, px, eq, band, integer_shares, lot):
+    """一括化前の plan_rebalance の式（銘柄ごとのスカラー版）。"""
+    if not px > 0:
+        return None
+    target_qty = tgt / px
+    if integer_shares:
+        target_qty = float(math.trunc(target_qty / lot) * lot)
+    delta = target_qty - cur
+    dn = abs(delta) * px
+    if not (tgt == 0.0 and cur != 0.0):
+        if dn < max(CM.min_notional_usd, band * eq):
+            return None
+    elif dn == 0.0:
+        return None
+    return delta
+
+
+@pytest.mark.parametrize("integer_shares", [False, True])
+def test_plan_rebalance_batch_matches_per_symbol_rules(integer_shares):
+    """バンド・最小ノーショナル・完全クローズ例外・売買単位の切り捨てが
+    銘柄ごとのスカラー版と完全に一致すること。"""
+    rng = np.random.default_rng(3)
+    N = 400
+    cur = np.where(rng.random(N) < 0.3, 0.0, rng.normal(0, 5, N))
+    tgt = np.where(rng.random(N) < 0.2, 0.0, rng.normal(0, 800, N))
+    px = rng.uniform(1, 300, N)
+    px[rng.random(N) < 0.05] = np.nan
+    px[:3] = [0.0, -1.0, np.nan]
+    lots = rng.choice([1, 10, 100], N)
+    delta, mask = ex.plan_rebalance_batch(cur, tgt, px, 5000.0, CM, 0.01,
+                                          integer_shares, lots)
+    for j in range(N):
+        ref = _plan_reference(cur[j], tgt[j], px[j], 5000.0, 0.01,
+                              integer_shares, lots[j])
+        assert mask[j] == (ref is not None)
+        assert delta[j] == (ref if ref is not None else 0.0)
+
+
+def test_orders_from_batch_builds_orders_only_for_mask():
+    delta, mask = ex.plan_rebalance_batch([0.0, 0.03, 0.0], [50.0, 0.0, 1.0],
+                                          [100.0, 100.0, 100.0], 1000.0, CM, 0.01)
+    orders = ex.orders_from_batch(["A", "B", "C"], delta, mask,
+                                  [100.0, 100.0, 100.0])
+    assert [(o.symbol, o.qty, o.reason) for o in orders] == [
+        ("A", pytest.approx(0.5), "rebalance"), ("B", pytest.approx(-0.03), "rebalance")]
+    assert all(type(o.qty) is float for o in orders)
+
+
+def test_portfolio_is_view_over_array_book():
+    """Portfolio は ArrayPortfolio のビュー。辞書としての振る舞いは従来どおり。"""
+    pf = ex.Portfolio(cash_usd=1000.0, positions={"SPY": 3.0})
+    pf.apply_fill(ex.execute_order(ex.Order("ITOT", 2.0, 100.0), 100.0, CM))
+    assert pf.book.symbols == ["SPY", "ITOT"]          # 未知の銘柄は末尾に追加
+    assert pf.book.qty.tolist() == [3.0, 2.0]
+    assert pf.positions == {"SPY": 3.0, "ITOT": 2.0}
+    assert pf.cash_usd == pf.book.cash_usd < 1000.0 - 200.0
+    pf.positions["SPY"] = 0.0
+    assert pf.book.qty[0] == 0.0 and pf.positions.get("QQQ", 0.0) == 0.0
+    del pf.positions["SPY"]
+    assert list(pf.positions) == ["ITOT"] and pf.book.index == {"ITOT": 0}
+    assert json.loads(json.dumps(dict(pf.positions))) == {"ITOT": 2.0}
+
+
+def test_sequential_sum_matches_python_loop_rounding():
+    vals = np.random.default_rng(0).normal(0, 1e6, 300)
+    total = 0.1
+    for v in vals:
+        total += v
+    assert ex.sequential_sum(0.1, vals) == total
@@ -0,0 +1,58 @@
+"""FillLog（列指向の約定ログ）のテスト。list[Fill] と同じ中身・同じ集計値になること。"""
+import numpy as np
+
+from cta.execution import Fill
+from cta.fill_log import FillLog
+
+
+def _fills(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in range(n):
+        ref = float(rng.uniform(50, 150))
+        qty = float(rng.normal(0, 2)) or 1.0
+        out.append(Fill(symbol=("A", "B", "C")[i % 3], qty=qty,
+                        signal_price=ref * float(rng.uniform(0.99, 1.01)),
+                        ref_price=ref, fill_price=ref * (1.002 if qty > 0 else 0.998),
+                        fee_usd=abs(qty) * ref * 0.001,
+                        reason="circuit_breaker" if i % 50 == 49 else "rebalance",
+                        ts=1.6e9 + 14400.0 * (i // 2)))
+    return out
+
+
+def test_log_round_trips_fills_and_slices_by_time():
+    fills = _fills()
+    log = FillLog.from_fills(["A", "B", "C"], fills)
+    assert len(log) == len(fills) and log == fills and log.to_list() == fills
+    assert log[7] == fills[7] and log[-1] == fills[-1]
+    assert log[10:20] == fills[10:20]
+    t0, t1 = fills[40].ts, fills[133].ts
+    sub = log.between(t0, t1)
+    assert sub == [f for f in fills if t0 <= f.ts < t1]
+    assert np.shares_memory(sub.qty, log.qty)          # 切り出しはビュー
+    restored = FillLog.from_arrays(log.symbols, log.reasons,
+                                   **{c: getattr(log, c) for c in
+                                      ("ts", "sym", "qty", "signal_price",
+                                       "ref_price", "fill_price", "fee_usd",
+                                       "reason")})
+    assert restored == log
+
+
+def test_vectorized_totals_match_summing_fill_objects():
+    fills = _fills()
+    log = FillLog.from_fills(["A", "B", "C"], fills)
+    assert log.total(np.abs(log.slippage_usd)) == sum(abs(f.slippage_usd)
+                                                      for f in fills)
+    assert log.total(log.signal_deviation_usd) == sum(f.signal_deviation_usd
+                                                      for f in fills)
+    empty = FillLog(["A"])
+    assert empty.total(empty.slippage_usd) == 0 and empty == []
+
+
+def test_concatenation_remaps_reason_codes():
+    fills = _fills(120)
+    head = FillLog.from_fills(["A", "B", "C"], fills[:49])   # rebalance のみ
+    tail = FillLog.from_fills(["A", "B", "C"], fills[49:])   # circuit_breaker から
+    assert head.reasons == ["rebalance"]
+    assert tail.reasons == ["circuit_breaker", "rebalance"]
+    assert head + tail == fills
@@ -0,0 +1,108 @@
+"""JITカーネル（numba）と参照実装の一致テスト。
+
+numba の無い環境（素のRPi等）ではフォールバックのテストだけが走る。"""
+import sys
+
+import numpy as np
+import pytest
+
+import cta
+from cta import cache as cache_mod
+from cta import kernels
+from cta import strategy as st
+from cta.engine import run_backtest
+from tests.test_engine import make_cfg, trending_market
+
+
+@pytest.fixture(autouse=True)
+def _restore_backend():
+    prev = kernels.backend()
+    yield
+    kernels.set_backend(prev)
+
+
+def _panel(T=800, N=4, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(0, 0.02, (T, N))
+    x[:120, 1] = np.nan
+    x[300:310, 2] = np.nan
+    x[::17, 3] = np.nan
+    return x
+
+
+def _both(fn):
+    kernels.set_backend("numpy")
+    ref = fn()
+    kernels.set_backend("numba")
+    return ref, fn()
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        kernels.set_backend("cuda")
+
+
+def test_missing_numba_falls_back_silently(monkeypatch):
+    # sys.modules に None を置くと import は ImportError になる（未導入と同じ）
+    monkeypatch.setitem(sys.modules, "numba", None)
+    monkeypatch.setitem(sys.modules, "cta._numba_kernels", None)
+    monkeypatch.delattr(cta, "_numba_kernels", raising=False)
+    monkeypatch.setattr(kernels, "_jit", None)
+    assert kernels.set_backend("numba") == "numpy"
+    assert kernels.set_backend("auto") == "numpy"
+    assert kernels.jit() is None
+    assert st.ewma(np.arange(5.0), 3).shape == (5,)
+
+
+def test_config_backend_applies_only_during_the_run(tmp_path, monkeypatch):
+    """config の [engine] backend はその実行の間だけ効き、後の呼び出し
+    （直接の strategy 呼び出し・キャッシュのタグ）に残らない。"""
+    kernels.set_backend("numpy")
+    seen = []
+    ewma = st.ewma
+
+    def spy(*args, **kw):
+        seen.append(kernels.backend())
+        return ewma(*args, **kw)
+
+    monkeypatch.setattr(st, "ewma", spy)
+    db, _, _ = trending_market(tmp_path)
+    run_backtest(make_cfg(db, ["A"], kernel_backend="numba"),
+                 cache=cache_mod.ArrayCache())
+    assert seen and set(seen) == {kernels.resolve("numba")}   # 実行中は numba
+    assert kernels.backend() == "numpy"                        # 抜けたら元どおり
+    with pytest.raises(ValueError):
+        with kernels.use_backend("cuda"):
+            pass
+    assert kernels.backend() == "numpy"
+
+
+def test_ewma_and_trailing_vol_match_reference():
+    pytest.importorskip("numba")
+    p = _panel()
+    x = np.cumsum(np.nan_to_num(p), axis=0)
+    x[np.isnan(p)] = np.nan
+    ref, fast = _both(lambda: st.ewma(x, np.array([5.0, 20.0, 60.0, 7.0])))
+    assert np.array_equal(ref, fast, equal_nan=True)
+    for w in (2, 30, 90):
+        ref, fast = _both(lambda: st.trailing_vol(_panel(), w, 2190))
+        np.testing.assert_allclose(fast, ref, rtol=1e-12, atol=1e-15)
+
+
+@pytest.mark.parametrize("kw", [{}, dict(cost_mult=3.0, long_only=True),
+                                dict(target_vol=3.0, max_gross=8.0,
+                                     dd_soft=0.05, dd_hard=0.08)])
+def test_backtest_identical_under_jit(tmp_path, kw):
+    pytest.importorskip("numba")
+    db, _, _ = trending_market(tmp_path, noise=0.03)
+    cost_mult = kw.pop("cost_mult", 1.0)
+    cfg = make_cfg(db, ["A"], **kw)
+    # sig/vol もそれぞれのバックエンドで作り直させる（キャッシュを共有しない）
+    ref, fast = _both(lambda: run_backtest(cfg, cost_mult=cost_mult,
+                                           cache=cache_mod.ArrayCache()))
+    for k in ("equity", "weights", "pos_qty", "asset_pnl"):
+        np.testing.assert_allclose(getattr(fast, k), getattr(ref, k),
+                                   rtol=1e-12, atol=1e-9)
+    assert fast.funding_usd == pytest.approx(ref.funding_usd, rel=1e-12)
+    assert fast.halted_at == ref.halted_at
+    assert len(fast.fills) == len(ref.fills)
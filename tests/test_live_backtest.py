@@ -0,0 +1,117 @@
+"""追記型ライブバックテストのテスト。継ぎ足した結果が通しの run_backtest と
+ビット単位で一致し、過去データや設定が変われば作り直すこと。"""
+import dataclasses
+
+import numpy as np
+
+from cta import kernels
+from cta import live_backtest
+from cta import strategy as st
+from cta.engine import run_backtest
+from tests.test_engine import make_cfg, make_db
+
+
+def _prices(n, seed=3):
+    rng = np.random.default_rng(seed)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        closes = 100.0 * np.exp(np.cumsum(rng.normal(0.002 * (1 - k), 0.01, 800)))
+        closes[[499 - k, 502]] = np.nan   # 継ぎ目付近の欠損バー（直近有効終値の持ち越し）
+        prices[sym] = (np.r_[100.0, closes[:-1]] * 1.002, closes)
+    return {s: (o[:n], c[:n]) for s, (o, c) in prices.items()}
+
+
+def _db(tmp_path, name, prices):
+    d = tmp_path / name
+    d.mkdir()
+    return make_db(d, prices)
+
+
+def _assert_same(res, ref):
+    assert np.array_equal(res.times, ref.times)
+    assert np.array_equal(res.equity, ref.equity)
+    assert np.array_equal(res.weights, ref.weights)
+    assert np.array_equal(res.pos_qty, ref.pos_qty)
+    assert np.array_equal(res.asset_pnl, ref.asset_pnl)
+    assert res.fills == ref.fills
+    assert (res.fees_usd, res.funding_usd, res.slippage_usd, res.turnover_usd,
+            res.halted_at) == (ref.fees_usd, ref.funding_usd, ref.slippage_usd,
+                               ref.turnover_usd, ref.halted_at)
+
+
+def test_appended_bars_match_full_run(tmp_path):
+    path = str(tmp_path / "live.npz")
+    cfg = make_cfg(_db(tmp_path, "d0", _prices(500)), list("AB"))
+    res, status = live_backtest.update(cfg, path)
+    assert status == "created"
+    _assert_same(res, run_backtest(cfg))
+
+    for i, n in enumerate((503, 650, 800)):   # 数本ずつ・まとめて追記
+        cfg = make_cfg(_db(tmp_path, f"d{i + 1}", _prices(n)), list("AB"))
+        res, status = live_backtest.update(cfg, path)
+        assert status == "extended"
+        _assert_same(res, run_backtest(cfg))
+    res, status = live_backtest.update(cfg, path)
+    assert status == "unchanged"
+    _assert_same(res, run_backtest(cfg))
+
+
+def test_extension_precomputes_only_the_new_bars(tmp_path, monkeypatch):
+    """継ぎ足しではシグナル・vol・共分散を全履歴から作り直さず、保存した
+    前計算の状態の続きから新しいバーの分だけ作る。"""
+    path = str(tmp_path / "live.npz")
+    live_backtest.update(make_cfg(_db(tmp_path, "d0", _prices(500)), list("AB")),
+                         path)
+    rows, panel = [], st.trend_signal_panel
+
+    def counted(logc, horizons_bars, state=None):
+        rows.append(len(logc))
+        return panel(logc, horizons_bars, state=state)
+
+    monkeypatch.setattr(st, "trend_signal_panel", counted)
+    cfg = make_cfg(_db(tmp_path, "d1", _prices(520)), list("AB"))
+    res, status = live_backtest.update(cfg, path)
+    assert (status, rows) == ("extended", [20])
+    monkeypatch.undo()
+    _assert_same(res, run_backtest(cfg))
+
+
+def test_artifact_without_precompute_state_rebuilds(tmp_path):
+    path = str(tmp_path / "live.npz")
+    cfg = make_cfg(_db(tmp_path, "d0", _prices(500)), list("AB"))
+    live_backtest.update(cfg, path)
+    live = live_backtest.LiveBacktest.load(path)
+    dataclasses.replace(live, state=None).save(path)      # 旧形式の成果物
+    cfg = make_cfg(_db(tmp_path, "d1", _prices(520)), list("AB"))
+    res, status = live_backtest.update(cfg, path)
+    assert status == "rebuilt"
+    _assert_same(res, run_backtest(cfg))
+    assert live_backtest.LiveBacktest.load(path).state is not None
+
+
+def test_changed_history_or_config_rebuilds(tmp_path):
+    path = str(tmp_path / "live.npz")
+    live_backtest.update(make_cfg(_db(tmp_path, "d0", _prices(500)), list("AB")),
+                         path)
+    prices = _prices(600)
+    prices["A"][1][100] *= 1.01            # 処理済み区間の過去足が修正された
+    cfg = make_cfg(_db(tmp_path, "d1", prices), list("AB"))
+    res, status = live_backtest.update(cfg, path)
+    assert status == "rebuilt"
+    _assert_same(res, run_backtest(cfg))
+
+    cfg = dataclasses.replace(cfg, target_vol=0.2)
+    res, status = live_backtest.update(cfg, path)
+    assert status == "rebuilt"
+    _assert_same(res, run_backtest(cfg))
+    # ループ方式は結果に影響しないので作り直さない
+    _, status = live_backtest.update(dataclasses.replace(cfg, engine_mode="event"),
+                                     path)
+    assert status == "unchanged"
+    # カーネルのバックエンドは丸めまで一致する保証が無いので、実際に使われる
+    # バックエンドが変われば作り直す（numba が無い環境では numpy のまま）
+    live_backtest.update(dataclasses.replace(cfg, kernel_backend="numpy"), path)
+    _, status = live_backtest.update(dataclasses.replace(cfg, kernel_backend="numba"),
+                                     path)
+    assert status == ("rebuilt" if kernels.resolve("numba") == "numba"
+                      else "unchanged")
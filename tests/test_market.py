@@ -0,0 +1,69 @@
+"""MarketData（読み込み済みデータの束）のテスト。束を渡しても結果は1bitも変わらないこと。"""
+import numpy as np
+import pytest
+
+from cta import data as data_mod
+from cta import validate
+from cta.engine import run_backtest
+from cta.market import MarketData
+from tests.test_engine import make_cfg, make_db
+
+
+def _two_assets(tmp_path):
+    rng = np.random.default_rng(5)
+    prices = {}
+    for k, sym in enumerate("AB"):
+        closes = 100.0 * np.exp(np.cumsum(rng.normal(0.002 * (1 - k), 0.01, 500)))
+        prices[sym] = (np.r_[100.0, closes[:-1]], closes)
+    prices["B"] = tuple(p[120:] for p in prices["B"])   # 後発上場
+    return make_db(tmp_path, prices)
+
+
+def test_backtest_with_market_bundle_is_identical(tmp_path):
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    ref = run_backtest(cfg, cost_mult=2.0)
+    res = run_backtest(cfg, cost_mult=2.0, market=MarketData.load(cfg))
+    assert np.array_equal(res.equity, ref.equity)
+    assert np.array_equal(res.asset_pnl, ref.asset_pnl)
+    assert res.fills == ref.fills
+
+
+def test_gates_do_not_reload_when_market_is_given(tmp_path, monkeypatch):
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    market = MarketData.load(cfg)
+    ref = validate.cost_stress(cfg, mults=(1.0, 3.0))
+
+    def _no_reload(*a, **kw):
+        raise AssertionError("DBを読み直した")
+
+    monkeypatch.setattr(data_mod, "load_universe", _no_reload)
+    monkeypatch.setattr(data_mod, "load_funding", _no_reload)
+    assert validate.cost_stress(cfg, mults=(1.0, 3.0), market=market) == ref
+    validate.walk_forward(cfg, years=(2020,), market=market)
+
+
+def test_derived_arrays_are_lazy_memoized_and_read_only(tmp_path):
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    market = MarketData.load(cfg)
+    assert "closes_ff" not in vars(market)            # 触るまで作らない
+    _, _, closes_df = data_mod.load_universe(cfg.db_path, cfg.symbols, cfg.timeframe_min)
+    assert np.array_equal(market.closes_ff, closes_df.ffill().to_numpy(),
+                          equal_nan=True)
+    assert market.rets is market.rets
+    for arr in (market.closes, market.funding, market.closes_ff, market.rets):
+        with pytest.raises(ValueError):
+            arr[0, 0] = 1.0
+
+
+def test_market_must_match_config(tmp_path):
+    db = _two_assets(tmp_path)
+    market = MarketData.load(make_cfg(db, ["A", "B"]))
+    with pytest.raises(ValueError):
+        run_backtest(make_cfg(db, ["A"]), market=market)
+    with pytest.raises(ValueError):
+        run_backtest(make_cfg(db, ["A", "B"], storage_dtype="float32"), market=market)
+    # 同じユニバースでも、別のDB・funding設定から読んだ束は使わない
+    for kw in ({"db_path": db + ".old"}, {"funding_pkl": "/other.pkl"},
+               {"funding_default_annual": {"A": 0.1, "B": 0.05}}):
+        with pytest.raises(ValueError):
+            run_backtest(make_cfg(db, ["A", "B"], **kw), market=market)
@@ -0,0 +1,53 @@
+"""評価指標のテスト。DD継続期間と四半期別PnLが、バーごとに数えた値と一致すること。"""
+import datetime as dt
+
+import numpy as np
+
+from cta.metrics import RunningEquityStats, equity_stats
+
+
+def test_dd_duration_and_quarterly_pnl_match_bar_by_bar_count():
+    rng = np.random.default_rng(2)
+    times = dt.datetime(2023, 12, 20, tzinfo=dt.timezone.utc).timestamp() \
+        + np.arange(400) * 86400.0
+    eq = 1000.0 * np.exp(np.cumsum(rng.normal(0, 0.02, 400)))
+    eq[300:] = eq[:300].max() * 0.5          # 最後まで水面下
+    es = equity_stats(times, eq)
+
+    longest = cur = 0
+    qpnl = {}
+    for i, d in enumerate(1 - eq / np.maximum.accumulate(eq)):
+        cur = cur + 1 if d > 1e-9 else 0
+        longest = max(longest, cur)
+        if i:
+            t = dt.datetime.fromtimestamp(times[i], dt.timezone.utc)
+            q = f"{t.year}Q{(t.month - 1) // 3 + 1}"
+            qpnl[q] = qpnl.get(q, 0.0) + (eq[i] - eq[i - 1])
+    assert es["dd_bars"] == longest >= 100
+    assert list(es["quarterly_pnl"]) == ["2023Q4", "2024Q1", "2024Q2", "2024Q3",
+                                         "2024Q4", "2025Q1"]
+    assert es["quarterly_pnl"] == qpnl       # 丸めまで一致
+
+
+def test_running_equity_stats_match_series_stats_for_any_blocking():
+    """逐次集計（record="summary"）の統計が、系列から求めた equity_stats と
+    ビット単位で一致し、行ごと・ブロックごとのどちらで渡しても同じ値になること。"""
+    rng = np.random.default_rng(5)
+    T, S = 1500, 3
+    times = dt.datetime(2023, 11, 1, tzinfo=dt.timezone.utc).timestamp() \
+        + np.arange(T) * 14400.0
+    eq = 1000.0 * np.exp(np.cumsum(rng.normal(0, 0.02, (T, S)), axis=0))
+    eq[:200, 1] = np.nan                     # 開始前
+    eq[1100:, 2] = np.nan                    # 窓の終了後
+    by_bar, by_block = RunningEquityStats(S), RunningEquityStats(S)
+    for i in range(T):
+        by_bar.add(times[i], eq[i], np.ones(S))
+    for a in range(0, T, 377):
+        by_block.add_block(times[a:a + 377], eq[a:a + 377], np.ones((377, S))[:T - a])
+    for k in range(S):
+        m = ~np.isnan(eq[:, k])
+        ref = equity_stats(times[m], eq[m, k])
+        got = by_bar.result(k)
+        assert got == by_block.result(k)
+        assert by_bar.gross(k) == by_block.gross(k) == (1.0, 1.0)
+        assert got == ref
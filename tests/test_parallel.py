@@ -0,0 +1,34 @@
+"""検証ゲートの並列実行のテスト。ワーカー数によらず結果（値と順序）が同じで、
+ワーカーはDBを読まずに共有メモリのパネルを使うこと。"""
+import os
+
+from cta import validate
+from cta.market import MarketData
+from cta.parallel import CellPool
+from tests.test_engine import make_cfg
+from tests.test_market import _two_assets
+
+
+def _gates(cfg, market, workers):
+    return {"wf": validate.walk_forward(cfg, years=(2019, 2020, 2021), market=market,
+                                        workers=workers),
+            "cs": validate.cost_stress(cfg, mults=(1.0, 3.0, 5.0), market=market,
+                                       workers=workers),
+            "sens": validate.sensitivity(cfg, target_vols=(0.1, 0.3),
+                                         horizon_scales=(0.5, 1.0),
+                                         vol_windows=(3, 5), market=market,
+                                         workers=workers)}
+
+
+def test_parallel_gates_match_serial(tmp_path):
+    db = _two_assets(tmp_path)
+    cfg = make_cfg(db, ["A", "B"])
+    market = MarketData.load(cfg)
+    ref = _gates(cfg, market, None)
+    assert ref["wf"] and ref["cs"]["5x"]
+    os.remove(db)                      # ワーカーは共有メモリのパネルだけで回る
+    with CellPool(market, 2) as pool:
+        out = _gates(cfg, market, pool)
+    assert out == ref
+    for grid in ("vol_x_horizon", "vol_x_volwindow"):     # 順序も同じ
+        assert list(out["sens"][grid]) == list(ref["sens"][grid])
@@ -0,0 +1,85 @@
+"""結果キャッシュのテスト。2回目は回さずに同じ結果を返し、キーは設定・終了バーまでの
+データ・上書き引数で変わり、合計サイズで古いものから消えること。"""
+import dataclasses
+import os
+
+import pytest
+
+from cta import kernels, result_cache, validate
+from cta.engine import run_backtest
+from cta.market import MarketData
+from cta.metrics import compute_metrics
+from tests.test_engine import make_cfg
+from tests.test_market import _two_assets
+
+pytestmark = pytest.mark.skipif(result_cache.code_version() is None,
+                                reason="git が使えない")
+
+
+@pytest.fixture
+def rc(tmp_path, monkeypatch):
+    c = result_cache.ResultCache(str(tmp_path / "results"))
+    monkeypatch.setattr(result_cache, "_default", c)
+    return c
+
+
+def _count_runs(monkeypatch):
+    calls = []
+    fn = validate.run_backtest_batch
+    monkeypatch.setattr(validate, "run_backtest_batch",
+                        lambda *a, **kw: calls.append(1) or fn(*a, **kw))
+    return calls
+
+
+def test_gates_reuse_cached_results(tmp_path, rc, monkeypatch):
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    market = MarketData.load(cfg)
+
+    def gates(years=(2019, 2020)):
+        return (validate.full_period(cfg, market=market),
+                validate.walk_forward(cfg, years=years, market=market),
+                validate.cost_stress(cfg, mults=(1.0, 3.0), market=market))
+
+    ref = gates()
+    assert ref[0] == compute_metrics(run_backtest(cfg, market=market),
+                                     cfg.bars_per_year)
+    calls = _count_runs(monkeypatch)
+    assert gates() == ref and calls == []
+    validate.walk_forward(cfg, years=(2019, 2020, 2021), market=market)
+    assert len(calls) == 1                   # 足した年だけ回す
+    # 上書き引数が違えば別のキー
+    validate.cost_stress(cfg, mults=(2.0,), market=market)
+    assert len(calls) == 2
+
+
+def test_key_depends_on_data_only_up_to_end_bar(tmp_path, rc):
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    m = MarketData.load(cfg)
+    head = MarketData(m.symbols, m.times[:400], m.opens[:400], m.closes[:400],
+                      m.funding[:400], m.conservative, m.timeframe_min)
+    end = m.times[300]
+    assert rc.key(cfg, m, end_epoch=end) == rc.key(cfg, head, end_epoch=end)
+    assert rc.key(cfg, m) != rc.key(cfg, head)
+    assert rc.key(cfg, m, {"cost_mult": 1.0}) == rc.key(cfg, m)
+    assert rc.key(cfg, m, {"target_vol": 0.2}) != rc.key(cfg, m)
+
+
+def test_key_depends_on_kernel_backend(tmp_path, rc, monkeypatch):
+    """numba と numpy は丸めまで一致する保証が無いので、片方で計算した結果を
+    もう片方の実行に返さない（config が空なら既定のバックエンドで決まる）。"""
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    m = MarketData.load(cfg)
+    monkeypatch.setattr(kernels, "resolve", lambda name=None: name or "numpy")
+    assert rc.key(cfg, m) == rc.key(dataclasses.replace(cfg, kernel_backend="numpy"), m)
+    assert rc.key(cfg, m) != rc.key(dataclasses.replace(cfg, kernel_backend="numba"), m)
+
+
+def test_entries_are_evicted_oldest_first(tmp_path):
+    c = result_cache.ResultCache(str(tmp_path / "results"), max_bytes=3000)
+    metrics = {"valid": True, "quarterly_pnl": {f"q{i}": float(i) for i in range(10)}}
+    for i, k in enumerate("abc"):
+        c.put(k, metrics)
+        os.utime(c._path(k), (i, i))
+    c.put("d", metrics)
+    assert c.get("a") is None
+    assert all(c.get(k) == metrics for k in "bcd")
@@ -0,0 +1,148 @@
+"""シグナル逐次更新状態の回帰テスト。
+
+全履歴から計算し直した値（strategy.trend_signal_panel / trailing_vol）と
+逐次更新の値が一致すること、データが変わったら作り直すことを固定する。"""
+import json
+
+import numpy as np
+import pytest
+
+from cta import signal_state as ss
+from cta import strategy as st
+from cta.paper import PaperTrader
+from tests.test_engine import make_cfg, make_db, trending_market, T0, STEP
+
+HB = [(5, 20), (10, 40)]
+W = 30
+BPY = 6 * 365
+
+
+def _panel(T=400, N=3, seed=0):
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0.001, 0.01, (T, N)), axis=0))
+    closes[:150, 2] = np.nan          # 後発上場
+    closes[200:203, 1] = np.nan       # 欠損バー
+    times = T0 + STEP * np.arange(1, T + 1, dtype=float)
+    return times, closes
+
+
+def _full(closes, t):
+    logc = np.log(closes[:t + 1])
+    rets = np.vstack([np.full((1, closes.shape[1]), np.nan), np.diff(logc, axis=0)])
+    return (st.trend_signal_panel(logc, HB)[-1], st.trailing_vol(rets, W, BPY)[-1],
+            rets[t - W:t])
+
+
+def test_incremental_updates_match_full_recompute():
+    times, closes = _panel()
+    state = ss.IncrementalSignalState.from_history(
+        ["A", "B", "C"], HB, W, BPY, times[:100], closes[:100])
+    for t in range(100, len(closes)):
+        state.update(times[t], closes[t])
+        sig, vol, win = _full(closes, t)
+        assert np.array_equal(state.signal(), sig, equal_nan=True)
+        np.testing.assert_allclose(state.vol(), vol, rtol=1e-9, atol=1e-9)
+        assert np.array_equal(state.rets_window(), win, equal_nan=True)
+
+
+def test_state_survives_json_round_trip():
+    times, closes = _panel()
+    a = ss.IncrementalSignalState.from_history(
+        ["A", "B", "C"], HB, W, BPY, times[:250], closes[:250])
+    b = ss.IncrementalSignalState.from_dict(json.loads(json.dumps(a.to_dict())))
+    for t in range(250, 300):
+        a.update(times[t], closes[t])
+        b.update(times[t], closes[t])
+    assert np.array_equal(a.signal(), b.signal(), equal_nan=True)
+    np.testing.assert_allclose(a.vol(), b.vol(), rtol=1e-12)
+
+
+def test_load_market_reads_only_new_bars_and_rebuilds_on_change(tmp_path):
+    db, _, closes = trending_market(tmp_path)
+    cfg = make_cfg(db, ["A"])
+    path = str(tmp_path / "sig.json")
+    from cta import data as dm
+    calls = []
+
+    def loader(since):
+        calls.append(since)
+        return dm.load_universe(cfg.db_path, cfg.symbols, cfg.timeframe_min, since)
+
+    now = T0 + (len(closes) - 10) * STEP + 60
+    *_, t0, s0 = ss.load_market(cfg, path, now, loader)
+    assert calls == [None]                       # 初回は全履歴
+    times, _, cdf, t, s1 = ss.load_market(cfg, path, now + 5 * STEP, loader)
+    assert calls[-1] == s0.last_time             # 2回目は前回バー以降のみ
+    assert times[0] == s0.last_time and t == 5
+    full = dm.load_universe(cfg.db_path, cfg.symbols, cfg.timeframe_min)[2]
+    ref = ss.IncrementalSignalState.for_config(cfg)
+    logc = np.log(full.to_numpy(float)[:t0 + 6])
+    sig = st.trend_signal_panel(logc, ref.horizons_bars)[-1]
+    assert np.array_equal(s1.signal(), sig, equal_nan=True)
+
+    # 保存済み最終バーの終値が変わった（キャッシュ修正）→ 全履歴から作り直す
+    state = json.load(open(path))
+    state["last_close"] = [123.0]
+    json.dump(state, open(path, "w"))
+    ss.load_market(cfg, path, now + 6 * STEP, loader)
+    assert calls[-2:] == [s1.last_time, None]
+
+
+def test_load_market_rebuilds_when_older_history_is_edited(tmp_path):
+    """最終処理バーより前の終値が直った（jp_repair・キャッシュ修正）ら、
+    履歴の指紋が変わるので全履歴から作り直し、全再計算と一致する。"""
+    import sqlite3
+    from cta import data as dm
+
+    db, _, closes = trending_market(tmp_path)
+    cfg = make_cfg(db, ["A"])
+    path = str(tmp_path / "sig.json")
+    calls = []
+
+    def loader(since):
+        calls.append(since)
+        return dm.load_universe(cfg.db_path, cfg.symbols, cfg.timeframe_min, since)
+
+    def history(until):
+        return dm.history_fingerprint(cfg.db_path, cfg.symbols, cfg.timeframe_min,
+                                      until)
+
+    now = T0 + (len(closes) - 10) * STEP + 60
+    ss.load_market(cfg, path, now, loader, history)
+    ss.load_market(cfg, path, now + STEP, loader, history)
+    assert calls[-1] is not None                 # 履歴が同じなら逐次更新
+    con = sqlite3.connect(db)
+    con.execute("UPDATE candles SET close_price = close_price * 1.5 "
+                "WHERE close_time = ?", (T0 + 300 * STEP,))
+    con.commit()
+    con.close()
+    *_, t, s = ss.load_market(cfg, path, now + 2 * STEP, loader, history)
+    assert calls[-1] is None                     # 途中の修正 → 作り直し
+    full = dm.load_universe(cfg.db_path, cfg.symbols, cfg.timeframe_min)[2]
+    logc = np.log(full.to_numpy(float)[:t + 1])
+    ref = ss.IncrementalSignalState.for_config(cfg)
+    assert np.array_equal(s.signal(),
+                          st.trend_signal_panel(logc, ref.horizons_bars)[-1],
+                          equal_nan=True)
+    ss.load_market(cfg, path, now + 3 * STEP, loader, history)
+    assert calls[-1] is not None                 # 作り直した後は再び逐次更新
+
+
+def test_paper_decisions_identical_with_and_without_saved_state(tmp_path):
+    db, _, closes = trending_market(tmp_path, drift=0.004, noise=0.005)
+    runs = {}
+    for name in ("incremental", "rebuild"):
+        base = tmp_path / name
+        base.mkdir()
+        trader = PaperTrader(make_cfg(db, ["A"]), base_dir=str(base))
+        out = []
+        for k in range(8, 0, -1):
+            if name == "rebuild":
+                (base / "state/paper_signal_state.json").unlink(missing_ok=True)
+            now = T0 + (len(closes) - k) * STEP + 60
+            r = trader.run_once(refresh=False, price_fn=lambda s: closes[-k - 1],
+                                now=now)
+            out.append(r["positions"]["A"] if "positions" in r else None)
+        runs[name] = out
+    assert any(runs["incremental"])              # 実際に建玉している
+    assert runs["incremental"] == pytest.approx(runs["rebuild"], rel=1e-12)
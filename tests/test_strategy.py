@@ -1,4 +1,6 @@
 """戦略ロジックの回帰テスト。シグナル成熟度・volターゲティング・ブレーカーの仕様を固定する。"""
+import io
+
 import numpy as np
 import pytest
 
@@ -69,3 +71,171 @@ def test_circuit_breaker_soft_and_hard():
     assert cb.update(590.0) == 0.0    # DD41%: 停止
     assert cb.halted
     assert cb.update(2000.0) == 0.0   # 回復してもhaltedは人手解除まで維持
+
+
+def _ewma_reference(x, span):
+    """旧実装（要素単位ループ）。パネル版カーネルの仕様固定用。"""
+    a = 2.0 / (span + 1.0)
+    out = np.full_like(x, np.nan, dtype=float)
+    prev = np.nan
+    for i in range(len(x)):
+        v = x[i]
+        if np.isnan(v):
+            out[i] = prev
+            continue
+        prev = v if np.isnan(prev) else a * v + (1 - a) * prev
+        out[i] = prev
+    return out
+
+
+def test_ewma_panel_matches_reference_bit_for_bit():
+    # 上場前NaN・途中欠損・全NaN列を含むパネルで、旧ループと完全一致すること
+    rng = np.random.default_rng(4)
+    x = np.cumsum(rng.normal(0, 0.01, (800, 4)), axis=0)
+    x[:300, 1] = np.nan
+    x[::17, 2] = np.nan
+    x[:, 3] = np.nan
+    for span in (3, 40, 500):
+        ref = np.column_stack([_ewma_reference(x[:, j], span) for j in range(4)])
+        assert np.array_equal(st.ewma(x, span), ref, equal_nan=True)
+        assert np.array_equal(st.ewma(x[:, 1], span), ref[:, 1], equal_nan=True)
+
+
+def test_trend_signal_panel_equals_per_symbol_reference():
+    # スパンを共有するホライズン（20が2回）でも、銘柄×ホライズン個別計算と一致
+    rng = np.random.default_rng(5)
+    x = np.cumsum(rng.normal(0.001, 0.01, (600, 3)), axis=0)
+    x[:200, 2] = np.nan
+    hb = [(5, 20), (20, 80)]
+
+    def reference(col):
+        n_valid = np.cumsum(~np.isnan(col))
+        sig, valid = np.zeros(len(col)), np.zeros(len(col))
+        for f, s in hb:
+            d = _ewma_reference(col, f) - _ewma_reference(col, s)
+            ok = (~np.isnan(d)) & (n_valid >= s)
+            sig[ok] += np.sign(d[ok])
+            valid[ok] += 1
+        return np.where(valid == len(hb), sig / len(hb), np.nan)
+
+    ref = np.column_stack([reference(x[:, j]) for j in range(3)])
+    assert np.array_equal(st.trend_signal_panel(x, hb), ref, equal_nan=True)
+    assert np.array_equal(st.trend_signal(x[:, 0], hb), ref[:, 0], equal_nan=True)
+
+
+def _trailing_vol_reference(rets, window, bars_per_year):
+    """旧実装（毎時点で窓をスライスして std）。累積和版の仕様固定用。"""
+    out = np.full(len(rets), np.nan)
+    for i in range(window, len(rets)):
+        w = rets[i - window:i]
+        w = w[~np.isnan(w)]
+        if len(w) >= window // 2:
+            out[i] = w.std() * np.sqrt(bars_per_year)
+    return out
+
+
+def test_trailing_vol_panel_matches_reference():
+    # 上場前NaN・間欠欠損（有効本数が半分を割る窓を含む）・大きなドリフト
+    rng = np.random.default_rng(6)
+    rets = rng.normal(0.0005, 0.01, (2000, 4))
+    rets[:700, 1] = np.nan
+    rets[1000:1060, 2] = np.nan
+    rets[::3, 3] = np.nan
+    rets[:, 0] += 0.3
+    for window in (2, 10, 90):
+        ref = np.column_stack([_trailing_vol_reference(rets[:, j], window, BPY)
+                               for j in range(4)])
+        got = st.trailing_vol(rets, window, BPY)
+        assert np.array_equal(np.isnan(got), np.isnan(ref))
+        np.testing.assert_allclose(got, ref, rtol=1e-9, atol=1e-9)
+
+
+def test_trailing_vol_is_unchanged_by_appended_bars():
+    """中心化は列ごとの最初の有効値（全期間平均ではない）なので、後からバーを
+    足しても既存の時点の値は1bitも変わらない（追記型・チャンク分割の前提）。"""
+    rng = np.random.default_rng(8)
+    rets = rng.normal(0.001, 0.02, (1500, 3))
+    rets[:400, 1] = np.nan
+    rets[-300:, 2] += 0.5                  # 後半だけ平均が大きく動く
+    full = st.trailing_vol(rets, 60, BPY)
+    for n in (500, 1200):
+        assert np.array_equal(st.trailing_vol(rets[:n], 60, BPY), full[:n],
+                              equal_nan=True)
+
+
+def test_rolling_covariance_matches_window_portfolio_vol():
+    # 上場前NaN・欠損バー・アクティブ資産の入れ替わりがあっても、
+    # 毎回窓から np.cov を作る portfolio_vol と一致すること
+    rng = np.random.default_rng(7)
+    T, N, W = 600, 4, 60
+    rets = rng.normal(0, [0.01, 0.02, 0.005, 0.015], (T, N))
+    rets[:250, 3] = np.nan
+    rets[::11, 1] = np.nan
+    rc = st.RollingCovariance(N, W)
+    for t in range(T):
+        if t >= W:
+            w = rng.normal(0, 1, N) * (rng.random(N) > 0.3)
+            ref = st.portfolio_vol(w, rets[t - W:t], BPY)
+            assert st.portfolio_vol(w, rc, BPY) == pytest.approx(ref, rel=1e-9, abs=1e-12)
+        rc.push(rets[t])
+    assert len(rc) == W
+
+
+def test_rolling_covariance_array_round_trip_is_bit_exact():
+    # to_arrays / from_arrays（.npz 往復込み）で戻した状態から続けて push しても、
+    # 通しで進めた状態と cov がビット単位で一致すること
+    rng = np.random.default_rng(11)
+    T, N, W = 300, 3, 40
+    rets = rng.normal(0, [0.01, 0.02, 0.005], (T, N))
+    rets[:90, 2] = np.nan
+    rets[::7, 0] = np.nan
+    ref = st.RollingCovariance(N, W)
+    for r in rets:
+        ref.push(r)
+    active = np.ones(N, dtype=bool)
+    for cut in (0, 95, 170):
+        rc = st.RollingCovariance(N, W)
+        for r in rets[:cut]:
+            rc.push(r)
+        buf = io.BytesIO()
+        np.savez(buf, **rc.to_arrays())
+        buf.seek(0)
+        with np.load(buf) as z:
+            rc = st.RollingCovariance.from_arrays(dict(z))
+        for r in rets[cut:]:
+            rc.push(r)
+        assert np.array_equal(rc.cov(active)[0], ref.cov(active)[0])
+        assert rc.portfolio_vol(np.ones(N), BPY) == ref.portfolio_vol(np.ones(N), BPY)
+
+
+def test_rolling_covariance_too_few_complete_rows_is_zero():
+    rets = np.full((30, 2), np.nan)
+    rets[:, 0] = 0.01 * np.arange(30)
+    rets[25:, 1] = 0.02                 # 2資産とも有効な行は5本だけ
+    rc = st.RollingCovariance(2, 30)
+    for r in rets:
+        rc.push(r)
+    w = np.array([0.5, 0.5])
+    assert st.portfolio_vol(w, rc, BPY) == st.portfolio_vol(w, rets, BPY) == 0.0
+
+
+def test_unit_weight_path_matches_target_weights():
+    # 前計算（正規化ウェイト+pvol）にスケールとキャップを掛けた結果が、
+    # バーごとに target_weights を呼んだ結果と一致すること（target_vol違いも含む）
+    rng = np.random.default_rng(8)
+    T, N, W = 400, 3, 50
+    rets = rng.normal(0, [0.01, 0.03, 0.002], (T, N))
+    rets[:120, 2] = np.nan
+    sig = np.sign(rng.normal(0, 1, (T, N)))
+    sig[:60, 1] = np.nan
+    vol = st.trailing_vol(rets, W, BPY)
+    bars = np.arange(W, T, 7)
+    for long_only in (False, True):
+        w_unit, pvol = st.unit_weight_path(sig, vol, rets, W, BPY, bars,
+                                           long_only=long_only)
+        for t in bars:
+            for tv in (0.05, 0.3, 5.0):
+                ref = st.target_weights(sig[t], vol[t], rets[t - W:t], tv, 3.0,
+                                        BPY, long_only=long_only)
+                got = st.scale_weights(w_unit[t], pvol[t], tv, 3.0)
+                np.testing.assert_allclose(got, ref, rtol=1e-9, atol=1e-15)
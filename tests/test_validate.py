@@ -0,0 +1,38 @@
+"""検証ゲートの窓指定のテスト。暦・ローリング窓のラベルと境界、任意の窓の
+walk-forward が窓ごとの run_backtest と同じメトリクスになること。"""
+from cta import validate
+from cta.engine import run_backtest
+from cta.market import MarketData
+from cta.metrics import compute_metrics
+from tests.test_engine import make_cfg
+from tests.test_market import _two_assets
+
+_ep = validate._ep
+
+
+def test_calendar_and_rolling_window_labels():
+    t0, t1 = _ep(2023, 11, 20), _ep(2024, 8, 5)
+    assert [w[0] for w in validate.calendar_windows(t0, t1)] == ["2023", "2024"]
+    q = validate.calendar_windows(t0, t1, 3)
+    assert [w[0] for w in q] == ["2023Q4", "2024Q1", "2024Q2", "2024Q3"]
+    assert q[1][1:] == (_ep(2024, 1), _ep(2024, 4))
+    r = validate.rolling_windows(t0, t1, 6, step_months=2)
+    assert [w[0] for w in r] == ["2023-12..2024-05", "2024-02..2024-07"]
+    assert r[0][1:] == (_ep(2023, 12), _ep(2024, 6))
+
+
+def test_walk_forward_with_custom_windows(tmp_path):
+    cfg = make_cfg(_two_assets(tmp_path), ["A", "B"])
+    market = MarketData.load(cfg)
+    t0, t1 = float(market.times[0]), float(market.times[-1])
+    windows = validate.calendar_windows(t0, t1, 1) + validate.rolling_windows(t0, t1, 1)
+    wf = validate.walk_forward(cfg, market=market, windows=windows)
+    assert list(wf) == ["2020-09", "2020-10", "2020-11", "2020-12",   # 両端は途中まで
+                        "2020-10..2020-10", "2020-11..2020-11"]
+    for label, a, b in windows:
+        if label in wf:
+            m = compute_metrics(run_backtest(cfg, start_epoch=a, end_epoch=b,
+                                             market=market), cfg.bars_per_year)
+            assert wf[label]["sharpe"] == m["sharpe"]
+            assert wf[label]["total_pnl"] == m["total_pnl"]
+    assert wf["2020-10"] == wf["2020-10..2020-10"]